@@ -20,6 +20,13 @@ function App() {
   const [fullBotResponse, setFullBotResponse] = useState('');
   const [visibleBotResponse, setVisibleBotResponse] = useState('');
   const [locationEnabled, setLocationEnabled] = useState(true);
+  const [sessionId] = useState(() => {
+    const saved = localStorage.getItem('sessionId');
+    if (saved) return saved;
+    const created = crypto.randomUUID();
+    localStorage.setItem('sessionId', created);
+    return created;
+  });
 
   const messagesEndRef = useRef(null);
   const popupRef = useRef();
@@ -84,7 +91,9 @@ function App() {
           .map(item => item.trim())
           .filter(item => item.length > 0),
           city: city,
-          name: namePopupInput
+          location: locationEnabled ? location : null,
+          name: namePopupInput,
+          session_id: sessionId
           }),
       });
 
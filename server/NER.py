@@ -1,14 +1,129 @@
 import spacy
 from spacy.pipeline import EntityRuler
+from spacy.language import Language
+from spacy.matcher import PhraseMatcher
+from spacy.tokens import Span
+from spacy.util import filter_spans
+from pathlib import Path
 import inflect
-from rag import graph
+import hashlib
+import json
+import os
+import re
+import shutil
+import tempfile
+import time
+from cypher_builder import parse_allergies, parse_location
 
-# This function will run once on app startup to establish entity ruler patterns based on the data from the neo4j knowledge graph
+# The built pipeline is saved here together with a fingerprint of the graph vocabulary it was built from
+NER_CACHE_DIR = os.getenv('NER_CACHE_DIR', 'ner_cache')
+# Bump this whenever the way patterns are built changes so saved pipelines get rebuilt
+PATTERN_VERSION = 3
+# written into every cache directory save_pipeline builds, it only ever deletes directories that have it
+CACHE_MARKER = ".ner_cache"
+CACHE_FILES = {CACHE_MARKER, "pipeline", "inflections.json", "fingerprint.json"}
+
+# surface form -> [singular, plural] for every ingredient and category, filled in by build_patterns
+inflections = {}
+
+# This function will run once on app startup to get the pipeline with entity ruler patterns based on the data from the neo4j knowledge graph
 # This ensures that any parameter that is in the knowledge graph will be recognized by the parser
+# The pipeline is only rebuilt when the vocabulary in the graph has changed since the saved one was built
 def build_patterns():
-    # initialize pluralizer
-    m = inflect.engine()
-    
+    start = time.perf_counter()
+    ingredients, origins, categories = fetch_vocabulary()
+    fingerprint = vocabulary_fingerprint(ingredients, origins, categories)
+
+    nlp = load_cached_pipeline(fingerprint)
+    if nlp is not None:
+        print(f"Loaded NER pipeline from {NER_CACHE_DIR} in {(time.perf_counter() - start) * 1000:.0f} ms")
+        return nlp
+
+    nlp = create_pipeline(ingredients, origins, categories)
+    save_pipeline(nlp, fingerprint)
+    print(f"Built NER pipeline from the graph in {(time.perf_counter() - start) * 1000:.0f} ms")
+    return nlp
+
+
+# Counts plus a hash of every name, along with anything else that changes the built pipeline
+def vocabulary_fingerprint(ingredients, origins, categories):
+    digest = hashlib.sha256()
+    for label, names in (("ingredient", ingredients), ("cuisine", origins), ("category", categories)):
+        digest.update(label.encode('utf-8'))
+        for name in sorted(set(names)):
+            digest.update(b"\0" + name.encode('utf-8'))
+    return {
+        "pattern_version": PATTERN_VERSION,
+        "spacy_version": spacy.__version__,
+        "counts": {"ingredients": len(ingredients), "cuisines": len(origins), "categories": len(categories)},
+        "hash": digest.hexdigest()
+    }
+
+
+def load_cached_pipeline(fingerprint):
+    try:
+        with open(os.path.join(NER_CACHE_DIR, "fingerprint.json"), encoding='utf-8') as f:
+            saved = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if saved != fingerprint:
+        return None
+    nlp = spacy.load(os.path.join(NER_CACHE_DIR, "pipeline"))
+    with open(os.path.join(NER_CACHE_DIR, "inflections.json"), encoding='utf-8') as f:
+        inflections.clear()
+        inflections.update(json.load(f))
+    return nlp
+
+
+# The cache is built in a new directory next to NER_CACHE_DIR and renamed into place, so a reader (or another
+# worker starting at the same time) sees either the old complete cache or the new one, never a half written one
+def save_pipeline(nlp, fingerprint):
+    cache_dir = os.path.abspath(NER_CACHE_DIR)
+    if os.path.exists(cache_dir) and not owned_cache_dir(cache_dir):
+        print(f"Not saving the NER pipeline, {cache_dir} exists and was not created by NER.py")
+        return
+    parent = os.path.dirname(cache_dir)
+    os.makedirs(parent, exist_ok=True)
+    new_dir = tempfile.mkdtemp(prefix=".ner_cache-new-", dir=parent)
+    old_dir = None
+    try:
+        open(os.path.join(new_dir, CACHE_MARKER), 'w').close()
+        nlp.to_disk(os.path.join(new_dir, "pipeline"))
+        with open(os.path.join(new_dir, "inflections.json"), 'w', encoding='utf-8') as f:
+            json.dump(inflections, f)
+        with open(os.path.join(new_dir, "fingerprint.json"), 'w', encoding='utf-8') as f:
+            json.dump(fingerprint, f)
+
+        if os.path.exists(cache_dir):
+            # a directory can only be renamed over an empty one, so move the old cache aside first
+            old_dir = tempfile.mkdtemp(prefix=".ner_cache-old-", dir=parent)
+            os.replace(cache_dir, old_dir)
+        os.replace(new_dir, cache_dir)
+    except OSError as e:
+        # the pipeline is still usable, it is just rebuilt again on the next start
+        print(f"Could not save the NER pipeline to {cache_dir}: {e}")
+        shutil.rmtree(new_dir, ignore_errors=True)
+        if old_dir is not None and not os.path.exists(cache_dir):
+            # put the old cache back when the new one could not be renamed into place
+            os.replace(old_dir, cache_dir)
+        elif old_dir is not None:
+            shutil.rmtree(old_dir, ignore_errors=True)
+        return
+    if old_dir is not None:
+        shutil.rmtree(old_dir, ignore_errors=True)
+
+
+def owned_cache_dir(path):
+    # caches saved before the marker was added hold only the cache files
+    entries = set(os.listdir(path)) if os.path.isdir(path) else None
+    return entries is not None and (CACHE_MARKER in entries or entries <= CACHE_FILES)
+
+
+# get the lowercased ingredient, cuisine and category names from neo4j
+def fetch_vocabulary():
+    # imported here so the pattern helpers can be used (e.g. by benchmark_ner.py) without a database connection
+    from rag import graph
+
     # get list of ingredients from neo4j to store as patterns
     ingredients_query = """
     MATCH (i:Ingredient)
@@ -32,94 +147,196 @@ def build_patterns():
     """
     records = graph.query(category_query)
     categories = [record['value'].lower() for record in records]
-    
+
+    return ingredients, origins, categories
+
+
+# patterns for ratings/diet that do not come from the graph
+BASE_PATTERNS = [
+    {"label": "RATING_VALUE", "pattern": [{"LIKE_NUM": True}, {"LOWER": "stars"}]},
+    {"label": "RATING_VALUE", "pattern": [{"LIKE_NUM": True}, {"LOWER": "star"}]},
+    {"label": "RATING_VALUE", "pattern": [{"LIKE_NUM": True}, {"TEXT": "★"}]},
+
+    {"label": "DIET_LABEL", "pattern": [{"LOWER": "healthy"}]},
+    {"label": "DIET_LABEL", "pattern": [{"LOWER": "vegan"}]},
+    {"label": "DIET_LABEL", "pattern": [{"LOWER": "vegetarian"}]},
+]
+
+
+# "what can I make with ...", "I have ... in my fridge": the listed ingredients are a pantry to cook from,
+# not a search term, see recipe_index.py. Only explicit phrasings count, "I have chicken, any curry ideas?" is a search
+PANTRY_PHRASES = re.compile(
+    r"\b(what (can|could) i (make|cook|bake) with|in my (pantry|fridge)|use up)\b",
+    re.IGNORECASE
+)
+
+# Restaurant questions about the user's surroundings, searched within a radius of the position the client sends
+NEARBY_PHRASES = re.compile(r"\b(near me|nearby|near here|close by|close to me|around me|around here|walking distance)\b", re.IGNORECASE)
+RADIUS = re.compile(r"\bwithin\s+(?:a\s+)?(\d+(?:\.\d+)?)?\s*(miles?|mi|kilometers?|kilometres?|km)\b", re.IGNORECASE)
+NEARBY_RADIUS_MILES = float(os.getenv('RESTAURANT_RADIUS_MILES', '5'))
+MILES_PER_KM = 0.621371
+
+
+# Map every singular and plural surface form of each name to its [singular, plural] pair
+# This runs once at build time so requests never have to call inflect
+def build_inflections(names, m):
+    table = {}
+    for name in names:
+        singular = m.singular_noun(name) # m.singular_noun(x) returns false if x is already singular
+        if not singular:
+            singular, plural = name, m.plural(name)
+        else:
+            plural = name
+        table[singular] = [singular, plural]
+        table[plural] = [singular, plural]
+    return table
+
+
+# Every surface form for each label, ingredients and categories in both singular and plural
+def vocabulary_phrases(ingredients, origins, categories, table):
+    phrases = {"CUISINE": sorted(set(origins))}
+    for label, names in (("INGREDIENT", ingredients), ("CATEGORY", categories)):
+        forms = set()
+        for name in names:
+            forms.update(table[name])
+        phrases[label] = sorted(forms)
+    return phrases
+
+
+# Pipeline component that tags every vocabulary phrase with a PhraseMatcher on lowercase text
+# Unlike one token pattern per form this matches multi word names like "olive oil", and unlike the
+# entity ruler's phrase patterns it does not keep a Doc per phrase in memory
+@Language.factory("vocabulary_matcher")
+class VocabularyMatcher(object):
+    def __init__(self, nlp, name):
+        self.nlp = nlp
+        self.name = name
+        self.matcher = PhraseMatcher(nlp.vocab, attr="LOWER")
+        self.phrases = {}
+
+    def add(self, label, phrases, batch_size=10000):
+        phrases = list(phrases)
+        self.phrases.setdefault(label, []).extend(phrases)
+        for i in range(0, len(phrases), batch_size):
+            self.matcher.add(label, list(self.nlp.tokenizer.pipe(phrases[i:i + batch_size])))
+
+    def __len__(self):
+        return sum(len(phrases) for phrases in self.phrases.values())
+
+    def __call__(self, doc):
+        matches = [Span(doc, start, end, label=match_id) for match_id, start, end in self.matcher(doc)]
+        # longest match wins and entities set earlier in the pipeline (ratings, diet labels) are kept
+        taken = set()
+        for ent in doc.ents:
+            taken.update(range(ent.start, ent.end))
+        new_ents = [span for span in filter_spans(matches) if not taken.intersection(range(span.start, span.end))]
+        doc.ents = list(doc.ents) + new_ents
+        return doc
+
+    def to_disk(self, path, exclude=tuple()):
+        path = Path(path)
+        path.mkdir(parents=True, exist_ok=True)
+        with open(path / "phrases.json", 'w', encoding='utf-8') as f:
+            json.dump(self.phrases, f)
+
+    def from_disk(self, path, exclude=tuple()):
+        with open(Path(path) / "phrases.json", encoding='utf-8') as f:
+            for label, phrases in json.load(f).items():
+                self.add(label, phrases)
+        return self
+
+
+def add_vocabulary_matcher(nlp, phrases):
+    matcher = nlp.add_pipe("vocabulary_matcher", before="ner")
+    for label, forms in phrases.items():
+        matcher.add(label, forms)
+    return matcher
+
+
+# Build the spacy pipeline with an entity ruler for ratings/diet and a phrase matcher for every name in the vocabulary
+def create_pipeline(ingredients, origins, categories):
+    # initialize pluralizer
+    m = inflect.engine()
+    table = build_inflections(set(ingredients) | set(categories), m)
+
     # load spacy model and create entity ruler
     nlp = spacy.load("en_core_web_sm")
     ruler = nlp.add_pipe("entity_ruler", before="ner")
+    ruler.add_patterns(BASE_PATTERNS)
+    add_vocabulary_matcher(nlp, vocabulary_phrases(ingredients, origins, categories, table))
+
+    inflections.clear()
+    inflections.update(table)
     
-    # establish patterns for ratings/diet
-    patterns = [
-        {"label": "RATING_VALUE", "pattern": [{"LIKE_NUM": True}, {"LOWER": "stars"}]},
-        {"label": "RATING_VALUE", "pattern": [{"LIKE_NUM": True}, {"LOWER": "star"}]},
-        {"label": "RATING_VALUE", "pattern": [{"LIKE_NUM": True}, {"TEXT": "★"}]},
-
-        {"label": "DIET_LABEL", "pattern": [{"LOWER": "healthy"}]},
-        {"label": "DIET_LABEL", "pattern": [{"LOWER": "vegan"}]},
-        {"label": "DIET_LABEL", "pattern": [{"LOWER": "vegetarian"}]},
-    ]
-    
-    # add pattern for every origin in the list from neo4j
-    for origin in origins:
-        patterns.append({"label": "CUISINE", "pattern": [{"LOWER": f"{origin}"}]})
-    
-    # add pattern for ingredients
-    for ingredient in ingredients:
-        
-        # generalize patterns by including both plural and singular form
-        if(not m.singular_noun(ingredient)): # m.singular_noun(x) returns false if x is already singular
-            # ingredient is singular, add it and its plural form to pattern
-            patterns.append({"label": "INGREDIENT", "pattern": [{"LOWER": f"{ingredient}"}]})
-            patterns.append({"label": "INGREDIENT", "pattern": [{"LOWER": f"{m.plural(ingredient)}"}]})
-        else: # ingredient is in plural form
-            #add it and its singular form to pattern
-            patterns.append({"label": "INGREDIENT", "pattern": [{"LOWER": f"{m.singular_noun(ingredient)}"}]})
-            patterns.append({"label": "INGREDIENT", "pattern": [{"LOWER": f"{ingredient}"}]})
-    
-    # add pattern for every category in the list from neo4j
-    for category in categories:
-        # generalize patterns 
-        if(not m.singular_noun(category)): # category is in singular form
-            patterns.append({"label": "CATEGORY", "pattern": [{"LOWER": f"{category}"}]})
-            patterns.append({"label": "CATEGORY", "pattern": [{"LOWER": f"{m.plural(category)}"}]})
-        else: # category is in plural form
-            patterns.append({"label": "CATEGORY", "pattern": [{"LOWER": f"{m.singular_noun(category)}"}]})
-            patterns.append({"label": "CATEGORY", "pattern": [{"LOWER": f"{category}"}]})
-
-    # apply patterns to entity ruler
-    ruler.add_patterns(patterns)
-    
-    # return the language object which now includes patterns from entity ruler
+    # return the language object which now includes the entity ruler and vocabulary matcher
     return nlp
 
 
+# Both the singular and plural form of each ingredient in an explicit list, the graph may store either
+# The list can also come as comma separated text, like the allergies
+def inflect_ingredients(names):
+    if isinstance(names, str):
+        names = names.split(',')
+    forms = []
+    for name in names:
+        name = name.strip().lower()
+        if name:
+            forms.extend(inflections.get(name, [name]))
+    return list(dict.fromkeys(forms))
+
+
 # This function will use the doc object (list of individual words/entities) to extract key information from a user query
 # This will be called any time the user asks a question about recipes
 # Return value is a dictionary of the key information: category, cuisine, ingredients, and allergies
 def extract_recipe_criteria(doc, allergies):
+    # the client sends allergies as typed, "peanuts" has to exclude an Ingredient named "Peanut" too
+    allergies = inflect_ingredients(parse_allergies(allergies))
     # initialize variables and pluralizer
     cuisine = []
     ingredients = []
     category = []
-    m = inflect.engine()
+    diet = []
+    time = []
 
     # check each entity in doc object and add to its respective list based on its label
     for ent in doc.ents:
         if ent.label_ == "CUISINE":
             cuisine.append(ent.text.capitalize())
         elif ent.label_ == "INGREDIENT":
+            singular, plural = inflections.get(ent.text.lower(), [ent.lemma_, ent.text.lower()])
             # if ingredient, add any non allergen to list
-            if ent.label_ not in allergies and m.plural(ent.lemma_) not in allergies:
-                # add both singular and plural version to list. ent.lemma_ is the base singular form of the word
-                ingredients.append(ent.lemma_)
-                ingredients.append(m.plural(ent.lemma_))
+            if singular not in allergies and plural not in allergies:
+                # add both singular and plural version to list
+                ingredients.append(singular)
+                ingredients.append(plural)
         elif ent.label_ == "CATEGORY":
             # add both singular and plural version to list
-            category.append(ent.lemma_)
-            category.append(m.plural(ent.lemma_))
+            singular, plural = inflections.get(ent.text.lower(), [ent.lemma_, ent.text.lower()])
+            category.append(singular)
+            category.append(plural)
+        elif ent.label_ == "DIET_LABEL":
+            diet.append(ent.text.lower())
+        elif ent.label_ == "TIME":
+            time.append(ent.text)
 
     # return dict holding criteria
-    return {
+    criteria = {
         "category": category,
         "cuisine": cuisine,
         "ingredients": ingredients,
-        "allergies": allergies
+        "allergies": allergies,
+        "diet": diet,
+        "time": time
     }
+    if ingredients and PANTRY_PHRASES.search(doc.text):
+        criteria["pantry"] = True
+    return criteria
     
     
 # This function will use the doc object (list of individual words/entities) to extract key information from a user query
 # This will be called any time the user asks a question about restaurants
 # Return value is a dictionary of the key information: cuisine, rating, time, and allergies
-def extract_restaurant_criteria(doc, city):
+def extract_restaurant_criteria(doc, city, location=None):
     # initialize variables
     cuisine = []
     rating = None
@@ -137,10 +354,25 @@ def extract_restaurant_criteria(doc, city):
         elif ent.label_ == "CUISINE":
             cuisine = ent.text.capitalize()
 
-    # return dict holding criteria
-    return {
+    criteria = {
         "cuisine": cuisine,
         "min_rating": rating,
         "max_time": time,
         "city": city
-    }
\ No newline at end of file
+    }
+    # "near me" or "within 5 miles" turns into a radius around the user, when the client sent where they are
+    position = parse_location(location)
+    radius = RADIUS.search(doc.text)
+    if position and (radius or NEARBY_PHRASES.search(doc.text)):
+        criteria["latitude"], criteria["longitude"] = position
+        criteria["radius_miles"] = radius_miles(radius) if radius else NEARBY_RADIUS_MILES
+    # return dict holding criteria
+    return criteria
+
+
+def radius_miles(match):
+    # "within a mile" has no number
+    distance = float(match.group(1) or 1)
+    if match.group(2).lower().startswith("k"):
+        distance *= MILES_PER_KM
+    return distance
\ No newline at end of file
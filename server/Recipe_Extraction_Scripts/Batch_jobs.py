@@ -0,0 +1,153 @@
+import argparse
+import hashlib
+import json
+import os
+import time
+from langchain_core.messages import AIMessage
+
+# Batch mode for the extraction scripts: instead of calling the LLM, every chain call becomes one line of an
+# OpenAI Batch API request file, and a later run answers the same calls from the results file.
+# The custom ids are a hash of the request body, so the same prompt on the same input always gets the same id,
+# however the files are ordered or split between runs.
+#
+#   python Csv_extractor.py data --batch-requests requests.jsonl --batch-results results.jsonl
+#   (submit requests.jsonl to the provider, or: python Batch_jobs.py requests.jsonl results.jsonl)
+#   python Csv_extractor.py data --batch-requests requests.jsonl --batch-results results.jsonl
+#
+# Each run ingests every recipe whose calls all have results and rewrites the request file with the calls that
+# are still missing, so it can be repeated as results trickle in. Calls that depend on an earlier answer
+# (a field ReadFromURL asks for again after it failed validation) are requested in the following round.
+
+ROLES = {"system": "system", "human": "user", "ai": "assistant"}
+
+
+class ResultPending(Exception):
+    """Raised by BatchJob.invoke when the call has been queued and its result is not in yet."""
+
+
+def gather(*calls):
+    """Run every call even if some are pending, so all their requests are queued in the same round."""
+    results = []
+    pending = None
+    for call in calls:
+        try:
+            results.append(call())
+        except ResultPending as e:
+            pending = e
+            results.append(None)
+    if pending is not None:
+        raise pending
+    return results
+
+
+def custom_id(body):
+    return "req-" + hashlib.sha256(json.dumps(body, sort_keys=True).encode()).hexdigest()[:32]
+
+
+class BatchJob(object):
+    """Stands in for LLMWorkerPool in the extraction scripts (same invoke/map/stats interface)."""
+
+    def __init__(self, results_paths=None):
+        self.requests = {}
+        self.results = {}
+        self.failed = 0
+        for path in results_paths or []:
+            self.load_results(path)
+
+    def load_results(self, path):
+        if not os.path.exists(path):
+            return
+        with open(path, encoding='utf-8') as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                record = json.loads(line)
+                response = record.get("response") or {}
+                if record.get("error") or response.get("status_code") != 200:
+                    # failed calls are requested again in the next request file
+                    self.failed += 1
+                    continue
+                self.results[record["custom_id"]] = response["body"]["choices"][0]["message"]["content"]
+
+    def request_body(self, chain, inputs):
+        prompt, llm = chain.first, chain.steps[1]
+        messages = [{"role": ROLES[m.type], "content": m.content} for m in prompt.format_messages(**inputs)]
+        # a model bound with llm.bind(response_format=...) sends its bound arguments along
+        return dict(getattr(llm, "kwargs", {}), model=llm.model_name, temperature=llm.temperature, messages=messages)
+
+    def invoke(self, chain, inputs):
+        body = self.request_body(chain, inputs)
+        request_id = custom_id(body)
+        if request_id not in self.results:
+            self.requests[request_id] = {"custom_id": request_id, "method": "POST", "url": "/v1/chat/completions", "body": body}
+            raise ResultPending(request_id)
+
+        # run the answer through whatever follows the model in the chain (e.g. the output parser)
+        value = AIMessage(content=self.results[request_id])
+        for step in chain.steps[2:]:
+            value = step.invoke(value)
+        return value
+
+    def map(self, fn, items):
+        return [fn(item) for item in items]
+
+    def write_requests(self, path):
+        with open(path, 'w', encoding='utf-8') as f:
+            for request in self.requests.values():
+                f.write(json.dumps(request) + "\n")
+        return len(self.requests)
+
+    def stats(self):
+        return {"answered": len(self.results), "pending": len(self.requests), "failed": self.failed}
+
+
+class ChatCompletions(object):
+    # lets LLMWorkerPool.invoke rate limit raw request bodies
+    def __init__(self, client):
+        self.client = client
+
+    def invoke(self, body):
+        return self.client.chat.completions.create(**body)
+
+
+def run_requests(requests_path, results_path, pool, client, limit=None):
+    """Local batch runner: answers the requests that have no result yet and appends them to the results file."""
+    done = set()
+    if os.path.exists(results_path):
+        with open(results_path, encoding='utf-8') as f:
+            done = {r["custom_id"] for r in map(json.loads, filter(str.strip, f)) if not r.get("error")}
+    with open(requests_path, encoding='utf-8') as f:
+        requests = [json.loads(line) for line in f if line.strip()]
+    requests = [r for r in requests if r["custom_id"] not in done][:limit]
+
+    completions = ChatCompletions(client)
+
+    def answer(request):
+        try:
+            response = pool.invoke(completions, request["body"])
+            return {"id": f"batch_req_{request['custom_id']}", "custom_id": request["custom_id"],
+                    "response": {"status_code": 200, "body": response.model_dump()}, "error": None}
+        except Exception as e:
+            return {"id": f"batch_req_{request['custom_id']}", "custom_id": request["custom_id"],
+                    "response": None, "error": {"message": str(e)}}
+
+    with open(results_path, 'a', encoding='utf-8') as f:
+        for result in pool.map(answer, requests):
+            f.write(json.dumps(result) + "\n")
+    return len(requests)
+
+
+if __name__ == "__main__":
+    from openai import OpenAI
+    from LLM_pool import LLMWorkerPool
+
+    parser = argparse.ArgumentParser(description="Answer a batch request file locally, e.g. against Fake_LLM_server.py.")
+    parser.add_argument("requests", help="JSONL request file written by an extraction script")
+    parser.add_argument("results", help="JSONL results file, new results are appended")
+    parser.add_argument("--base-url", default=os.getenv("OPENAI_BASE_URL", "http://127.0.0.1:8100/v1"))
+    parser.add_argument("--limit", type=int, default=None, help="Only answer this many requests, to try partial results")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    answered = run_requests(args.requests, args.results, LLMWorkerPool(), OpenAI(base_url=args.base_url, api_key=os.getenv("OPENAI_API_KEY", "fake"), max_retries=0), args.limit)
+    print(f"Answered {answered} requests in {time.perf_counter() - start:.1f} s, results in {args.results}")
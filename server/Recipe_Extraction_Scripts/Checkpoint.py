@@ -0,0 +1,32 @@
+import json
+import os
+
+
+def write_json_atomic(path, data):
+    # write to a temporary file and swap it in, so a crash mid-write leaves the previous version intact
+    tmp_path = path + ".tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+class Checkpoint(object):
+    """Position of a resumable ingestion run, e.g. {"file": "recipes.csv", "row": 4200}."""
+
+    def __init__(self, path):
+        self.path = path
+
+    def load(self):
+        if not os.path.exists(self.path):
+            return None
+        with open(self.path, encoding='utf-8') as f:
+            return json.load(f)
+
+    def save(self, position):
+        write_json_atomic(self.path, position)
+
+    def clear(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
@@ -0,0 +1,150 @@
+import argparse
+import json
+import os
+import random
+import re
+import threading
+import time
+from collections import Counter
+from langchain_core.messages import AIMessage
+import ReadFromURL
+from Ingredient_parser import parse_line
+from Recipe_schema import FIELDS
+
+# Compares the single structured output call per recipe against the old three chains (ingredients, instructions,
+# then fill_missing_fields) on the same pages, with a fake in-process model that counts tokens instead of the API.
+# Latency is modelled per call from the token counts, the calls of one recipe run one after another.
+#
+#   python Compare_extraction.py saved_pages            (a directory of .html pages, e.g. Fixture_server's)
+#   python Compare_extraction.py --from-cache --limit 200 --invalid 0.1
+
+
+def tokens(text):
+    # same estimate as Fake_LLM_server, about four characters a token
+    return len(text) // 4 + 1
+
+
+def numbered(text):
+    steps = [step.strip() for step in re.split(r"(?<=[.!?])\s+", " ".join(text.split())) if step.strip()]
+    return " ".join(f"{i}. {step}" for i, step in enumerate(steps, 1))
+
+
+class CountingFakeLLM(object):
+    """Stands in for the worker pool: answers each chain with a plausible reply and counts calls and tokens.
+    invalid is the share of structured answers that come back with one field broken, to exercise the retries."""
+
+    def __init__(self, call_ms=400.0, prompt_token_ms=0.2, completion_token_ms=12.0, invalid=0.0, seed=0):
+        self.call_ms = call_ms
+        self.prompt_token_ms = prompt_token_ms
+        self.completion_token_ms = completion_token_ms
+        self.invalid = invalid
+        self.random = random.Random(seed)
+        self.counts = Counter()
+        self.lock = threading.Lock()
+
+    def reset(self):
+        with self.lock:
+            self.counts = Counter()
+
+    def reply(self, chain, text):
+        if chain is ReadFromURL.chain:
+            return ", ".join(name.title() for name, _ in map(parse_line, text.splitlines()) if name)
+        if chain is ReadFromURL.chain_instructions:
+            return numbered(text)
+        if chain is ReadFromURL.fill_fields_chain:
+            return json.dumps({"Category": "Main Course", "Cuisine": "American", "Difficulty": "Easy"})
+
+        ingredients, _, instructions = text.partition("\nInstructions:\n")
+        answer = {
+            "ingredients_list": [parse_line(line[2:])[0] or line[2:] for line in ingredients.splitlines() if line.startswith("* ")],
+            "instructions": numbered(instructions),
+            "category": "Main Course",
+            "cuisine": "American",
+            "difficulty": "Easy",
+        }
+        if chain is ReadFromURL.recipe_chain:
+            if self.random.random() < self.invalid:
+                answer[self.random.choice(list(FIELDS))] = ""
+            return json.dumps(answer)
+        field = next(field for field, field_chain in ReadFromURL.field_chains.items() if field_chain is chain)
+        return json.dumps({field: answer[field]})
+
+    def invoke(self, chain, inputs):
+        prompt = "".join(m.content for m in chain.first.format_messages(**inputs))
+        content = self.reply(chain, inputs["input"])
+        prompt_tokens, completion_tokens = tokens(prompt), tokens(content)
+        with self.lock:
+            self.counts["calls"] += 1
+            self.counts["prompt_tokens"] += prompt_tokens
+            self.counts["completion_tokens"] += completion_tokens
+            self.counts["latency_ms"] += (self.call_ms + prompt_tokens * self.prompt_token_ms
+                                          + completion_tokens * self.completion_token_ms)
+
+        value = AIMessage(content=content)
+        for step in chain.steps[2:]:
+            value = step.invoke(value)
+        return value
+
+    def map(self, fn, items):
+        return [fn(item) for item in items]
+
+    def stats(self):
+        with self.lock:
+            return dict(self.counts)
+
+
+def read_pages(args):
+    if args.from_cache:
+        urls = ReadFromURL.page_cache.urls()[:args.limit]
+        return [(url, ReadFromURL.page_cache.get(url).html) for url in urls]
+    pages = []
+    for name in sorted(f for f in os.listdir(args.directory) if f.endswith(".html"))[:args.limit]:
+        with open(os.path.join(args.directory, name), encoding="utf-8") as f:
+            pages.append((f"http://localhost/{name}", f.read()))
+    return pages
+
+
+def run(fake, pages, single_call):
+    fake.reset()
+    start = time.perf_counter()
+    recipes = 0
+    for url, html in pages:
+        try:
+            ReadFromURL.extract_recipe(html, url, single_call=single_call)
+            recipes += 1
+        except Exception as e:
+            print(f"Skipped {url}: {e}")
+    stats = fake.stats()
+    stats["recipes"] = recipes
+    stats["local_ms"] = (time.perf_counter() - start) * 1000
+    return stats
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare one structured extraction call per recipe with the old three calls.")
+    parser.add_argument("directory", nargs="?", help="Directory of saved .html recipe pages")
+    parser.add_argument("--from-cache", action="store_true", help="Use the pages in the page cache instead")
+    parser.add_argument("--limit", type=int, help="Only use the first N pages")
+    parser.add_argument("--invalid", type=float, default=0.0, help="Share of structured answers with a broken field")
+    parser.add_argument("--call-ms", type=float, default=400.0, help="Modelled fixed latency of a call")
+    args = parser.parse_args()
+    if not args.directory and not args.from_cache:
+        parser.error("give a directory of pages or --from-cache")
+
+    pages = read_pages(args)
+    fake = CountingFakeLLM(call_ms=args.call_ms, invalid=args.invalid)
+    ReadFromURL.llm_pool = fake
+
+    three = run(fake, pages, single_call=False)
+    one = run(fake, pages, single_call=True)
+
+    print(f"{len(pages)} pages, {one['recipes']} extracted")
+    print(f"{'':>14} {'calls':>7} {'prompt tok':>10} {'output tok':>10} {'LLM ms':>8}   (per recipe)")
+    for name, stats in (("three calls", three), ("single call", one)):
+        n = max(stats["recipes"], 1)
+        print(f"{name:>14} {stats.get('calls', 0) / n:>7.2f} {stats.get('prompt_tokens', 0) / n:>10.0f} "
+              f"{stats.get('completion_tokens', 0) / n:>10.0f} {stats.get('latency_ms', 0) / n:>8.0f}")
+    for key in ("calls", "prompt_tokens", "latency_ms"):
+        if three.get(key):
+            print(f"{key}: {1 - one.get(key, 0) / three[key]:.0%} fewer with the single call")
+    print(f"Field retries: {dict(ReadFromURL.field_retries)}")
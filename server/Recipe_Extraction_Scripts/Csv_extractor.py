@@ -6,14 +6,39 @@ from dotenv import load_dotenv
 from neo4j import GraphDatabase
 from langchain_core.output_parsers import CommaSeparatedListOutputParser
 import csv
+from Neo4j_writer import BulkRecipeWriter, DEFAULT_FACETS
+from LLM_pool import LLMWorkerPool
+from Batch_jobs import BatchJob, ResultPending, gather
+from Checkpoint import Checkpoint
+from Extraction_cache import CachedPool, ExtractionCache
+from Manifest import Manifest, file_hash, report
+from Ingredient_parser import IngredientParser, merge_names
+from collections import Counter
+import argparse
 
 load_dotenv()
 
+# CSV recipes store servings as Servings nodes and link categories with BELONGS_TO
+FACETS = dict(DEFAULT_FACETS, **{
+    "Yield": ("Servings", "SERVES"),
+    "Category": ("Category", "BELONGS_TO"),
+})
+
+# retries are left to the worker pool so 429s back off across all workers together
 llm = ChatOpenAI(
     model="gpt-4o-mini",
-    temperature=0
+    temperature=0,
+    max_retries=0
 )
 
+# calls already made with the same prompt and input are answered from disk
+llm_pool = CachedPool(LLMWorkerPool(), ExtractionCache())
+ingredient_parser = IngredientParser()
+
+# Rows are parsed and written this many at a time, it bounds both memory and the work lost to a crash
+CHUNK_SIZE = int(os.getenv('CSV_CHUNK_SIZE', '100'))
+CHECKPOINT_PATH = os.getenv('CSV_CHECKPOINT_PATH', 'csv_checkpoint.json')
+
 parser = CommaSeparatedListOutputParser()
 
 prompt = ChatPromptTemplate.from_messages([
@@ -42,45 +67,101 @@ chain_instructions = prompt2 | llm
 
 def parse_instructions(instructions_text):
     """Parse the instructions text using the Groq model."""
-    result = chain_instructions.invoke({"input": instructions_text})
+    result = llm_pool.invoke(chain_instructions, {"input": instructions_text})
     return result.content.strip()
 
 def parse_ingredients(ingredients_text):
-    """Parse the ingredients text using the Groq model."""
-    result = chain.invoke({"input": ingredients_text})
-    result = result[1:]
-    result = [item.lstrip('- ').strip() for item in result]
-    return result
-
-def process_files_in_directory(directory_path):
-    results = []
-    
-    for filename in os.listdir(directory_path):
-        if not filename.endswith(".csv"):
+    """Parse the ingredient lines with the local rules, only the lines they are unsure about go to the Groq model."""
+    names, unsure = ingredient_parser.parse(ingredients_text)
+    if not unsure:
+        return names
+    return merge_names(names, llm_pool.invoke(chain, {"input": "\n".join(unsure)}))
+
+def parse_row(row):
+    ingredients_text = row.get("ingredients", "")
+    instructions_text = row.get("directions", "")
+
+    try:
+        parsed_ingredients, parsed_instructions = gather(
+            lambda: parse_ingredients(ingredients_text) if ingredients_text else [],
+            lambda: parse_instructions(instructions_text) if instructions_text else ""
+        )
+    except ResultPending:
+        # batch mode, the row is ingested once its results are in
+        return None
+    category = row.get("cuisine_path", "")
+    parts = category.split('/')
+    category = parts[1]
+    cuisine = row.get("cuisine", "")
+    difficulty = row.get("difficulty", "")
+    return {"Category":category, "Cuisine": cuisine, "Difficulty":difficulty, "Recipe Name": row.get("recipe_name", ''), "Ingredients": row.get("ingredients",''), "Instructions": parsed_instructions, "Yield": row.get('servings',''), "Total Time": row.get("total_time",''), "Nutrition": row.get("nutrition",''), "Ingredients_list": parsed_ingredients}
+
+def iter_rows(directory_path, filenames, start=None):
+    """Yield (filename, row offset, row) for every row of the given CSV files, from the checkpoint position on if one is given."""
+    for filename in filenames:
+        if start and filename < start["file"]:
             continue
-        
+        skip = start["row"] if start and filename == start["file"] else 0
+
         file_path = os.path.join(directory_path, filename)
         with open(file_path, newline='', encoding='utf-8') as csvfile:
-            reader = csv.DictReader(csvfile)
-
-            
-            
-            for row in reader:
-                ingredients_text = row.get("ingredients", "")
-                instructions_text = row.get("directions", "")
-
-                
-                parsed_ingredients = parse_ingredients(ingredients_text) if ingredients_text else []
-                parsed_instructions = parse_instructions(instructions_text) if instructions_text else ""
-                category = row.get("cuisine_path", "")
-                parts = category.split('/')
-                category = parts[1]
-                cuisine = row.get("cuisine", "")
-                difficulty = row.get("difficulty", "")
-                results.append({"Category":category, "Cuisine": cuisine, "Difficulty":difficulty, "Recipe Name": row.get("recipe_name", ''), "Ingredients": row.get("ingredients",''), "Instructions": parsed_instructions, "Yield": row.get('servings',''), "Total Time": row.get("total_time",''), "Nutrition": row.get("nutrition",''), "Ingredients_list": parsed_ingredients})
-                print(len(results))
-
-    return results
+            for offset, row in enumerate(csv.DictReader(csvfile)):
+                if offset >= skip:
+                    yield filename, offset, row
+
+def iter_chunks(items, size):
+    chunk = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+def process_files_in_directory(directory_path, writer, checkpoint=None, manifest=None, chunk_size=CHUNK_SIZE):
+    """Parse and write the rows one chunk at a time so memory stays flat however large the input is.
+    The checkpoint moves past a chunk only once it is in Neo4j, so a rerun starts at the first unwritten row.
+    With a manifest, files and recipes that have not changed since they were last written are skipped."""
+    summary = Counter()
+    filenames = sorted(f for f in os.listdir(directory_path) if f.endswith(".csv"))
+    hashes = {f: file_hash(os.path.join(directory_path, f)) for f in filenames}
+    changed = [f for f in filenames if manifest is None or manifest.file_changed(os.path.join(directory_path, f), hashes[f])]
+    summary["files_skipped"] = len(filenames) - len(changed)
+    summary["files_processed"] = len(changed)
+
+    start = checkpoint.load() if checkpoint else None
+    if start:
+        print(f"Resuming at {start['file']} row {start['row']}")
+
+    pending_files = set()
+    for chunk in iter_chunks(iter_rows(directory_path, changed, start), chunk_size):
+        # rows are parsed concurrently on the pool, map keeps them in file order
+        recipes = []
+        for (filename, _, _), recipe in zip(chunk, llm_pool.map(parse_row, [row for _, _, row in chunk])):
+            if recipe is None:
+                pending_files.add(filename)
+            else:
+                recipes.append(recipe)
+
+        if manifest:
+            changed_recipes = manifest.changed_recipes(recipes)
+            summary["recipes_unchanged"] += len(recipes) - len(changed_recipes)
+            recipes = changed_recipes
+        writer.write(recipes)
+        if manifest:
+            manifest.record_recipes(recipes)
+        summary["recipes_written"] += len(recipes)
+
+        filename, offset, _ = chunk[-1]
+        if checkpoint:
+            checkpoint.save({"file": filename, "row": offset + 1})
+        print(f"{summary['recipes_written']} recipes written, up to {filename} row {offset + 1}, LLM calls: {llm_pool.stats()}")
+
+    # a file only counts as done once none of its rows are waiting on batch results
+    if manifest:
+        manifest.record_files({os.path.join(directory_path, f): hashes[f] for f in changed if f not in pending_files})
+    return summary
 
 def init_neo4j_driver():
     uri = os.getenv('NEO4J_URI')  
@@ -94,83 +175,42 @@ def init_neo4j_driver():
 def close_neo4j_driver(driver):
     driver.close()
 
-def create_recipe(driver, recipe):
-    query = """
-    MERGE (r:Recipe {name: $name})
-    SET r.instructions = $instructions
-    SET r.ingredients = $ingredients
-    """
-    parameters = {
-        "name": recipe["Recipe Name"],
-        "instructions": recipe["Instructions"],
-        "ingredients": recipe["Ingredients"]
-    }
-
-    with driver.session() as session:
-        session.run(query, parameters)
-
-def create_ingredients(driver, recipe_name, ingredients):
-    for name in ingredients:
-        query = """
-        MERGE (i:Ingredient {name: $ingredient_name})
-        WITH i
-        MATCH (r:Recipe {name: $recipe_name})
-        MERGE (r)-[:CONTAINS]->(i)
-        """
-        with driver.session() as session:
-            session.run(query, ingredient_name=name.lower(), recipe_name=recipe_name)
-
-def create_optional_field(driver, recipe_name, field_value, node_label, relationship_type):
-    query = f"""
-    MERGE (n:{node_label} {{value: $field_value}})
-    WITH n
-    MATCH (r:Recipe {{name: $recipe_name}})
-    MERGE (r)-[:{relationship_type}]->(n)
-    """
-    
-    parameters = {
-        "recipe_name": recipe_name,
-        "field_value": field_value,
-        "node_label": node_label, 
-        "relationship_type": relationship_type
-    }
-
-    with driver.session() as session:
-        session.run(query, parameters)
-
 def save_results_to_neo4j(data):
     driver = init_neo4j_driver()
-    for recipe in data:
-        create_recipe(driver, recipe)
-        
-        create_ingredients(driver, recipe["Recipe Name"], recipe["Ingredients_list"])
-
-        if recipe["Total Time"] != '':
-            create_optional_field(driver, recipe["Recipe Name"], recipe["Total Time"], "TotalTime", "HAS_TOTAL_TIME")
-        
-        if recipe["Yield"] != '':
-            create_optional_field(driver, recipe["Recipe Name"], recipe["Yield"], "Servings", "SERVES")
-        
-        if recipe["Nutrition"] != '':
-            create_optional_field(driver, recipe["Recipe Name"], recipe["Nutrition"], "Nutrition", "HAS_NUTRITION")
-        
-        if recipe["Category"] != '':
-            create_optional_field(driver, recipe["Recipe Name"], recipe["Category"], "Category", "BELONGS_TO")
-        
-        if recipe["Cuisine"] != '':
-            create_optional_field(driver, recipe["Recipe Name"], recipe["Cuisine"], "Cuisine", "HAS_CUISINE")
-        
-        if recipe["Difficulty"] != '':
-            create_optional_field(driver, recipe["Recipe Name"], recipe["Difficulty"], "Difficulty", "HAS_DIFFICULTY")
-        
-        print("Added recipe to Neo4j.")
-    
+    BulkRecipeWriter(driver, FACETS).write(data)
     close_neo4j_driver(driver)
         
 
-directory_path = r"C:\Users\lalit\Desktop\DeepDish-AI\server\data"  
-output_file = "standardized_recipes.json"
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Parse recipe CSV files and ingest them into Neo4j.")
+    parser.add_argument("directory", nargs="?", default=r"C:\Users\lalit\Desktop\DeepDish-AI\server\data")
+    parser.add_argument("--batch-requests", help="Batch mode: write the LLM calls still missing a result to this JSONL file")
+    parser.add_argument("--batch-results", action="append", help="Batch mode: JSONL results file(s) to answer calls from")
+    parser.add_argument("--checkpoint", default=CHECKPOINT_PATH, help="File recording the last written row, a rerun resumes after it")
+    parser.add_argument("--restart", action="store_true", help="Ignore the checkpoint and start from the first row")
+    parser.add_argument("--force", action="store_true", help="Forget the ingestion manifest and rewrite every recipe")
+    args = parser.parse_args()
+
+    checkpoint = Checkpoint(args.checkpoint)
+    if args.restart:
+        checkpoint.clear()
+    manifest = Manifest()
+    if args.force:
+        manifest.clear()
+    if args.batch_requests:
+        llm_pool = CachedPool(BatchJob(args.batch_results), ExtractionCache())
+        # pending rows are not written yet, so batch mode rereads everything and relies on its results files instead
+        checkpoint = None
 
-results = process_files_in_directory(directory_path)
-
-save_results_to_neo4j(results)
\ No newline at end of file
+    driver = init_neo4j_driver()
+    try:
+        summary = process_files_in_directory(args.directory, BulkRecipeWriter(driver, FACETS), checkpoint, manifest)
+    finally:
+        close_neo4j_driver(driver)
+    # the run finished, from here on the manifest decides what a rerun has to do
+    if checkpoint:
+        checkpoint.clear()
+    report(summary, llm_pool.stats())
+    print(f"Ingredient lines: {ingredient_parser.stats()}")
+    if args.batch_requests:
+        print(f"{llm_pool.write_requests(args.batch_requests)} calls still pending, written to {args.batch_requests}")
\ No newline at end of file
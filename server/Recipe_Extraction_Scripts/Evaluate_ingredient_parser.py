@@ -0,0 +1,84 @@
+import argparse
+import json
+import time
+from collections import defaultdict
+from Ingredient_parser import parse_line
+
+
+# Score the rule based ingredient parser against hand labelled lines (ingredient_lines_labelled.jsonl)
+# Reports accuracy, how many lines and recipes skip the LLM at each threshold, and parsing speed
+#
+#   python Evaluate_ingredient_parser.py ingredient_lines_labelled.jsonl --thresholds 0.5,0.7,0.9
+
+def read_labelled(path):
+    with open(path, encoding='utf-8') as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def expected(record):
+    return record["name"].lower() if record["name"] else None
+
+
+def lines_per_second(records, repeat=200):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for record in records:
+            parse_line(record["line"])
+    return len(records) * repeat / (time.perf_counter() - start)
+
+
+def evaluate(records, threshold):
+    correct = 0
+    answered = 0
+    answered_correct = 0
+    unsure_recipes = set()
+    recipes = defaultdict(int)
+
+    for record in records:
+        name, confidence = parse_line(record["line"])
+        recipes[record["recipe"]] += 1
+        right = name == expected(record)
+        if right:
+            correct += 1
+        if confidence >= threshold:
+            answered += 1
+            if right:
+                answered_correct += 1
+        else:
+            unsure_recipes.add(record["recipe"])
+
+    total = len(records)
+    return {
+        "threshold": threshold,
+        "lines": total,
+        "accuracy": correct / total if total else 0.0,
+        "coverage": answered / total if total else 0.0,
+        "fast_path_accuracy": answered_correct / answered if answered else 0.0,
+        # before, every recipe was one LLM call, now only recipes with an unsure line make one
+        "llm_calls_before": len(recipes),
+        "llm_calls_after": len(unsure_recipes),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Evaluate the rule based ingredient parser against labelled lines.")
+    parser.add_argument("labelled", help="JSONL of {recipe, line, name}, name null for lines that are not an ingredient")
+    parser.add_argument("--thresholds", default="0.5,0.6,0.7,0.8,0.9,0.95", help="Comma separated confidence thresholds")
+    parser.add_argument("--errors", action="store_true", help="Print the lines the parser gets wrong")
+    args = parser.parse_args()
+
+    records = read_labelled(args.labelled)
+
+    print(f"{'threshold':>9} {'accuracy':>8} {'coverage':>8} {'fast-path acc':>13} {'LLM calls':>9} {'avoided':>7}")
+    for threshold in [float(t) for t in args.thresholds.split(",")]:
+        report = evaluate(records, threshold)
+        avoided = report['llm_calls_before'] - report['llm_calls_after']
+        print(f"{report['threshold']:>9.2f} {report['accuracy']:>8.1%} {report['coverage']:>8.1%} "
+              f"{report['fast_path_accuracy']:>13.1%} {report['llm_calls_after']:>4}/{report['llm_calls_before']:<4} {avoided:>7}")
+    print(f"{lines_per_second(records):,.0f} lines/sec")
+
+    if args.errors:
+        for record in records:
+            name, confidence = parse_line(record["line"])
+            if name != expected(record):
+                print(f"{confidence:.2f}  {record['line']!r} -> {name!r}, expected {record['name']!r}")
@@ -0,0 +1,105 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+from langchain_core.messages import AIMessage
+
+EXTRACTION_CACHE_PATH = os.getenv('EXTRACTION_CACHE_PATH', 'extraction_cache.db')
+
+
+def sha256(text):
+    return hashlib.sha256(text.encode()).hexdigest()
+
+
+def prompt_hash(chain):
+    # the template with its placeholders left in, plus the model settings, so any prompt or model change misses
+    prompt, llm = chain.first, chain.steps[1]
+    placeholders = {name: "{" + name + "}" for name in prompt.input_variables}
+    messages = [(m.type, m.content) for m in prompt.format_messages(**placeholders)]
+    key = [llm.model_name, llm.temperature, messages]
+    if getattr(llm, "kwargs", None):
+        # bound arguments such as a response_format schema change the output too
+        key.append(llm.kwargs)
+    return sha256(json.dumps(key, sort_keys=True))
+
+
+def input_hash(inputs):
+    return sha256(json.dumps(inputs, sort_keys=True, default=str))
+
+
+class ExtractionCache(object):
+    """Raw LLM outputs on disk keyed by (prompt hash, input hash)."""
+
+    def __init__(self, path=EXTRACTION_CACHE_PATH):
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("""
+            CREATE TABLE IF NOT EXISTS extractions (
+                prompt_hash TEXT NOT NULL,
+                input_hash TEXT NOT NULL,
+                output TEXT NOT NULL,
+                PRIMARY KEY (prompt_hash, input_hash)
+            )
+        """)
+        self.db.commit()
+
+    def get(self, prompt_key, input_key):
+        with self.lock:
+            row = self.db.execute(
+                "SELECT output FROM extractions WHERE prompt_hash = ? AND input_hash = ?", (prompt_key, input_key)
+            ).fetchone()
+        return row[0] if row else None
+
+    def set(self, prompt_key, input_key, output):
+        with self.lock:
+            self.db.execute(
+                "INSERT OR REPLACE INTO extractions (prompt_hash, input_hash, output) VALUES (?, ?, ?)",
+                (prompt_key, input_key, output)
+            )
+            self.db.commit()
+
+
+class CachedPool(object):
+    """Wraps an LLMWorkerPool or BatchJob so chain calls already made with the same prompt and input are answered
+    from the cache. Only the model output is cached, the rest of the chain (e.g. the output parser) runs every time."""
+
+    def __init__(self, pool, cache):
+        self.pool = pool
+        self.cache = cache
+        self.prompt_hashes = {}
+        self.cached = 0
+        self.extracted = 0
+        self.stats_lock = threading.Lock()
+
+    def invoke(self, chain, inputs):
+        if id(chain) not in self.prompt_hashes:
+            self.prompt_hashes[id(chain)] = prompt_hash(chain)
+        keys = self.prompt_hashes[id(chain)], input_hash(inputs)
+
+        output = self.cache.get(*keys)
+        if output is None:
+            output = self.pool.invoke(chain.first | chain.steps[1], inputs).content
+            self.cache.set(*keys, output)
+            with self.stats_lock:
+                self.extracted += 1
+        else:
+            with self.stats_lock:
+                self.cached += 1
+
+        value = AIMessage(content=output)
+        for step in chain.steps[2:]:
+            value = step.invoke(value)
+        return value
+
+    def map(self, fn, items):
+        return self.pool.map(fn, items)
+
+    def stats(self):
+        with self.stats_lock:
+            return dict(self.pool.stats(), extracted=self.extracted, cached=self.cached)
+
+    def __getattr__(self, name):
+        # e.g. BatchJob.write_requests
+        return getattr(self.pool, name)
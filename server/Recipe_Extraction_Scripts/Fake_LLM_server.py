@@ -0,0 +1,101 @@
+import argparse
+import json
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Minimal OpenAI compatible /v1/chat/completions server for trying the extraction scripts without an API key
+# or spending tokens. It enforces its own requests-per-minute limit and answers 429 with Retry-After past it,
+# the same way the real API does, so the worker pool's backoff can be checked.
+# Point a script at it with OPENAI_BASE_URL=http://127.0.0.1:8100/v1 OPENAI_API_KEY=fake
+
+
+class FakeLLM(object):
+    def __init__(self, requests_per_minute, latency, reply):
+        self.requests_per_minute = requests_per_minute
+        self.latency = latency
+        self.reply = reply
+        self.recent = deque()
+        self.served = 0
+        self.rejected = 0
+        self.lock = threading.Lock()
+
+    def admit(self):
+        """Sliding one minute window, returns the seconds to wait or 0 when the request may go through."""
+        now = time.monotonic()
+        with self.lock:
+            while self.recent and now - self.recent[0] >= 60:
+                self.recent.popleft()
+            if self.requests_per_minute and len(self.recent) >= self.requests_per_minute:
+                self.rejected += 1
+                return 60 - (now - self.recent[0])
+            self.recent.append(now)
+            self.served += 1
+            return 0
+
+    def complete(self, body):
+        messages = body.get("messages") or [{}]
+        prompt = messages[-1].get("content", "")
+        # echo the request so callers can check their output order
+        content = self.reply.format(prompt=prompt)
+        prompt_tokens = sum(len(str(m.get("content", ""))) for m in messages) // 4 + 1
+        completion_tokens = len(content) // 4 + 1
+        return {
+            "id": f"chatcmpl-fake-{self.served}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body.get("model", "fake"),
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+            "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                      "total_tokens": prompt_tokens + completion_tokens},
+        }
+
+
+def handler_for(fake):
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            length = int(self.headers.get("Content-Length", 0))
+            body = json.loads(self.rfile.read(length) or b"{}")
+            if not self.path.endswith("/chat/completions"):
+                return self.send_json(404, {"error": {"message": "not found"}})
+
+            wait = fake.admit()
+            if wait:
+                return self.send_json(429, {"error": {"message": "Rate limit reached", "type": "requests"}},
+                                      {"Retry-After": f"{wait:.2f}"})
+            time.sleep(fake.latency)
+            self.send_json(200, fake.complete(body))
+
+        def send_json(self, status, payload, headers=None):
+            data = json.dumps(payload).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            for key, value in (headers or {}).items():
+                self.send_header(key, value)
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run a fake OpenAI chat completions server.")
+    parser.add_argument("--port", type=int, default=8100)
+    parser.add_argument("--rpm", type=int, default=120, help="Requests per minute before answering 429, 0 for no limit")
+    parser.add_argument("--latency", type=float, default=0.2, help="Seconds each completion takes")
+    parser.add_argument("--reply", default="ingredients, flour, eggs, milk ({prompt})", help="Reply text, {prompt} is the last message")
+    args = parser.parse_args()
+
+    fake = FakeLLM(args.rpm, args.latency, args.reply)
+    server = ThreadingHTTPServer(("127.0.0.1", args.port), handler_for(fake))
+    print(f"Fake LLM listening on http://127.0.0.1:{args.port}/v1")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    print(f"served {fake.served}, rejected {fake.rejected} with 429")
@@ -0,0 +1,82 @@
+import argparse
+import hashlib
+import os
+import time
+from email.utils import formatdate, parsedate_to_datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Serves a directory of saved recipe pages over HTTP so ReadFromURL's bulk mode can be measured without the network.
+# Pages carry an ETag and Last-Modified header and answer conditional requests with 304 like a real site.
+#
+#   python Fixture_server.py saved_pages --urls urls.txt --latency 0.1 &
+#   python ReadFromURL.py --urls-file urls.txt --delay 0 --dry-run
+
+
+def handler_for(directory, latency):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"  # keep-alive, so connection reuse shows up in the numbers
+
+        def do_GET(self):
+            path = os.path.join(directory, os.path.basename(self.path.split("?")[0]))
+            if not os.path.isfile(path):
+                return self.send_body(404, b"not found")
+
+            with open(path, 'rb') as f:
+                body = f.read()
+            etag = '"' + hashlib.md5(body).hexdigest() + '"'
+            mtime = int(os.path.getmtime(path))
+            headers = {"ETag": etag, "Last-Modified": formatdate(mtime, usegmt=True)}
+
+            time.sleep(latency)
+            if self.not_modified(etag, mtime):
+                return self.send_body(304, b"", headers)
+            self.send_body(200, body, dict(headers, **{"Content-Type": "text/html; charset=utf-8"}))
+
+        def not_modified(self, etag, mtime):
+            if self.headers.get("If-None-Match"):
+                return self.headers["If-None-Match"] == etag
+            since = self.headers.get("If-Modified-Since")
+            if since:
+                try:
+                    return mtime <= parsedate_to_datetime(since).timestamp()
+                except (TypeError, ValueError):
+                    return False
+            return False
+
+        def send_body(self, status, body, headers=None):
+            self.send_response(status)
+            for key, value in (headers or {}).items():
+                self.send_header(key, value)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve saved recipe pages for local scraping benchmarks.")
+    parser.add_argument("directory", help="Directory of saved .html recipe pages")
+    parser.add_argument("--port", type=int, default=8200)
+    parser.add_argument("--latency", type=float, default=0.1, help="Seconds added to every response, like a remote site")
+    parser.add_argument("--hosts", default="127.0.0.1,localhost", help="Host names to spread the urls over, each counts as its own domain")
+    parser.add_argument("--urls", help="Write the url of every page to this file")
+    args = parser.parse_args()
+
+    if args.urls:
+        hosts = args.hosts.split(",")
+        pages = sorted(f for f in os.listdir(args.directory) if f.endswith(".html"))
+        with open(args.urls, 'w', encoding='utf-8') as f:
+            for i, page in enumerate(pages):
+                f.write(f"http://{hosts[i % len(hosts)]}:{args.port}/{page}\n")
+        print(f"Wrote {len(pages)} urls to {args.urls}")
+
+    server = ThreadingHTTPServer(("127.0.0.1", args.port), handler_for(args.directory, args.latency))
+    print(f"Serving {args.directory} on http://127.0.0.1:{args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
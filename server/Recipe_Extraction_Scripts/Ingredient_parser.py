@@ -0,0 +1,180 @@
+import os
+import re
+import string
+import threading
+
+# Rule based ingredient name extraction, "2 (15 oz) cans black beans, rinsed" -> "black beans"
+# Every line gets a confidence and only the lines below the threshold are left for the LLM
+
+CONFIDENCE_THRESHOLD = float(os.getenv('INGREDIENT_CONFIDENCE_THRESHOLD', '0.7'))
+
+UNICODE_FRACTIONS = {
+    "½": " 1/2", "⅓": " 1/3", "⅔": " 2/3", "¼": " 1/4", "¾": " 3/4", "⅕": " 1/5",
+    "⅛": " 1/8", "⅜": " 3/8", "⅝": " 5/8", "⅞": " 7/8", "⁄": "/",
+}
+
+UNITS = {
+    "cup", "cups", "c", "tablespoon", "tablespoons", "tbsp", "tbsps", "tbs", "tbl", "teaspoon", "teaspoons", "tsp",
+    "tsps", "ounce", "ounces", "oz", "fluid", "fl", "pound", "pounds", "lb", "lbs", "gram", "grams", "g", "kilogram",
+    "kilograms", "kg", "milligram", "mg", "milliliter", "milliliters", "millilitre", "ml", "liter", "liters", "litre",
+    "litres", "l", "pint", "pints", "pt", "quart", "quarts", "qt", "gallon", "gallons", "gal", "can", "cans", "jar",
+    "jars", "package", "packages", "pkg", "packet", "packets", "envelope", "envelopes", "box", "boxes", "bag", "bags",
+    "bottle", "bottles", "container", "containers", "carton", "stick", "sticks", "clove", "cloves", "slice", "slices",
+    "piece", "pieces", "pinch", "pinches", "dash", "dashes", "handful", "handfuls", "bunch", "bunches", "sprig",
+    "sprigs", "head", "heads", "stalk", "stalks", "rib", "ribs", "leaf", "sheet", "sheets", "inch", "inches",
+    "drop", "drops", "scoop", "scoops", "block", "fillet", "fillets", "wedge", "wedges", "knob",
+}
+
+# size, state and preparation words that are not part of the ingredient's name
+DESCRIPTORS = {
+    "fresh", "freshly", "organic", "frozen", "thawed", "dried", "dry", "chopped", "minced", "sliced", "diced", "ground",
+    "whole", "crushed", "canned", "large", "medium", "small", "extra-large", "jumbo", "finely", "roughly", "coarsely",
+    "thinly", "thickly", "lightly", "packed", "firmly", "softened", "melted", "cold", "warm", "room",
+    "temperature", "boneless", "skinless", "shredded", "grated", "peeled", "seeded", "pitted", "cored", "trimmed",
+    "halved", "quartered", "cubed", "julienned", "cooked", "uncooked", "raw", "beaten", "whisked", "sifted", "heaping",
+    "level", "rounded", "optional", "divided", "plus", "more", "additional", "extra-virgin", "good", "quality",
+    "ripe", "toasted", "rinsed", "drained", "cut", "into", "torn", "zested", "juiced", "about", "approximately",
+    "generous", "scant", "mashed", "prepared", "unsalted", "salted", "double", "thumb-sized",
+}
+
+# cut at the first of these, what follows is preparation or serving notes
+NOTE_PATTERN = re.compile(r",|;|\s-\s|\s–\s|\bfor\s+(serving|garnish|frying|greasing|dusting|topping|drizzling)\b|\bto (taste|serve)\b|\bas needed\b|\bif desired\b")
+PARENTHETICAL = re.compile(r"\([^)]*\)|\[[^\]]*\]")
+QUANTITY = re.compile(r"^(\d+(\.\d+)?|\d+/\d+|a|an|one|two|three|four|five|six|few|several|couple|some)$")
+RANGE = re.compile(r"(\d)\s*(-|to|or)\s*(\d)")
+BULLET = re.compile(r"^\s*([-*•·▢□]|\d+[.)])\s+")
+HEADER = re.compile(r"^(for (the )?[\w ]+|[\w ]+ ingredients?|topping|filling|sauce|garnish|dressing|glaze|frosting|crust)\s*:$")
+# a line that starts a new ingredient when a block is comma separated
+NEW_ITEM = re.compile(r"^\s*(\d|[½⅓⅔¼¾⅛]|a |an |one |pinch |dash |salt|pepper)", re.IGNORECASE)
+
+
+def split_lines(text):
+    """Ingredient blocks come either one per line (scraped pages) or comma separated (the CSV dataset)."""
+    lines = [line.strip() for line in text.splitlines() if line.strip()]
+    if len(lines) > 1:
+        return lines
+
+    # "1 cup flour, sifted, 2 eggs" -> ["1 cup flour, sifted", "2 eggs"], notes stay with their ingredient
+    items = []
+    for part in text.split(","):
+        if items and not NEW_ITEM.match(part):
+            items[-1] += "," + part
+        else:
+            items.append(part.strip())
+    return [item for item in items if item]
+
+
+def bare(word):
+    # abbreviations keep their period in the word regex, "tsp." and "oz." are still units
+    return word.rstrip(".")
+
+
+def parse_line(line):
+    """Returns (name, confidence), name is None when the line names no ingredient (e.g. a section header)."""
+    text = line.lower().strip()
+    for fraction, replacement in UNICODE_FRACTIONS.items():
+        text = text.replace(fraction, replacement)
+    text = BULLET.sub("", text).strip()
+    if not text or HEADER.match(text):
+        return None, 1.0
+
+    text = PARENTHETICAL.sub(" ", text)
+    text = RANGE.sub(r"\1", text)
+    match = NOTE_PATTERN.search(text)
+    if match:
+        text = text[:match.start()]
+
+    words = re.findall(r"[\w/.'&-]+", text)
+    quantity = unit = False
+    while words and (QUANTITY.match(bare(words[0])) or bare(words[0]) in UNITS or bare(words[0]) in DESCRIPTORS
+                     or words[0] == "of"):
+        if QUANTITY.match(bare(words[0])):
+            quantity = True
+        elif bare(words[0]) in UNITS:
+            unit = True
+        words.pop(0)
+    words = [w for w in words if bare(w) not in DESCRIPTORS]
+    # "2 cloves garlic" and "garlic, 2 cloves" both leave the unit at an end
+    while words and bare(words[-1]) in UNITS:
+        words.pop()
+    name = " ".join(words).strip(" .-'")
+
+    if not name:
+        return None, 0.0
+
+    confidence = 1.0
+    if not (quantity or unit):
+        # "salt and pepper" style lines, usually fine but nothing anchored the parse
+        confidence -= 0.1
+    if re.search(r"\d", name):
+        confidence -= 0.5
+    if re.search(r"\b(and|or|with|plus)\b", name):
+        # may be two ingredients, or one whose name contains "and"
+        confidence -= 0.35
+    if len(name.split()) > 3:
+        confidence -= 0.1 * (len(name.split()) - 3)
+    if len(name) < 3:
+        confidence -= 0.4
+    return name, max(confidence, 0.0)
+
+
+class IngredientParser(object):
+    """Counts how many lines the rules handled and how many LLM calls that saved."""
+
+    def __init__(self, threshold=CONFIDENCE_THRESHOLD):
+        self.threshold = threshold
+        self.lines = 0
+        self.local_lines = 0
+        self.blocks = 0
+        self.llm_blocks = 0
+        self.lock = threading.Lock()
+
+    def parse(self, text):
+        """Returns (names parsed with enough confidence, lines to send to the LLM)."""
+        names = []
+        unsure = []
+        lines = split_lines(text)
+        for line in lines:
+            name, confidence = parse_line(line)
+            if confidence < self.threshold:
+                unsure.append(line)
+            elif name:
+                # capitalised like the LLM's answers so both paths MERGE onto the same Ingredient nodes
+                name = string.capwords(name)
+                if name not in names:
+                    names.append(name)
+
+        with self.lock:
+            self.lines += len(lines)
+            self.local_lines += len(lines) - len(unsure)
+            self.blocks += 1
+            self.llm_blocks += 1 if unsure else 0
+        return names, unsure
+
+    def stats(self):
+        with self.lock:
+            return {"lines": self.lines, "local_lines": self.local_lines, "llm_calls": self.llm_blocks,
+                    "llm_calls_avoided": self.blocks - self.llm_blocks}
+
+
+def clean_llm_items(items):
+    """Names from the comma separated list the model returns. Only a header-like first item is dropped
+    ("Here are the ingredients:"), the old result[1:] threw away a real ingredient whenever there was none."""
+    cleaned = []
+    for item in items:
+        item = item.strip().strip('[]"\'').lstrip('- ').strip()
+        if not item or item.endswith(':'):
+            continue
+        cleaned.append(item)
+    return cleaned
+
+
+def merge_names(names, llm_items):
+    """The locally parsed names followed by the model's, without repeats."""
+    merged = list(names)
+    seen = {name.lower() for name in names}
+    for item in clean_llm_items(llm_items):
+        if item.lower() not in seen:
+            seen.add(item.lower())
+            merged.append(item)
+    return merged
@@ -6,14 +6,26 @@ from langchain_core.output_parsers import JsonOutputParser
 from langchain_community.document_loaders import JSONLoader
 from dotenv import load_dotenv
 from neo4j import GraphDatabase
+from Neo4j_writer import BulkRecipeWriter
+from LLM_pool import LLMWorkerPool
+from Batch_jobs import BatchJob, ResultPending
+from Extraction_cache import CachedPool, ExtractionCache
+from Manifest import Manifest, file_hash, recipe_hash, report
+from collections import Counter
+import argparse
 
 load_dotenv()
 
+# retries are left to the worker pool so 429s back off across all workers together
 llm = ChatOpenAI(
     model="gpt-4o-mini",
-    temperature=0
+    temperature=0,
+    max_retries=0
 )
 
+# calls already made with the same prompt and input are answered from disk
+llm_pool = CachedPool(LLMWorkerPool(), ExtractionCache())
+
 parser = JsonOutputParser(pydantic_object={
     "type": "object",
     "properties": {
@@ -103,29 +115,49 @@ chain = prompt | llm | parser
 
 def parse_recipe(description):
     """Parse the recipe description using the Groq model."""
-    result = chain.invoke({"input": description})
+    result = llm_pool.invoke(chain, {"input": description})
     return result
 
-def process_files_in_directory(directory_path):
+def parse_file(file_path):
+    loader = JSONLoader(file_path, jq_schema=".", text_content=False)
+    data = loader.load()
+    content = "\n".join([doc.page_content for doc in data])
+    try:
+        return parse_recipe(content)
+    except ResultPending:
+        # batch mode, the file is ingested once its result is in
+        return None
+
+def process_files_in_directory(directory_path, manifest=None):
+    """Returns (recipes, {path: hash} of the files fully parsed, summary counts).
+    With a manifest, files that have not changed since they were last ingested are not sent to the LLM again."""
     results = []
-    
-    for filename in os.listdir(directory_path):
-        file_path = os.path.join(directory_path, filename)
-
-        if os.path.isdir(file_path):
+    seen = set()
+    summary = Counter()
+
+    file_paths = [os.path.join(directory_path, filename) for filename in sorted(os.listdir(directory_path))]
+    file_paths = [path for path in file_paths if not os.path.isdir(path)]
+    hashes = {path: file_hash(path) for path in file_paths}
+    changed = [path for path in file_paths if manifest is None or manifest.file_changed(path, hashes[path])]
+    summary["files_skipped"] = len(file_paths) - len(changed)
+    summary["files_processed"] = len(changed)
+
+    parsed_files = {}
+    # files are parsed concurrently on the pool, map keeps them in directory order
+    for path, result in zip(changed, llm_pool.map(parse_file, changed)):
+        if result is None:
             continue
-
-        loader = JSONLoader(file_path, jq_schema=".", text_content=False)
-        data = loader.load()
-        content = "\n".join([doc.page_content for doc in data])
-
-        result = parse_recipe(content)
-        
+        parsed_files[path] = hashes[path]
+        if isinstance(result, dict):
+            result = [result]
         for r in result:
-            if r not in results:
-                results.extend(result)
-            
-    return results
+            # same recipe extracted from several files, keep the first
+            key = recipe_hash(r)
+            if key not in seen:
+                seen.add(key)
+                results.append(r)
+
+    return results, parsed_files, summary
 
 def init_neo4j_driver():
     uri = os.getenv('NEO4J_URI')  
@@ -139,83 +171,35 @@ def init_neo4j_driver():
 def close_neo4j_driver(driver):
     driver.close()
 
-def create_recipe(driver, recipe):
-    query = """
-    MERGE (r:Recipe {name: $name})
-    SET r.instructions = $instructions
-    SET r.ingredients = $ingredients
-    """
-    parameters = {
-        "name": recipe["Recipe Name"],
-        "instructions": recipe["Instructions"],
-        "ingredients": recipe["Ingredients"]
-    }
-
-    with driver.session() as session:
-        session.run(query, parameters)
-
-def create_ingredients(driver, recipe_name, ingredients):
-     with driver.session() as session:
-        for name in ingredients:
-            query = """
-            MERGE (i:Ingredient {name: $ingredient_name})
-            WITH i
-            MATCH (r:Recipe {name: $recipe_name})
-            CREATE (r)-[:CONTAINS]->(i)
-            """
-            session.run(query, ingredient_name=name.lower(), recipe_name=recipe_name)
-
-def create_optional_field(driver, recipe_name, field_value, node_label, relationship_type):
-    query = f"""
-    MERGE (n:{node_label} {{value: $field_value}})
-    WITH n
-    MATCH (r:Recipe {{name: $recipe_name}})
-    CREATE (r)-[:{relationship_type}]->(n)
-    """
-    
-    parameters = {
-        "recipe_name": recipe_name,
-        "field_value": field_value,
-        "node_label": node_label, 
-        "relationship_type": relationship_type
-    }
-
-    with driver.session() as session:
-        session.run(query, parameters)
-
 def save_results_to_neo4j(data):
     driver = init_neo4j_driver()
-    for recipe in data:
-        create_recipe(driver, recipe)
-        
-        create_ingredients(driver, recipe["Recipe Name"], recipe["Ingredients_list"])
-
-        if recipe["Total Time"] != '':
-            create_optional_field(driver, recipe["Recipe Name"], recipe["Total Time"], "TotalTime", "HAS_TOTAL_TIME")
-        
-        if recipe["Yield"] != '':
-            create_optional_field(driver, recipe["Recipe Name"], recipe["Yield"], "Yield", "HAS_YIELD")
-        
-        if recipe["Nutrition"] != '':
-            create_optional_field(driver, recipe["Recipe Name"], recipe["Nutrition"], "Nutrition", "HAS_NUTRITION")
-        
-        if recipe["Category"] != '':
-            create_optional_field(driver, recipe["Recipe Name"], recipe["Category"], "Category", "BELONGS_TO_CATEGORY")
-        
-        if recipe["Cuisine"] != '':
-            create_optional_field(driver, recipe["Recipe Name"], recipe["Cuisine"], "Cuisine", "HAS_CUISINE")
-        
-        if recipe["Difficulty"] != '':
-            create_optional_field(driver, recipe["Recipe Name"], recipe["Difficulty"], "Difficulty", "HAS_DIFFICULTY")
-        
-        print("Added recipe to Neo4j.")
-    
+    BulkRecipeWriter(driver).write(data)
     close_neo4j_driver(driver)
         
 
-directory_path = r"C:\Users\lalit\Desktop\DeepDish-AI\server\data"  
-output_file = "standardized_recipes.json"
-
-results = process_files_in_directory(directory_path)
-
-save_results_to_neo4j(results)
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Extract recipes from JSON files and ingest them into Neo4j.")
+    parser.add_argument("directory", nargs="?", default=r"C:\Users\lalit\Desktop\DeepDish-AI\server\data")
+    parser.add_argument("--batch-requests", help="Batch mode: write the LLM calls still missing a result to this JSONL file")
+    parser.add_argument("--batch-results", action="append", help="Batch mode: JSONL results file(s) to answer calls from")
+    parser.add_argument("--force", action="store_true", help="Forget the ingestion manifest and rewrite every recipe")
+    args = parser.parse_args()
+
+    manifest = Manifest()
+    if args.force:
+        manifest.clear()
+    if args.batch_requests:
+        llm_pool = CachedPool(BatchJob(args.batch_results), ExtractionCache())
+
+    results, parsed_files, summary = process_files_in_directory(args.directory, manifest)
+
+    recipes = manifest.changed_recipes(results)
+    summary["recipes_unchanged"] = len(results) - len(recipes)
+    save_results_to_neo4j(recipes)
+    # only recorded once the recipes are in the graph
+    manifest.record_recipes(recipes)
+    manifest.record_files(parsed_files)
+    summary["recipes_written"] = len(recipes)
+    report(summary, llm_pool.stats())
+    if args.batch_requests:
+        print(f"{llm_pool.write_requests(args.batch_requests)} calls still pending, written to {args.batch_requests}")
@@ -0,0 +1,173 @@
+import argparse
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import openai
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Budgets are per minute like the OpenAI account limits, set them a little under the limits of your tier
+WORKERS = int(os.getenv('LLM_WORKERS', '8'))
+REQUESTS_PER_MINUTE = int(os.getenv('LLM_RPM', '500'))
+TOKENS_PER_MINUTE = int(os.getenv('LLM_TPM', '200000'))
+MAX_RETRIES = int(os.getenv('LLM_MAX_RETRIES', '6'))
+# completion tokens reserved per call on top of the estimated prompt size
+COMPLETION_TOKENS = int(os.getenv('LLM_COMPLETION_TOKENS', '512'))
+
+BASE_DELAY = 1.0
+MAX_DELAY = 60.0
+
+
+def estimate_tokens(inputs):
+    # roughly four characters per token for English text
+    return len(str(inputs)) // 4 + 1
+
+
+class RateLimiter(object):
+    """Token buckets for requests and tokens per minute, shared by every worker thread.
+    A budget of 0 turns that limit off."""
+
+    def __init__(self, requests_per_minute, tokens_per_minute):
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self.requests = float(requests_per_minute)
+        self.tokens = float(tokens_per_minute)
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self.lock = threading.Lock()
+
+    def refill(self, now):
+        elapsed = now - self.updated
+        self.updated = now
+        if self.requests_per_minute:
+            self.requests = min(self.requests_per_minute, self.requests + elapsed * self.requests_per_minute / 60)
+        if self.tokens_per_minute:
+            self.tokens = min(self.tokens_per_minute, self.tokens + elapsed * self.tokens_per_minute / 60)
+
+    def acquire(self, tokens):
+        """Block until one request and the given number of tokens fit in the budgets."""
+        if self.tokens_per_minute:
+            tokens = min(tokens, self.tokens_per_minute)
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.refill(now)
+                wait = self.paused_until - now
+                if wait <= 0:
+                    wait = 0.0
+                    if self.requests_per_minute and self.requests < 1:
+                        wait = (1 - self.requests) * 60 / self.requests_per_minute
+                    if self.tokens_per_minute and self.tokens < tokens:
+                        wait = max(wait, (tokens - self.tokens) * 60 / self.tokens_per_minute)
+                    if wait == 0.0:
+                        if self.requests_per_minute:
+                            self.requests -= 1
+                        if self.tokens_per_minute:
+                            self.tokens -= tokens
+                        return
+            time.sleep(wait)
+
+    def pause(self, seconds):
+        # after a 429 every worker holds off, not just the one that got it
+        with self.lock:
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+
+def retry_after(error):
+    response = getattr(error, 'response', None)
+    if response is None:
+        return None
+    try:
+        return float(response.headers.get('retry-after'))
+    except (TypeError, ValueError):
+        return None
+
+
+def is_rate_limited(error):
+    return isinstance(error, openai.RateLimitError) or getattr(error, 'status_code', None) == 429
+
+
+def is_retryable(error):
+    if is_rate_limited(error) or isinstance(error, openai.APIConnectionError):
+        return True
+    status = getattr(error, 'status_code', None)
+    return status is not None and status >= 500
+
+
+class LLMWorkerPool(object):
+    """Bounded thread pool for the extraction chains.
+    invoke() runs one chain call inside the RPM/TPM budgets and retries 429s, 5xx and dropped connections with
+    jittered exponential backoff (honouring Retry-After). map() fans a function out over the workers and returns
+    the results in input order, so a run produces the same output order no matter how the calls interleave.
+    Don't call map() from inside a mapped function, the inner calls would wait for workers held by the outer ones."""
+
+    def __init__(self, max_workers=WORKERS, requests_per_minute=REQUESTS_PER_MINUTE, tokens_per_minute=TOKENS_PER_MINUTE,
+                 max_retries=MAX_RETRIES, completion_tokens=COMPLETION_TOKENS):
+        self.executor = ThreadPoolExecutor(max_workers=max_workers)
+        self.limiter = RateLimiter(requests_per_minute, tokens_per_minute)
+        self.max_retries = max_retries
+        self.completion_tokens = completion_tokens
+        self.calls = 0
+        self.retries = 0
+        self.rate_limited = 0
+        self.stats_lock = threading.Lock()
+
+    def invoke(self, chain, inputs):
+        cost = estimate_tokens(inputs) + self.completion_tokens
+        for attempt in range(self.max_retries + 1):
+            self.limiter.acquire(cost)
+            with self.stats_lock:
+                self.calls += 1
+            try:
+                return chain.invoke(inputs)
+            except Exception as e:
+                if attempt == self.max_retries or not is_retryable(e):
+                    raise
+                delay = random.uniform(0, min(MAX_DELAY, BASE_DELAY * 2 ** attempt))
+                with self.stats_lock:
+                    self.retries += 1
+                if is_rate_limited(e):
+                    with self.stats_lock:
+                        self.rate_limited += 1
+                    delay += retry_after(e) or 0
+                    self.limiter.pause(delay)
+                time.sleep(delay)
+
+    def map(self, fn, items):
+        return list(self.executor.map(fn, items))
+
+    def stats(self):
+        with self.stats_lock:
+            return {"calls": self.calls, "retries": self.retries, "rate_limited": self.rate_limited}
+
+
+if __name__ == "__main__":
+    # Exercise the pool against a local fake server, e.g.
+    #   python Fake_LLM_server.py --rpm 120 &
+    #   python LLM_pool.py --base-url http://127.0.0.1:8100/v1 --requests 200 --rpm 100
+    from langchain_openai import ChatOpenAI
+    from langchain_core.prompts import ChatPromptTemplate
+
+    parser = argparse.ArgumentParser(description="Send concurrent chat calls through the worker pool and report throughput.")
+    parser.add_argument("--base-url", default="http://127.0.0.1:8100/v1")
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--workers", type=int, default=WORKERS)
+    parser.add_argument("--rpm", type=int, default=REQUESTS_PER_MINUTE)
+    parser.add_argument("--tpm", type=int, default=TOKENS_PER_MINUTE)
+    args = parser.parse_args()
+
+    llm = ChatOpenAI(model="gpt-4o-mini", temperature=0, base_url=args.base_url, api_key="fake", max_retries=0)
+    chain = ChatPromptTemplate.from_messages([("user", "{input}")]) | llm
+    pool = LLMWorkerPool(args.workers, args.rpm, args.tpm)
+
+    start = time.perf_counter()
+    replies = pool.map(lambda i: pool.invoke(chain, {"input": f"request {i}"}).content, range(args.requests))
+    elapsed = time.perf_counter() - start
+
+    in_order = all(f"request {i}" in reply for i, reply in enumerate(replies))
+    stats = pool.stats()
+    print(f"{args.requests} requests in {elapsed:.1f} s ({args.requests / elapsed * 60:.0f}/min), "
+          f"{stats['rate_limited']} rate limited, {stats['retries']} retries, output in order: {in_order}")
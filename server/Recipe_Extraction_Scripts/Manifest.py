@@ -0,0 +1,67 @@
+import hashlib
+import json
+import os
+import sqlite3
+
+MANIFEST_PATH = os.getenv('INGEST_MANIFEST_PATH', 'ingest_manifest.db')
+
+
+def file_hash(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def recipe_hash(recipe):
+    return hashlib.sha256(json.dumps(recipe, sort_keys=True, default=str).encode()).hexdigest()
+
+
+class Manifest(object):
+    """Content hashes of the source files and recipes already in the graph, so a rerun only touches what changed.
+    Record entries only after they are written to Neo4j, a crash in between just means they are redone."""
+
+    def __init__(self, path=MANIFEST_PATH):
+        self.db = sqlite3.connect(path)
+        self.db.execute("CREATE TABLE IF NOT EXISTS files (path TEXT PRIMARY KEY, hash TEXT NOT NULL)")
+        self.db.execute("CREATE TABLE IF NOT EXISTS recipes (name TEXT PRIMARY KEY, hash TEXT NOT NULL)")
+        self.db.commit()
+
+    def file_changed(self, path, digest):
+        row = self.db.execute("SELECT hash FROM files WHERE path = ?", (os.path.abspath(path),)).fetchone()
+        return row is None or row[0] != digest
+
+    def record_files(self, hashes):
+        self.db.executemany(
+            "INSERT OR REPLACE INTO files (path, hash) VALUES (?, ?)",
+            [(os.path.abspath(path), digest) for path, digest in hashes.items()]
+        )
+        self.db.commit()
+
+    def changed_recipes(self, recipes):
+        """The recipes that are new or differ from what was last written under the same name."""
+        changed = []
+        for recipe in recipes:
+            row = self.db.execute("SELECT hash FROM recipes WHERE name = ?", (recipe.get("Recipe Name"),)).fetchone()
+            if row is None or row[0] != recipe_hash(recipe):
+                changed.append(recipe)
+        return changed
+
+    def record_recipes(self, recipes):
+        self.db.executemany(
+            "INSERT OR REPLACE INTO recipes (name, hash) VALUES (?, ?)",
+            [(recipe.get("Recipe Name"), recipe_hash(recipe)) for recipe in recipes]
+        )
+        self.db.commit()
+
+    def clear(self):
+        self.db.execute("DELETE FROM files")
+        self.db.execute("DELETE FROM recipes")
+        self.db.commit()
+
+
+def report(summary, llm_stats):
+    print(f"Files: {summary['files_skipped']} unchanged and skipped, {summary['files_processed']} processed")
+    print(f"Recipes: {summary['recipes_unchanged']} unchanged and skipped, {summary['recipes_written']} written")
+    print(f"LLM calls: {llm_stats.get('extracted', 0)} re-extracted, {llm_stats.get('cached', 0)} answered from the extraction cache")
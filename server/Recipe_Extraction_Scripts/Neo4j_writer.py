@@ -0,0 +1,113 @@
+import os
+import time
+
+# recipe field -> (node label, relationship type) used by the JSON and URL extractors
+DEFAULT_FACETS = {
+    "Total Time": ("TotalTime", "HAS_TOTAL_TIME"),
+    "Yield": ("Yield", "HAS_YIELD"),
+    "Nutrition": ("Nutrition", "HAS_NUTRITION"),
+    "Category": ("Category", "BELONGS_TO_CATEGORY"),
+    "Cuisine": ("Cuisine", "HAS_CUISINE"),
+    "Difficulty": ("Difficulty", "HAS_DIFFICULTY"),
+}
+
+BATCH_SIZE = int(os.getenv('NEO4J_BATCH_SIZE', '500'))
+
+# Lowercase copies of the MERGE keys (name_lower / value_lower) are stored alongside them so case-insensitive
+# lookups can use an index, see server/graph_schema.py
+
+RECIPE_QUERY = """
+UNWIND $rows AS row
+MERGE (r:Recipe {name: row.name})
+SET r.name_lower = row.name_lower
+SET r.instructions = row.instructions
+SET r.ingredients = row.ingredients
+"""
+
+INGREDIENT_QUERY = """
+UNWIND $rows AS row
+MATCH (r:Recipe {name: row.recipe_name})
+MERGE (i:Ingredient {name: row.ingredient_name})
+SET i.name_lower = row.ingredient_name
+MERGE (r)-[:CONTAINS]->(i)
+"""
+
+FACET_QUERY = """
+UNWIND $rows AS row
+MATCH (r:Recipe {{name: row.recipe_name}})
+MERGE (n:{node_label} {{value: row.field_value}})
+SET n.value_lower = row.field_key
+MERGE (r)-[:{relationship_type}]->(n)
+"""
+
+
+def lower(value):
+    # non-string values (e.g. a numeric yield) get no lowercase copy, matching what toLower would accept
+    return value.lower() if isinstance(value, str) else None
+
+
+class BulkRecipeWriter(object):
+    """Writes recipes, their ingredients and facet nodes with one UNWIND query per kind and one transaction per batch.
+    Batches run as managed write transactions, so the driver retries transient errors and lost connections itself."""
+
+    def __init__(self, driver, facets=None, batch_size=BATCH_SIZE):
+        self.driver = driver
+        self.facets = facets or DEFAULT_FACETS
+        self.batch_size = batch_size
+
+    def write(self, recipes):
+        start = time.perf_counter()
+        written = 0
+        batch = []
+        with self.driver.session() as session:
+            for recipe in recipes:
+                if not recipe or not recipe.get("Recipe Name"):
+                    continue
+                batch.append(recipe)
+                if len(batch) >= self.batch_size:
+                    written += self.write_batch(session, batch)
+                    batch = []
+                    self.report(written, start)
+            if batch:
+                written += self.write_batch(session, batch)
+                self.report(written, start)
+
+        elapsed = time.perf_counter() - start
+        return {"recipes": written, "seconds": elapsed, "recipes_per_second": written / elapsed if elapsed else 0.0}
+
+    def write_batch(self, session, batch):
+        session.execute_write(self.run_batch, self.batch_rows(batch))
+        return len(batch)
+
+    def batch_rows(self, batch):
+        recipes = []
+        ingredients = []
+        facets = {field: [] for field in self.facets}
+        for recipe in batch:
+            name = recipe["Recipe Name"]
+            recipes.append({
+                "name": name,
+                "name_lower": lower(name),
+                "instructions": recipe.get("Instructions", ""),
+                "ingredients": recipe.get("Ingredients", "")
+            })
+            for ingredient in set(i.lower() for i in recipe.get("Ingredients_list") or [] if i):
+                ingredients.append({"recipe_name": name, "ingredient_name": ingredient})
+            for field in self.facets:
+                value = recipe.get(field)
+                if value not in ('', None):
+                    facets[field].append({"recipe_name": name, "field_value": value, "field_key": lower(value)})
+        return recipes, ingredients, facets
+
+    def run_batch(self, tx, rows):
+        recipes, ingredients, facets = rows
+        tx.run(RECIPE_QUERY, rows=recipes)
+        tx.run(INGREDIENT_QUERY, rows=ingredients)
+        for field, facet_rows in facets.items():
+            if facet_rows:
+                node_label, relationship_type = self.facets[field]
+                tx.run(FACET_QUERY.format(node_label=node_label, relationship_type=relationship_type), rows=facet_rows)
+
+    def report(self, written, start):
+        elapsed = time.perf_counter() - start
+        print(f"Added {written} recipes to Neo4j ({written / elapsed if elapsed else 0.0:.1f} recipes/sec).")
@@ -0,0 +1,61 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+import zstandard
+from Page_fetcher import Page
+
+PAGE_CACHE_PATH = os.getenv('URL_PAGE_CACHE_PATH', 'page_cache.db')
+# zstd level 9 packs recipe HTML to around a tenth of its size and still decompresses at hundreds of MB/s
+COMPRESSION_LEVEL = 9
+
+
+class PageCache(object):
+    """Every fetched page, zstd compressed, with its url, fetch time and response headers.
+    ReadFromURL --from-cache reruns extraction over it without touching the network."""
+
+    def __init__(self, path=PAGE_CACHE_PATH, level=COMPRESSION_LEVEL):
+        self.level = level
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("""
+            CREATE TABLE IF NOT EXISTS pages (
+                url TEXT PRIMARY KEY,
+                fetched_at REAL NOT NULL,
+                status INTEGER NOT NULL,
+                headers TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                body BLOB NOT NULL
+            )
+        """)
+        self.db.commit()
+
+    def store(self, page, fetched_at=None):
+        raw = page.html.encode('utf-8')
+        # compressor objects are not thread safe, one per call is cheap
+        body = zstandard.ZstdCompressor(level=self.level).compress(raw)
+        with self.lock:
+            self.db.execute(
+                "INSERT OR REPLACE INTO pages (url, fetched_at, status, headers, size, body) VALUES (?, ?, ?, ?, ?, ?)",
+                (page.url, fetched_at or time.time(), page.status, json.dumps(page.headers), len(raw), body)
+            )
+            self.db.commit()
+
+    def get(self, url):
+        with self.lock:
+            row = self.db.execute("SELECT status, headers, body FROM pages WHERE url = ?", (url,)).fetchone()
+        if row is None:
+            return None
+        html = zstandard.ZstdDecompressor().decompress(row[2]).decode('utf-8')
+        return Page(url, row[0], html, json.loads(row[1]))
+
+    def urls(self):
+        with self.lock:
+            return [row[0] for row in self.db.execute("SELECT url FROM pages ORDER BY url")]
+
+    def stats(self):
+        with self.lock:
+            pages, raw, stored = self.db.execute("SELECT COUNT(*), SUM(size), SUM(LENGTH(body)) FROM pages").fetchone()
+        return {"pages": pages, "raw_mb": (raw or 0) / 1e6, "stored_mb": (stored or 0) / 1e6}
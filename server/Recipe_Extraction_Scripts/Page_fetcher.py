@@ -0,0 +1,154 @@
+import os
+import sqlite3
+import threading
+import time
+from collections import Counter, defaultdict, namedtuple
+from contextlib import contextmanager
+from urllib.parse import urlparse
+import httpx
+
+# Politeness towards recipe sites: at most this many requests in flight per domain, started this many seconds apart
+PER_DOMAIN = int(os.getenv('URL_PER_DOMAIN', '2'))
+DOMAIN_DELAY = float(os.getenv('URL_DOMAIN_DELAY', '1.0'))
+FETCH_STATE_PATH = os.getenv('URL_FETCH_STATE_PATH', 'fetch_state.db')
+USER_AGENT = "Mozilla/5.0 (compatible; DeepDish-AI recipe importer)"
+
+Page = namedtuple('Page', ['url', 'status', 'html', 'headers'])
+
+
+class PageNotModified(Exception):
+    """The server answered 304, the page has not changed since it was last ingested."""
+
+
+def domain(url):
+    return urlparse(url).netloc.lower()
+
+
+def interleave_by_domain(urls):
+    """Round-robin the urls over their domains so one big site does not hold every worker on its delay."""
+    by_domain = defaultdict(list)
+    for url in urls:
+        by_domain[domain(url)].append(url)
+    queues = list(by_domain.values())
+    ordered = []
+    for i in range(max((len(q) for q in queues), default=0)):
+        ordered.extend(q[i] for q in queues if i < len(q))
+    return ordered
+
+
+class DomainLimiter(object):
+    """At most max_concurrent requests in flight per domain, with request starts at least delay seconds apart."""
+
+    def __init__(self, max_concurrent=PER_DOMAIN, delay=DOMAIN_DELAY):
+        self.max_concurrent = max_concurrent
+        self.delay = delay
+        self.semaphores = {}
+        self.next_start = defaultdict(float)
+        self.lock = threading.Lock()
+
+    @contextmanager
+    def slot(self, name):
+        with self.lock:
+            if name not in self.semaphores:
+                self.semaphores[name] = threading.Semaphore(self.max_concurrent)
+            semaphore = self.semaphores[name]
+        with semaphore:
+            with self.lock:
+                now = time.monotonic()
+                start = max(now, self.next_start[name])
+                self.next_start[name] = start + self.delay
+            if start > now:
+                time.sleep(start - now)
+            yield
+
+
+class FetchState(object):
+    """ETag and Last-Modified per url, only committed once the page's recipe is in the graph, so a page that
+    failed to ingest is downloaded in full again rather than answered with 304."""
+
+    def __init__(self, path=FETCH_STATE_PATH):
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute("""
+            CREATE TABLE IF NOT EXISTS pages (
+                url TEXT PRIMARY KEY,
+                etag TEXT,
+                last_modified TEXT,
+                fetched_at REAL NOT NULL
+            )
+        """)
+        self.db.commit()
+        self.pending = {}
+
+    def validators(self, url):
+        with self.lock:
+            row = self.db.execute("SELECT etag, last_modified FROM pages WHERE url = ?", (url,)).fetchone()
+        return row or (None, None)
+
+    def seen(self, url, headers):
+        with self.lock:
+            self.pending[url] = (headers.get('etag'), headers.get('last-modified'), time.time())
+
+    def commit(self, urls):
+        with self.lock:
+            rows = [(url,) + self.pending.pop(url) for url in urls if url in self.pending]
+            self.db.executemany(
+                "INSERT OR REPLACE INTO pages (url, etag, last_modified, fetched_at) VALUES (?, ?, ?, ?)", rows
+            )
+            self.db.commit()
+
+
+class PageFetcher(object):
+    """One pooled HTTP client shared by every worker thread, so connections and TLS sessions are reused."""
+
+    def __init__(self, state=None, limiter=None, cache=None, timeout=15, max_connections=100):
+        self.state = state
+        self.cache = cache
+        self.limiter = limiter or DomainLimiter()
+        self.client = httpx.Client(
+            timeout=timeout,
+            follow_redirects=True,
+            headers={"User-Agent": USER_AGENT},
+            limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections)
+        )
+        self.counts = Counter()
+        self.counts_lock = threading.Lock()
+
+    def count(self, key):
+        with self.counts_lock:
+            self.counts[key] += 1
+
+    def fetch(self, url):
+        headers = {}
+        if self.state:
+            etag, last_modified = self.state.validators(url)
+            if etag:
+                headers['If-None-Match'] = etag
+            if last_modified:
+                headers['If-Modified-Since'] = last_modified
+
+        with self.limiter.slot(domain(url)):
+            try:
+                response = self.client.get(url, headers=headers)
+            except httpx.HTTPError:
+                self.count('errors')
+                raise
+
+        if response.status_code == 304:
+            self.count('not_modified')
+            raise PageNotModified(url)
+        if response.is_error:
+            self.count('errors')
+            response.raise_for_status()
+
+        self.count('fetched')
+        if self.state:
+            self.state.seen(url, response.headers)
+        page = Page(url, response.status_code, response.text, dict(response.headers))
+        if self.cache:
+            self.cache.store(page)
+        return page
+
+    def stats(self):
+        with self.counts_lock:
+            return dict(self.counts)
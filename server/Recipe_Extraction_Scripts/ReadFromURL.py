@@ -11,13 +11,28 @@ import csv
 import argparse
 import re
 import json
-import requests
 from pathlib import Path
 from urllib.parse import urlparse
 
-from recipe_scrapers import scrape_me           
+from recipe_scrapers import scrape_html         
 import extruct                                   
 from bs4 import BeautifulSoup 
+from Neo4j_writer import BulkRecipeWriter
+from LLM_pool import LLMWorkerPool
+from Batch_jobs import BatchJob, ResultPending, gather
+from Extraction_cache import CachedPool, ExtractionCache
+from Page_fetcher import FetchState, PageFetcher, PageNotModified, DomainLimiter, interleave_by_domain
+from Page_cache import PageCache
+from Ingredient_parser import IngredientParser, merge_names, parse_line, split_lines
+from Recipe_schema import FIELDS, describe, response_format, validate
+from langchain_core.output_parsers import JsonOutputParser
+from langchain_core.exceptions import OutputParserException
+from concurrent.futures import ThreadPoolExecutor
+from collections import Counter
+import threading
+from itertools import islice
+import sys
+import time
 
 import json
 import traceback
@@ -25,12 +40,24 @@ from openai import OpenAI
 
 load_dotenv()
 
+# retries are left to the worker pool so 429s back off across all workers together
 llm = ChatOpenAI(
     model="gpt-4o-mini",
     temperature=0,
-    openai_api_key=os.getenv("OPENAI_API_KEY")
+    openai_api_key=os.getenv("OPENAI_API_KEY"),
+    max_retries=0
 )
 
+# calls already made with the same prompt and input are answered from disk
+llm_pool = CachedPool(LLMWorkerPool(), ExtractionCache())
+ingredient_parser = IngredientParser()
+
+# every downloaded page is kept compressed so extraction can be rerun offline with --from-cache
+page_cache = PageCache()
+# pooled HTTP client shared by every page, remembers ETag/Last-Modified so unchanged pages answer 304
+fetcher = PageFetcher(FetchState(), cache=page_cache)
+URL_WORKERS = int(os.getenv('URL_WORKERS', '16'))
+
 parser = CommaSeparatedListOutputParser()
 
 prompt = ChatPromptTemplate.from_messages([
@@ -86,7 +113,7 @@ def fill_missing_fields(recipe: dict) -> dict:
         "Yield": recipe.get("Yield", ""),
         "Total Time": recipe.get("Total Time", "")
     }
-    response = fill_fields_chain.invoke({"input": str(input_text)})
+    response = llm_pool.invoke(fill_fields_chain, {"input": str(input_text)})
     try:
         filled = json.loads(response.content)
     except Exception as e:
@@ -100,17 +127,80 @@ def fill_missing_fields(recipe: dict) -> dict:
     })
     return recipe
 
+# One structured output call returns every field the three calls above used to, the recipe text is only sent once.
+# The answer is checked against Recipe_schema and a field that fails is asked for again on its own.
+recipe_prompt = ChatPromptTemplate.from_messages([
+    ("system", """
+        You extract the fields of a scraped recipe. Output a JSON object with exactly these keys:
+""" + describe(FIELDS) + """
+        If you are uncertain, make your best reasonable guess based on the ingredients and instructions.
+    """),
+    ("user", "{input}")
+])
+
+recipe_chain = recipe_prompt | llm.bind(response_format=response_format(list(FIELDS))) | JsonOutputParser()
+
+def field_chain(field):
+    field_prompt = ChatPromptTemplate.from_messages([
+        ("system", """
+        You extract one field of a scraped recipe. Output a JSON object with exactly this key:
+""" + describe([field])),
+        ("user", "{input}")
+    ])
+    return field_prompt | llm.bind(response_format=response_format([field])) | JsonOutputParser()
+
+field_chains = {field: field_chain(field) for field in FIELDS}
+field_retries = Counter()
+field_retries_lock = threading.Lock()
+
+def recipe_input(meta, ingredient_lines, unsure, raw_instructions):
+    """The recipe as the model sees it, the ingredient lines the local parser could not handle are marked with *."""
+    unsure = set(unsure)
+    ingredients = "\n".join(("* " if line in unsure else "") + line for line in ingredient_lines)
+    return (f"Recipe Name: {meta['name']}\nYield: {meta['servings']}\nTotal Time: {meta['total_time']}\n"
+            f"Ingredients:\n{ingredients}\nInstructions:\n{raw_instructions}")
+
+def invoke_json(chain, text):
+    try:
+        return llm_pool.invoke(chain, {"input": text})
+    except OutputParserException as e:
+        print(f"Model output is not valid JSON: {e}")
+        return None
+
+def extract_fields(meta, raw_ingredients, raw_instructions):
+    """ingredients_list, instructions, category, cuisine and difficulty from one call, plus one call per field
+    that failed validation. Fields that fail twice are left out for the caller to fill in."""
+    names, unsure = ingredient_parser.parse(raw_ingredients)
+    text = recipe_input(meta, split_lines(raw_ingredients), unsure, raw_instructions)
+    fields, failed = validate(invoke_json(recipe_chain, text), list(FIELDS), unsure)
+
+    retried = gather(*[lambda field=field: invoke_json(field_chains[field], text) for field in failed])
+    for field, answer in zip(failed, retried):
+        value, still_failed = validate(answer, [field], unsure)
+        fields.update(value)
+        with field_retries_lock:
+            field_retries[field] += 1
+        if still_failed:
+            print(f"{field} failed validation twice for {meta['name']}")
+
+    if "ingredients_list" in fields:
+        fields["ingredients_list"] = merge_names(names, fields["ingredients_list"])
+    else:
+        # the unsure lines' best local guess is still better than dropping them
+        fields["ingredients_list"] = merge_names(names, [name for name, _ in map(parse_line, unsure) if name])
+    return fields
+
 def parse_instructions(instructions_text):
     """Parse the instructions text using the Groq model."""
-    result = chain_instructions.invoke({"input": instructions_text})
+    result = llm_pool.invoke(chain_instructions, {"input": instructions_text})
     return result.content.strip()
 
 def parse_ingredients(ingredients_text):
-    """Parse the ingredients text using the Groq model."""
-    result = chain.invoke({"input": ingredients_text})
-    result = result[1:]
-    result = [item.lstrip('- ').strip() for item in result]
-    return result
+    """Parse the ingredient lines with the local rules, only the lines they are unsure about go to the Groq model."""
+    names, unsure = ingredient_parser.parse(ingredients_text)
+    if not unsure:
+        return names
+    return merge_names(names, llm_pool.invoke(chain, {"input": "\n".join(unsure)}))
 
 def _slug_to_cuisine(slug: str) -> str:
     """Cheap guess: pull 'mexican', 'italian', etc. from the domain or url path."""
@@ -130,50 +220,6 @@ def _extract_json_ld(html, url):
         if isinstance(block, dict) and block.get("@type") in {"Recipe", ["Recipe"]}:
             return block
     return None
-def create_recipe(driver, recipe):
-    query = """
-    MERGE (r:Recipe {name: $name})
-    SET r.instructions = $instructions
-    SET r.ingredients = $ingredients
-    """
-    parameters = {
-        "name": recipe["Recipe Name"],
-        "instructions": recipe["Instructions"],
-        "ingredients": recipe["Ingredients"]
-    }
-
-    with driver.session() as session:
-        session.run(query, parameters)
-
-def create_ingredients(driver, recipe_name, ingredients):
-     with driver.session() as session:
-        for name in ingredients:
-            query = """
-            MERGE (i:Ingredient {name: $ingredient_name})
-            WITH i
-            MATCH (r:Recipe {name: $recipe_name})
-            CREATE (r)-[:CONTAINS]->(i)
-            """
-            session.run(query, ingredient_name=name.lower(), recipe_name=recipe_name)
-
-def create_optional_field(driver, recipe_name, field_value, node_label, relationship_type):
-    query = f"""
-    MERGE (n:{node_label} {{value: $field_value}})
-    WITH n
-    MATCH (r:Recipe {{name: $recipe_name}})
-    CREATE (r)-[:{relationship_type}]->(n)
-    """
-    
-    parameters = {
-        "recipe_name": recipe_name,
-        "field_value": field_value,
-        "node_label": node_label, 
-        "relationship_type": relationship_type
-    }
-
-    with driver.session() as session:
-        session.run(query, parameters)
-
 def close_neo4j_driver(driver):
     driver.close()
 
@@ -188,31 +234,7 @@ def init_neo4j_driver():
 
 def save_results_to_neo4j(data):
     driver = init_neo4j_driver()
-    for recipe in data:
-        create_recipe(driver, recipe)
-        
-        create_ingredients(driver, recipe["Recipe Name"], recipe["Ingredients_list"])
-
-        if recipe["Total Time"] != '':
-            create_optional_field(driver, recipe["Recipe Name"], recipe["Total Time"], "TotalTime", "HAS_TOTAL_TIME")
-        
-        if recipe["Yield"] != '':
-            create_optional_field(driver, recipe["Recipe Name"], recipe["Yield"], "Yield", "HAS_YIELD")
-        
-        if recipe["Nutrition"] != '':
-            create_optional_field(driver, recipe["Recipe Name"], recipe["Nutrition"], "Nutrition", "HAS_NUTRITION")
-        
-        if recipe["Category"] != '':
-            create_optional_field(driver, recipe["Recipe Name"], recipe["Category"], "Category", "BELONGS_TO_CATEGORY")
-        
-        if recipe["Cuisine"] != '':
-            create_optional_field(driver, recipe["Recipe Name"], recipe["Cuisine"], "Cuisine", "HAS_CUISINE")
-        
-        if recipe["Difficulty"] != '':
-            create_optional_field(driver, recipe["Recipe Name"], recipe["Difficulty"], "Difficulty", "HAS_DIFFICULTY")
-        
-        print("Added recipe to Neo4j.")
-    
+    BulkRecipeWriter(driver).write(data)
     close_neo4j_driver(driver)
 
 
@@ -224,8 +246,14 @@ def scrape_recipe(url: str) -> dict:
         Category, Cuisine, Difficulty, Recipe Name, Ingredients, Instructions,
         Yield, Total Time, Nutrition, Ingredients_list
     """
+    page = fetcher.fetch(url)
+    return extract_recipe(page.html, url)
+
+
+def read_page(html: str, url: str):
+    """The raw ingredients, raw instructions and metadata of a downloaded page, before any LLM call."""
     try:
-        scraper = scrape_me(url)        
+        scraper = scrape_html(html, org_url=url)
         raw_ingredients = "\n".join(scraper.ingredients())
         raw_instructions = scraper.instructions()
         meta = {
@@ -236,10 +264,6 @@ def scrape_recipe(url: str) -> dict:
             "category": ", ".join(scraper.categories()) if hasattr(scraper, "categories") else "",
         }
     except Exception:
-        resp = requests.get(url, timeout=15)
-        resp.raise_for_status()
-        html = resp.text
-
         data = _extract_json_ld(html, url)
         if not data:                      
             soup = BeautifulSoup(html, "html.parser")
@@ -275,9 +299,13 @@ def scrape_recipe(url: str) -> dict:
                 "nutrition": json.dumps(data.get("nutrition", {})),
                 "category": ", ".join(data.get("recipeCategory", [])) if isinstance(data.get("recipeCategory", []), list) else data.get("recipeCategory", ""),
             }
+    return raw_ingredients, raw_instructions, meta
+
 
-    ingredients_list = parse_ingredients(raw_ingredients)
-    instructions_std = parse_instructions(raw_instructions)
+def extract_recipe(html: str, url: str, single_call=True) -> dict:
+    """Build the record for scrape_recipe() from an already downloaded page, Category, Cuisine and Difficulty
+    included. single_call=False is the old path of three chains in a row, kept for Compare_extraction.py."""
+    raw_ingredients, raw_instructions, meta = read_page(html, url)
 
     domain_bits = urlparse(url).netloc.split(".")
     cuisine_guess = _slug_to_cuisine("/".join(domain_bits + url.split("/")))
@@ -285,15 +313,29 @@ def scrape_recipe(url: str) -> dict:
     record = {
         "Category": meta["category"],
         "Cuisine": cuisine_guess,
-        "Difficulty": "",                     
+        "Difficulty": "",
         "Recipe Name": meta["name"],
         "Ingredients": raw_ingredients,
-        "Instructions": instructions_std,
         "Yield": meta["servings"],
         "Total Time": meta["total_time"],
         "Nutrition": meta["nutrition"],
-        "Ingredients_list": ingredients_list,
     }
+
+    if not single_call:
+        record["Ingredients_list"], record["Instructions"] = gather(
+            lambda: parse_ingredients(raw_ingredients),
+            lambda: parse_instructions(raw_instructions)
+        )
+        return fill_missing_fields(record)
+
+    fields = extract_fields(meta, raw_ingredients, raw_instructions)
+    record.update({
+        "Category": fields.get("category", record["Category"]),
+        "Cuisine": fields.get("cuisine", record["Cuisine"]),
+        "Difficulty": fields.get("difficulty", ""),
+        "Instructions": fields.get("instructions", " ".join(raw_instructions.split())),
+        "Ingredients_list": fields["ingredients_list"],
+    })
     return record
 
 
@@ -301,7 +343,6 @@ def scrape_and_ingest(url: str):
     """High‑level helper: scrape → push to Neo4j."""
     try:
       recipe = scrape_recipe(url)
-      filled_recipe = fill_missing_fields(recipe)
     except:
       pass
 
@@ -360,19 +401,26 @@ def regenerate_recipe_via_search(url):
 
     return regenerated_recipe
 
-def safe_scrape_and_fill(url):
+def safe_scrape_and_fill(url, page=None, fallback=True):
     """
-    Try scraping and filling a recipe.
-    If that fails, fall back to GPT-4o with search to reconstruct the recipe.
+    Try scraping and filling a recipe, from the given page if there is one instead of downloading it.
+    If that fails, fall back to GPT-4o with search to reconstruct the recipe (unless fallback is off).
     """
     try:
-        recipe = scrape_recipe(url)
-        filled_recipe = fill_missing_fields(recipe)
+        filled_recipe = extract_recipe(page.html, url) if page else scrape_recipe(url)
         print(f"Successfully scraped and filled {filled_recipe.get('Recipe Name', '(unknown)')}")
         return filled_recipe
+    except ResultPending:
+        # batch mode, the page is ingested once its results are in
+        return None
+    except PageNotModified:
+        print(f"Not modified since last ingest: {url}")
+        return None
     except Exception as e:
         print(f"Primary scrape and fill failed for {url}: {e}")
         print(traceback.format_exc())
+        if not fallback:
+            return None
         print("Falling back to GPT-4o with search...")
 
         fallback_recipe = regenerate_recipe_via_search(url)
@@ -382,11 +430,97 @@ def safe_scrape_and_fill(url):
         else:
             print(f"Completely failed to retrieve recipe for {url}")
             return None
-    
+
+def read_urls(args):
+    urls = list(args.urls)
+    if args.urls_file:
+        f = sys.stdin if args.urls_file == '-' else open(args.urls_file, encoding='utf-8')
+        with f:
+            urls.extend(line.strip() for line in f if line.strip() and not line.startswith('#'))
+    # drop repeats but keep the first-seen order
+    return list(dict.fromkeys(urls))
+
+def reprocess_cached(url):
+    # --from-cache: the stored page only, no download and no web search fallback
+    page = page_cache.get(url)
+    if page is None:
+        print(f"Not in the page cache: {url}")
+        return None
+    return safe_scrape_and_fill(url, page, fallback=False)
+
+def ingest_urls(urls, writer=None, workers=URL_WORKERS, from_cache=False, output=None):
+    """Scrape the urls concurrently and hand the records to the writer one batch at a time as they come in.
+    The results stay in the order of urls. Writer None means a dry run, output is an optional JSONL file
+    that gets every record (e.g. to diff parser changes over the cached corpus)."""
+    start = time.perf_counter()
+    batch_size = writer.batch_size if writer else 100
+    written = 0
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        results = zip(urls, executor.map(reprocess_cached if from_cache else safe_scrape_and_fill, urls))
+        while True:
+            batch = list(islice(results, batch_size))
+            if not batch:
+                break
+            recipes = [recipe for _, recipe in batch if recipe]
+            if output:
+                for url, recipe in batch:
+                    if recipe:
+                        output.write(json.dumps(dict(recipe, url=url)) + "\n")
+            if writer:
+                writer.write(recipes)
+                # validators are only kept for pages that made it into the graph
+                fetcher.state.commit([url for url, recipe in batch if recipe])
+            written += len(recipes)
+
+    elapsed = time.perf_counter() - start
+    print(f"{len(urls)} urls in {elapsed:.1f} s ({len(urls) / elapsed if elapsed else 0.0:.1f} pages/sec), "
+          f"{written} recipes {'parsed' if writer is None else 'written'}, pages: {fetcher.stats()}")
+    return written
+
 
 if __name__ == "__main__":
-    parser = argparse.ArgumentParser(description="Scrape a recipe URL and ingest it into Neo4j.")
-    parser.add_argument("url", help="Web address of the recipe page")
+    parser = argparse.ArgumentParser(description="Scrape recipe URLs and ingest them into Neo4j.")
+    parser.add_argument("urls", nargs="*", help="Web addresses of the recipe pages")
+    parser.add_argument("--urls-file", help="File with one url per line, '-' reads them from stdin")
+    parser.add_argument("--workers", type=int, default=URL_WORKERS, help="Pages processed at the same time")
+    parser.add_argument("--per-domain", type=int, default=None, help="Requests in flight per domain (default URL_PER_DOMAIN)")
+    parser.add_argument("--delay", type=float, default=None, help="Seconds between requests to the same domain (default URL_DOMAIN_DELAY)")
+    parser.add_argument("--dry-run", action="store_true", help="Scrape and parse but do not write to Neo4j")
+    parser.add_argument("--from-cache", action="store_true", help="Rerun extraction over the page cache (the given urls, or all of it) without downloading anything")
+    parser.add_argument("--offline", action="store_true", help="Only answer LLM calls from the extraction cache, the rest are counted as pending")
+    parser.add_argument("--output", help="Also write every extracted record to this JSONL file")
+    parser.add_argument("--batch-requests", help="Batch mode: write the LLM calls still missing a result to this JSONL file")
+    parser.add_argument("--batch-results", action="append", help="Batch mode: JSONL results file(s) to answer calls from")
     args = parser.parse_args()
-    data = safe_scrape_and_fill(args.url)
-    save_results_to_neo4j(data)
\ No newline at end of file
+    if args.batch_requests or args.offline:
+        # with no results to answer from, a BatchJob just queues every call the extraction cache cannot answer
+        llm_pool = CachedPool(BatchJob(args.batch_results), ExtractionCache())
+    if args.per_domain is not None or args.delay is not None:
+        fetcher.limiter = DomainLimiter(
+            args.per_domain if args.per_domain is not None else fetcher.limiter.max_concurrent,
+            args.delay if args.delay is not None else fetcher.limiter.delay
+        )
+
+    if args.from_cache:
+        urls = read_urls(args) or page_cache.urls()
+        print(f"Page cache: {page_cache.stats()}")
+    else:
+        urls = interleave_by_domain(read_urls(args))
+
+    output = open(args.output, 'w', encoding='utf-8') if args.output else None
+    try:
+        if args.dry_run:
+            ingest_urls(urls, None, args.workers, args.from_cache, output)
+        else:
+            driver = init_neo4j_driver()
+            try:
+                ingest_urls(urls, BulkRecipeWriter(driver), args.workers, args.from_cache, output)
+            finally:
+                close_neo4j_driver(driver)
+    finally:
+        if output:
+            output.close()
+    print(f"LLM calls: {llm_pool.stats()}")
+    print(f"Ingredient lines: {ingredient_parser.stats()}")
+    if args.batch_requests:
+        print(f"{llm_pool.write_requests(args.batch_requests)} calls still pending, written to {args.batch_requests}")
\ No newline at end of file
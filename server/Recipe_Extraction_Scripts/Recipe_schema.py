@@ -0,0 +1,76 @@
+import re
+
+# The fields ReadFromURL asks the model for in one structured output call, with the JSON schema sent as the
+# response_format and the checks its answer has to pass. A field that fails is asked for again on its own.
+
+DIFFICULTIES = ["Easy", "Intermediate", "Hard"]
+
+FIELDS = {
+    "ingredients_list": (
+        {"type": "array", "items": {"type": "string"}},
+        "The core ingredient name (no amounts, adjectives, or descriptors) of every ingredient line marked with *, "
+        "e.g. [\"Flour\", \"Eggs\", \"Milk\"]. An empty list when no line is marked."
+    ),
+    "instructions": (
+        {"type": "string"},
+        "The steps as a single string with each step numbered and no new lines, extra spacing or backslashes, "
+        "e.g. \"1. Preheat oven to 350°F. 2. Mix ingredients. 3. Bake for 30 minutes.\""
+    ),
+    "category": ({"type": "string"}, "The course, e.g. \"Dessert\", \"Main Course\", \"Appetizer\"."),
+    "cuisine": ({"type": "string"}, "e.g. \"American\", \"Italian\", \"French\"."),
+    "difficulty": ({"type": "string", "enum": DIFFICULTIES}, "One of " + ", ".join(DIFFICULTIES) + "."),
+}
+
+
+def response_format(fields):
+    """OpenAI json_schema response format for the given fields, strict so every field is always present."""
+    return {
+        "type": "json_schema",
+        "json_schema": {
+            "name": "recipe_" + "_".join(fields) if len(fields) == 1 else "recipe_fields",
+            "strict": True,
+            "schema": {
+                "type": "object",
+                "properties": {field: FIELDS[field][0] for field in fields},
+                "required": list(fields),
+                "additionalProperties": False,
+            },
+        },
+    }
+
+
+def describe(fields):
+    # literal braces would be read as prompt variables, none of the descriptions use them
+    return "\n".join(f"- {field}: {FIELDS[field][1]}" for field in fields)
+
+
+def check_field(field, value, marked_lines):
+    """Returns the cleaned value, or None when it does not pass. Not every provider enforces the schema."""
+    if field == "ingredients_list":
+        if not isinstance(value, list) or not all(isinstance(item, str) for item in value):
+            return None
+        items = [item.strip() for item in value if item.strip()]
+        # "DO NOT RETURN AN EMPTY LIST" in the old prompt, only marked lines are asked for now
+        return items if items or not marked_lines else None
+    if not isinstance(value, str) or not value.strip():
+        return None
+    value = " ".join(value.replace("\\n", " ").split())
+    if field == "difficulty":
+        value = "Intermediate" if value.lower() == "medium" else value.capitalize()
+        return value if value in DIFFICULTIES else None
+    if field == "instructions" and not re.match(r"^1[.)]", value):
+        return None
+    return value
+
+
+def validate(data, fields, marked_lines):
+    """Splits an answer into the fields that passed and the ones to ask for again."""
+    valid = {}
+    failed = []
+    for field in fields:
+        value = check_field(field, data.get(field), marked_lines) if isinstance(data, dict) else None
+        if value is None:
+            failed.append(field)
+        else:
+            valid[field] = value
+    return valid, failed
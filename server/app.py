@@ -1,140 +1,203 @@
-from flask import Flask, jsonify, request
+from flask import Flask, Response, jsonify, request, stream_with_context
 from flask_cors import CORS
-from rag import query_cypher
-from langchain.memory import ConversationBufferMemory
-from NER import build_patterns, extract_recipe_criteria, extract_restaurant_criteria
-from basicChatStructure import intent_parser, get_last_k_messages
+from rag import query_cypher, stream_cypher
+from NER import build_patterns
+from basicChatStructure import intent_parser, get_last_k_messages, response_cache
+from conversation import GRAPH_INTENTS, Conversation, QueryRequest, extract_criteria, pantry_response, question_with_context
+from speculation import Speculation, SpeculationStats, predict_branch
+from session_store import create_session_store
+from concurrent.futures import ThreadPoolExecutor
+import metrics
+import asyncio
+import contextvars
+import json
+import os
 
 app = Flask(__name__)
 cors = CORS(app, origins='*')
 
-# Simple memory store per user (by IP)
-user_memory = {}
+# Speculative mode starts the likely graph pipeline while the intent is still being classified
+SPECULATIVE_MODE = os.getenv('SPECULATIVE_MODE', 'false').lower() == 'true'
+speculation_executor = ThreadPoolExecutor(max_workers=int(os.getenv('SPECULATIVE_WORKERS', '8')))
+speculation_stats = SpeculationStats()
+
+# Conversation memory per session, bounded and optionally shared between workers (see session_store.py)
+session_store = create_session_store()
 nlp = build_patterns() #create patterns for NER
 
 #decalres intent parser object 
 conservational_intent_parser = intent_parser()
 
+# Requests whose stages are timed, see metrics.py
+TIMED_ENDPOINTS = ('query', 'query_stream')
+
+def submit(fn, *args):
+    # run on a worker thread inside this request's context, so its timing spans are counted for the request
+    return speculation_executor.submit(contextvars.copy_context().run, fn, *args)
+
+def classify_intent(query):
+    with metrics.span('intent'):
+        return conservational_intent_parser.parse_global_user_intent(query)
+
+def run_graph_branch(speculation, graph_query, criteria, name, direct):
+    # spans go to the branch's own timings, a discarded branch must not show up in the request's breakdown
+    with metrics.request_scope(speculation.timings):
+        # query_cypher is a coroutine, give it its own event loop when running on a worker thread
+        return asyncio.run(query_cypher(graph_query, speculation.graph_intent, criteria, name=name, direct=direct,
+                                        cancelled=speculation.cancelled))
+
+def start_speculation(doc, graph_query, turn, direct):
+    graph_intent = predict_branch(doc)
+    if graph_intent is None:
+        speculation_stats.record('skipped')
+        return None
+
+    criteria = extract_criteria(doc, graph_intent, turn)
+    speculation = Speculation(graph_intent, metrics.RequestTimings('speculation'), metrics.current_request.get())
+    speculation.future = submit(run_graph_branch, speculation, graph_query, criteria, turn.name, direct)
+    return speculation
+
+class SpeculativeConversation(Conversation):
+    # classify remotely while running NER locally and starting the most likely graph query
+    async def classify(self, question, turn, direct):
+        intent_future = submit(classify_intent, question)
+        with metrics.span('ner'):
+            doc = self.nlp(turn.query)
+        speculation = start_speculation(doc, question, turn, direct)
+        global_intent = intent_future.result()
+        if speculation is not None and not speculation.resolve(global_intent.strip().lower(), speculation_stats):
+            speculation = None
+        app.logger.info(f"Speculation stats: {speculation_stats.snapshot()}")
+        return global_intent, doc, speculation
+
+conversation = (SpeculativeConversation if SPECULATIVE_MODE else Conversation)(conservational_intent_parser, nlp)
+
+@app.before_request
+def start_timing():
+    if request.endpoint in TIMED_ENDPOINTS:
+        metrics.start_request(request.endpoint)
+
+@app.after_request
+def add_server_timing(response):
+    timings = metrics.current_request.get()
+    # a streamed answer is still being produced here, query_stream reports its own timings when it is done
+    if timings is not None and request.endpoint in TIMED_ENDPOINTS and not response.is_streamed:
+        metrics.finish(timings)
+        response.headers['Server-Timing'] = timings.server_timing()
+        # lets the browser show the breakdown for the cross-origin client too
+        response.headers['Timing-Allow-Origin'] = '*'
+    return response
+
+@app.route('/metrics', methods=['GET'])
+def metrics_report():
+    body, content_type = metrics.exposition()
+    return Response(body, mimetype=content_type)
+
+@app.route('/speculation/stats', methods=['GET'])
+def speculation_report():
+    return jsonify(speculation_stats.snapshot())
+
+@app.route('/cache/stats', methods=['GET'])
+def cache_report():
+    return jsonify(response_cache.stats())
+
+# "What can I make with ..." as an API: recipes ranked by how much of them the ingredients cover, no LLM involved
+@app.route('/pantry', methods=['POST'])
+def pantry():
+    body, status = pantry_response(request.json)
+    return jsonify(body), status
+
 @app.route('/query', methods=['POST'])
 async def query():
-    user_query = request.json.get('query', '')
-    allergies = request.json.get('allergies', '')
-    city = request.json.get('city', '')
-    name = request.json.get('name', '')
-    user_id = request.remote_addr
-
-    if not user_query:
+    turn = QueryRequest(request.json, request.remote_addr)
+    if not turn.query:
         return jsonify({"error": "No query provided"}), 400
 
-    # Initialize memory for this user if it doesn't exist 
-    if user_id not in user_memory:
-        user_memory[user_id] = ConversationBufferMemory(memory_key="chat_history", return_messages=True)
-
-    memory = user_memory[user_id]
-    memory.chat_memory.add_user_message(user_query)
-
-    memory_pass = str(get_last_k_messages(memory))
-    
-    # Get the relevant context from the query given the memory
-    relevant_context = conservational_intent_parser.find_relevant_information(user_query, memory_pass)
-    new_user_query = f"""relevant context from previous conversation:{relevant_context}
-    user_question:{user_query}
-"""
-    # Get the user's intent and direct to appropriate pipeline for further processing
-    global_intent = conservational_intent_parser.parse_global_user_intent(new_user_query)
-
-    if global_intent.strip().lower() == 'greetings':
-        temp = conservational_intent_parser.respond_to_greeting(user_query)
-        memory.chat_memory.add_ai_message(str(temp)) 
-        return jsonify({"result": {"result": temp}})
-    elif global_intent.strip().lower() == 'quit chat':
-        temp = conservational_intent_parser.respond_to_quit_chat(user_query)
-        memory.chat_memory.add_ai_message(str(temp)) 
-        return jsonify({"result": {"result": temp}})
-    elif global_intent.strip().lower() == 'express gratitude':
-        temp = conservational_intent_parser.respond_to_gratitude(user_query)
-        memory.chat_memory.add_ai_message(str(temp)) 
-        return jsonify({"result": {"result": temp}})
-    elif global_intent.strip().lower() == 'ask a question':
-        print('entering question pipeline')
-        temp = conservational_intent_parser.respond_to_question(memory_pass)
-        if temp.strip().lower() == 'non food related question':
-            print('entering non food related')
-            temp = conservational_intent_parser.respond_to_NonFood_question(user_query)
-            memory.chat_memory.add_ai_message(str(temp)) 
-            return jsonify({"result": {"result": temp}})
-        elif temp.strip().lower() == 'food related question':
-            print('entering food related')
-            new_user_query = f"""relevant context from previous conversation:{relevant_context}
-user_question:{user_query}
-"""
-            temp = conservational_intent_parser.respond_to_food_question(new_user_query)
-            memory.chat_memory.add_ai_message(str(temp)) 
-            return jsonify({"result": {"result": temp}})
-    elif global_intent.strip().lower() == 'other':
-        temp = conservational_intent_parser.respond_to_other(user_query)
-        memory.chat_memory.add_ai_message(str(temp))
-        return jsonify({"result": {"result": temp}})
-    elif global_intent.strip().lower() == 'find a recipe':
+    # Hold the session for the whole request so messages from the same user stay in order
+    with session_store.session(turn.session_id) as session:
         try:
-            # Get lemmatized ingredients using NER
-            doc = nlp(user_query)
-            criteria = extract_recipe_criteria(doc, allergies)
-
-            # Await the async query_cypher function
-            memory_pass = str(get_last_k_messages(memory)) + f"\nUser: {criteria}"
-            new_user_query = f"""relevant context from previous conversation:{relevant_context}
-user_question:{user_query}"""
-
-            result = await query_cypher(new_user_query, 'find a recipe', criteria, name=name)
-
-            # Save AI response to memory
-            memory.chat_memory.add_ai_message(str(result))
-
-            return jsonify({"result": result})
+            return jsonify(await conversation.answer(session.memory, turn))
         except Exception as e:
             app.logger.error(f"Error: {e}")
             return jsonify({"error": str(e)}), 500
-    elif global_intent.strip().lower() == 'find a restaurant':
-        try:
-            # Get lemmatized ingredients using NER
-            doc = nlp(user_query)
-            criteria = extract_restaurant_criteria(doc, city)
-
-            # Await the async query_cypher function
-            memory_pass = str(get_last_k_messages(memory)) + f"\nUser: {criteria}"
-            new_user_query = f"""relevant context from previous conversation:{relevant_context}
-user_question:{user_query}"""
 
-            result = await query_cypher(new_user_query, 'find a restaurant', criteria, name=name)
+def sse(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+# Pick the streaming conversational answer for every intent that does not need the graph
+def stream_conversation(global_intent, user_query, new_user_query, memory_pass):
+    if global_intent == 'greetings':
+        return conservational_intent_parser.respond_to_greeting(user_query, stream=True)
+    if global_intent == 'quit chat':
+        return conservational_intent_parser.respond_to_quit_chat(user_query, stream=True)
+    if global_intent == 'express gratitude':
+        return conservational_intent_parser.respond_to_gratitude(user_query, stream=True)
+    if global_intent == 'ask a question':
+        with metrics.span('question_type'):
+            question_type = conservational_intent_parser.respond_to_question(memory_pass)
+        if question_type.strip().lower() == 'food related question':
+            return conservational_intent_parser.respond_to_food_question(new_user_query, stream=True)
+        return conservational_intent_parser.respond_to_NonFood_question(user_query, stream=True)
+    return conservational_intent_parser.respond_to_other(user_query, stream=True)
+
+@app.route('/query/stream', methods=['POST'])
+def query_stream():
+    turn = QueryRequest(request.json, request.remote_addr)
+    user_query = turn.query
+    if not user_query:
+        return jsonify({"error": "No query provided"}), 400
 
-            # Save AI response to memory
-            memory.chat_memory.add_ai_message(str(result))
+    # the body is produced after this function returns, so the generator carries the request's timings along
+    timings = metrics.current_request.get()
 
-            return jsonify({"result": result})
-        except Exception as e:
-            app.logger.error(f"Error: {e}")
-            return jsonify({"error": str(e)}), 500
-    else:
-        try:
-            pass
-            # Get lemmatized ingredients using NER
-            doc = nlp(user_query)
-            criteria = extract_recipe_criteria(doc, allergies)
+    def generate():
+        with metrics.request_scope(timings), session_store.session(turn.session_id) as session:
+            try:
+                yield from generate_answer(session.memory)
+            finally:
+                metrics.finish(timings)
 
-            chat_history_msgs = memory.load_memory_variables({})["chat_history"]
-            chat_history_str = "\n".join([msg.content for msg in chat_history_msgs])
-            question_with_memory = chat_history_str + f"\nUser: {criteria}"
+    def generate_answer(memory):
+        memory.chat_memory.add_user_message(user_query)
+        memory_pass = str(get_last_k_messages(memory))
 
-            result = await query_cypher(question_with_memory, criteria, city=city, name=name)
+        with metrics.span('context'):
+            relevant_context = conservational_intent_parser.find_relevant_information(user_query, memory_pass)
+        new_user_query, direct_cypher = question_with_context(relevant_context, user_query)
 
-            # Save AI response to memory
-            memory.chat_memory.add_ai_message(str(result))
+        global_intent = classify_intent(new_user_query).strip().lower()
+        metrics.set_intent(global_intent)
+        yield sse('stage', {"stage": "intent", "intent": global_intent})
 
-            return jsonify({"result": result})
+        answer = []
+        try:
+            if global_intent in GRAPH_INTENTS:
+                criteria = extract_criteria(nlp(user_query), global_intent, turn)
+                for kind, payload in stream_cypher(new_user_query, global_intent, criteria, name=turn.name, direct=direct_cypher):
+                    if kind == 'cypher':
+                        yield sse('stage', {"stage": "cypher", "rows": payload["rows"]})
+                    else:
+                        answer.append(payload)
+                        yield sse('token', {"token": payload})
+            else:
+                tokens = stream_conversation(global_intent, user_query, new_user_query, memory_pass)
+                with metrics.span('answer'):
+                    for token in tokens:
+                        answer.append(token)
+                        yield sse('token', {"token": token})
         except Exception as e:
             app.logger.error(f"Error: {e}")
-            return jsonify({"error": str(e)}), 500
+            yield sse('error', {"error": str(e)})
+            return
+
+        # only remember the answer once the whole thing has been sent
+        result = "".join(answer)
+        memory.chat_memory.add_ai_message(result)
+        # no Server-Timing header on a stream, the breakdown comes with the last event instead
+        yield sse('done', {"result": result, "timings": timings.summary()})
+
+    return Response(stream_with_context(generate()), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
 
 if __name__ == '__main__':
     app.run(debug=True, port=8080, use_reloader=False)
\ No newline at end of file
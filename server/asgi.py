@@ -0,0 +1,65 @@
+# ASGI entry point: the same /query API as app.py, but every OpenAI and Neo4j call is awaited on one event loop
+# so a single process can hold many conversations in flight. Run with: uvicorn asgi:app --port 5000
+from quart import Quart, jsonify, request
+from NER import build_patterns
+from basicChatStructure import async_intent_parser, response_cache
+from conversation import Conversation, QueryRequest, pantry_response
+from session_store import create_session_store
+import metrics
+
+app = Quart(__name__)
+
+# Conversation memory per session, bounded and optionally shared between workers (see session_store.py)
+session_store = create_session_store()
+nlp = build_patterns() #create patterns for NER
+
+conversational_intent_parser = async_intent_parser()
+# the same turn as app.py, with the intent parser's LLM calls and the graph steps awaited
+conversation = Conversation(conversational_intent_parser, nlp, awaited=True)
+
+@app.before_request
+async def start_timing():
+    if request.endpoint == 'query':
+        metrics.start_request(request.endpoint)
+
+@app.after_request
+async def allow_cors(response):
+    response.headers['Access-Control-Allow-Origin'] = '*'
+    response.headers['Access-Control-Allow-Headers'] = 'Content-Type'
+    response.headers['Access-Control-Allow-Methods'] = 'GET, POST, OPTIONS'
+    timings = metrics.current_request.get()
+    if timings is not None and request.endpoint == 'query':
+        metrics.finish(timings)
+        response.headers['Server-Timing'] = timings.server_timing()
+        # lets the browser show the breakdown for the cross-origin client too
+        response.headers['Timing-Allow-Origin'] = '*'
+    return response
+
+@app.route('/metrics', methods=['GET'])
+async def metrics_report():
+    body, content_type = metrics.exposition()
+    return body, 200, {'Content-Type': content_type}
+
+@app.route('/cache/stats', methods=['GET'])
+async def cache_report():
+    return jsonify(response_cache.stats())
+
+# "What can I make with ..." as an API: recipes ranked by how much of them the ingredients cover, no LLM involved
+@app.route('/pantry', methods=['POST'])
+async def pantry():
+    body, status = pantry_response(await request.get_json())
+    return jsonify(body), status
+
+@app.route('/query', methods=['POST'])
+async def query():
+    turn = QueryRequest(await request.get_json(), request.remote_addr)
+    if not turn.query:
+        return jsonify({"error": "No query provided"}), 400
+
+    # Hold the session for the whole request so messages from the same user stay in order
+    async with session_store.async_session(turn.session_id) as session:
+        try:
+            return jsonify(await conversation.answer(session.memory, turn))
+        except Exception as e:
+            app.logger.error(f"Error: {e}")
+            return jsonify({"error": str(e)}), 500
@@ -1,4 +1,4 @@
-from openai import OpenAI
+from openai import OpenAI, AsyncOpenAI
 import numpy as np
 import os
 import random
@@ -7,8 +7,34 @@ import openai
 #from sentence_transformers import SentenceTransformer, util
 import re
 import json
+import time
+import threading
+from intent_classifier import IntentClassifier
+from response_cache import ResponseCache
+import metrics
 
 client = OpenAI()
+async_client = AsyncOpenAI()
+MODEL = "gpt-4o-mini"
+
+# Cache for repeated prompts, set OPENAI_CACHE_PATH to keep it on disk between restarts
+response_cache = ResponseCache(
+    max_entries=int(os.getenv('OPENAI_CACHE_SIZE', '1024')),
+    ttl=float(os.getenv('OPENAI_CACHE_TTL', '86400')),
+    path=os.getenv('OPENAI_CACHE_PATH')
+)
+# Non zero temperature answers are meant to vary so they are not cached unless asked for
+CACHE_ALL_TEMPERATURES = os.getenv('OPENAI_CACHE_ALL_TEMPERATURES', 'false').lower() == 'true'
+
+# Optional local intent classifier that answers confident cases without calling the LLM
+INTENT_CLASSIFIER_PATH = os.getenv('INTENT_CLASSIFIER_PATH', 'intent_model.json')
+# by default the threshold tuned on held-out queries when the model was trained, this overrides it
+INTENT_CONFIDENCE_THRESHOLD = os.getenv('INTENT_CONFIDENCE_THRESHOLD')
+# for models trained before calibration, their raw posteriors are close to 1.0 for most queries
+UNCALIBRATED_CONFIDENCE_THRESHOLD = 0.99
+# Optional JSONL file where LLM intent labels are logged to train the local classifier
+INTENT_LOG_PATH = os.getenv('INTENT_LOG_PATH')
+intent_log_lock = threading.Lock()
 
 def get_last_k_messages(memory, k = 5):
     # Get the underlying messages
@@ -17,86 +43,185 @@ def get_last_k_messages(memory, k = 5):
     return messages[-k:] if k <= len(messages) else messages
 
 
+def cache_key(user_input, system_instruction, temperature):
+    # None means the call should not be cached
+    if temperature != 0 and not CACHE_ALL_TEMPERATURES:
+        return None
+    return response_cache.key(MODEL, system_instruction, user_input, temperature)
+
+def build_messages(user_input, system_instruction):
+    return [
+        {"role": "system", "content": system_instruction},
+        {"role": "user", "content": user_input}
+    ]
+
 def ask_openai(user_input, system_instruction, temperature=0.0):
+    key = cache_key(user_input, system_instruction, temperature)
+    cached = response_cache.get(key) if key else None
+    if cached is not None:
+        return cached
+
+    metrics.count('llm')
     response = client.chat.completions.create(
-        model="gpt-4o-mini",
-        messages=[
-            {"role": "system", "content": system_instruction},
-            {"role": "user", "content": user_input}
-        ],
+        model=MODEL,
+        messages=build_messages(user_input, system_instruction),
+        temperature=temperature
+    )
+    content = response.choices[0].message.content
+
+    if key and content is not None:
+        response_cache.set(key, content)
+    return content
+
+async def aask_openai(user_input, system_instruction, temperature=0.0):
+    # Same as ask_openai but through the AsyncOpenAI client so the event loop is free while waiting
+    key = cache_key(user_input, system_instruction, temperature)
+    cached = response_cache.get(key) if key else None
+    if cached is not None:
+        return cached
+
+    metrics.count('llm')
+    response = await async_client.chat.completions.create(
+        model=MODEL,
+        messages=build_messages(user_input, system_instruction),
         temperature=temperature
     )
-    return response.choices[0].message.content
+    content = response.choices[0].message.content
+
+    if key and content is not None:
+        response_cache.set(key, content)
+    return content
+
+def stream_openai(user_input, system_instruction, temperature=0.0):
+    # Same as ask_openai but yields the answer piece by piece as the model produces it
+    key = cache_key(user_input, system_instruction, temperature)
+    cached = response_cache.get(key) if key else None
+    if cached is not None:
+        yield cached
+        return
+
+    metrics.count('llm')
+    stream = client.chat.completions.create(
+        model=MODEL,
+        messages=build_messages(user_input, system_instruction),
+        temperature=temperature,
+        stream=True
+    )
+    parts = []
+    for chunk in stream:
+        if chunk.choices and chunk.choices[0].delta.content:
+            parts.append(chunk.choices[0].delta.content)
+            yield chunk.choices[0].delta.content
+
+    if key:
+        response_cache.set(key, "".join(parts))
+
+def log_intent(user_input, global_intent, start):
+    if INTENT_LOG_PATH:
+        record = {"query": user_input, "intent": global_intent, "latency_ms": (time.perf_counter() - start) * 1000}
+        with intent_log_lock, open(INTENT_LOG_PATH, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(record) + "\n")
 
 class intent_parser(object):
-  def __init__(self):
+  def __init__(self, classifier=None, confidence_threshold=INTENT_CONFIDENCE_THRESHOLD):
     self.global_intents = ['Find a recipe', 'Find a restaurant', 'Quit Chat', 'Greetings', 'Express Gratitude',
                            'Ask a Question', 'Other']
     
     self.question_intent = ['Food Related Question', 'Non Food Related Question']
+
+    if classifier is None and os.path.exists(INTENT_CLASSIFIER_PATH):
+        classifier = IntentClassifier.load(INTENT_CLASSIFIER_PATH)
+    self.classifier = classifier
+    if confidence_threshold is None and classifier is not None:
+        confidence_threshold = classifier.threshold
+    self.confidence_threshold = float(confidence_threshold if confidence_threshold is not None
+                                      else UNCALIBRATED_CONFIDENCE_THRESHOLD)
+    self.intent_instruction = 'Please classify the user\'s intent into one of the following categories. Please provide only the option you choose: ' + ', '.join(self.global_intents)
     
   def parse_global_user_intent(self, user_input):
-    system_instruction = 'Please classify the user\'s intent into one of the following categories. Please provide only the option you choose: ' + ', '.join(self.global_intents)
-    global_intent = ask_openai(user_input, system_instruction)
+    # answer confident cases locally and only send the rest to the LLM
+    local_intent = self.local_intent(user_input)
+    if local_intent is not None:
+        return local_intent
 
-    normalized_intents = [intent.lower() for intent in self.global_intents]
-    normalized_response = global_intent.lower()
+    start = time.perf_counter()
+    global_intent = self.classify_with_llm(user_input)
+    log_intent(user_input, global_intent, start)
+    return global_intent
 
+  def local_intent(self, user_input):
+    if self.classifier is None:
+        return None
+    label, confidence = self.classifier.predict(user_input)
+    if label in self.global_intents and confidence >= self.confidence_threshold:
+        return label
+    return None
+
+  def match_intent(self, response):
+    # map the raw LLM answer onto one of the global intents, None if it is not one of them
+    normalized_intents = [intent.lower() for intent in self.global_intents]
+    normalized_response = response.strip().lower()
     if normalized_response not in normalized_intents:
-        global_intent = ask_openai(user_input, system_instruction, temperature=0.5)
-        normalized_response = global_intent.strip().lower()
-    if normalized_response not in normalized_intents:
-        return 'unknown'
+        return None
+    return self.global_intents[normalized_intents.index(normalized_response)]
 
-    intent_index = normalized_intents.index(normalized_response)
-    return self.global_intents[intent_index]
-  
+  def answer(self, user_input, system_instruction, stream=False):
+    # stream=True returns a generator of answer pieces instead of the full string
+    if stream:
+        return stream_openai(user_input, system_instruction)
+    return ask_openai(user_input, system_instruction)
+
+  def classify_with_llm(self, user_input):
+    global_intent = self.match_intent(ask_openai(user_input, self.intent_instruction))
+    if global_intent is None:
+        global_intent = self.match_intent(ask_openai(user_input, self.intent_instruction, temperature=0.5))
+    return global_intent or 'unknown'
   
-  def respond_to_greeting(self, user_input): #async
+  def respond_to_greeting(self, user_input, stream=False): #async
     system_instruction = """You are a friendly assistant that can help users find recipes or resturnats. 
     Please give a friendly response to this user greeting and let them know some of the things that you are able to do such as find a healhty recipe, find a recipe with certain ingredients, 
     find a resturant, etc."""
-    greeting_response = ask_openai(user_input, system_instruction)
+    greeting_response = self.answer(user_input, system_instruction, stream)
     
     return greeting_response
   
-  def respond_to_quit_chat(self, user_input):
+  def respond_to_quit_chat(self, user_input, stream=False):
     system_instruction = """You are a friendly assistant that can help users find recipes or resturnats. 
     The user has expressed that they are done with their current session. Please give them a kind farewell and let them know you are here to help for any future cooking needs"""
-    quit_chat_response = ask_openai(user_input, system_instruction)
+    quit_chat_response = self.answer(user_input, system_instruction, stream)
 
     return quit_chat_response
 
-  def respond_to_gratitude(self, user_input):
+  def respond_to_gratitude(self, user_input, stream=False):
     system_instruction = """You are a friendly assistant that can help users find recipes or resturnats. 
     The user has expressed gratitude for your help. Please provide a friendly answer and let them know you can continue to help them or help them with any new food questions"""
-    gratitude_response = ask_openai(user_input, system_instruction)
+    gratitude_response = self.answer(user_input, system_instruction, stream)
 
     return gratitude_response
   def respond_to_question(self, user_input):
     system_instruction = """You are an assistant that determines whether a user has asked a food related or non food related question. 
     Please respond exactly Food Related Question or Non Food Related Question"""
-    food_question_response = ask_openai(user_input, system_instruction)
+    food_question_response = self.answer(user_input, system_instruction)
     return food_question_response
   
-  def respond_to_food_question(self, user_input):
+  def respond_to_food_question(self, user_input, stream=False):
     system_instruction = """You are a friendly assistant that can help users answer food related questions. 
     Please refer to the current user question and previous input to answer as accurately as possible. 
     Only respond to the most recent user question and use previous input as context"""
-    food_question_response = ask_openai(user_input, system_instruction)
+    food_question_response = self.answer(user_input, system_instruction, stream)
     return food_question_response
     
-  def respond_to_NonFood_question(self, user_input):
+  def respond_to_NonFood_question(self, user_input, stream=False):
     system_instruction = """You are a friendly assistant that can help users find recipes or resturnats. 
     The user has asked a non food related question. Please let them know that unfortunately you cannot help with this as you are designed to only help with food related tasks"""
-    NonFood_response = ask_openai(user_input, system_instruction)
+    NonFood_response = self.answer(user_input, system_instruction, stream)
 
     return NonFood_response
   
-  def respond_to_other(self, user_input):
+  def respond_to_other(self, user_input, stream=False):
     system_instruction = """You are a friendly assistant that can help users find recipes or resturnats. 
     The user has given a response that is irrelevant to food. Please redirct the user by informing them that you are only trained for food related tasks."""
-    other_response = ask_openai(user_input, system_instruction)
+    other_response = self.answer(user_input, system_instruction, stream)
 
     return other_response
   def find_relevant_information(self, current_query, memory):
@@ -107,6 +232,28 @@ class intent_parser(object):
     If the conversation adds no relevant context for their current question please respond None"""
     user_input = f"""previous conversation: {memory}
     current question: {current_query}"""
-    find_info = ask_openai(user_input, system_instruction)
+    find_info = self.answer(user_input, system_instruction)
+
+    return find_info
+
+class async_intent_parser(intent_parser):
+  # Same prompts as intent_parser, but every LLM call goes through the AsyncOpenAI client
+  # so each respond_* method returns a coroutine that has to be awaited
+  def answer(self, user_input, system_instruction, stream=False):
+    return aask_openai(user_input, system_instruction)
+
+  async def parse_global_user_intent(self, user_input):
+    local_intent = self.local_intent(user_input)
+    if local_intent is not None:
+        return local_intent
+
+    start = time.perf_counter()
+    global_intent = await self.classify_with_llm(user_input)
+    log_intent(user_input, global_intent, start)
+    return global_intent
 
-    return find_info
\ No newline at end of file
+  async def classify_with_llm(self, user_input):
+    global_intent = self.match_intent(await aask_openai(user_input, self.intent_instruction))
+    if global_intent is None:
+        global_intent = self.match_intent(await aask_openai(user_input, self.intent_instruction, temperature=0.5))
+    return global_intent or 'unknown'
@@ -0,0 +1,3 @@
+# Offline serving benchmark: a scripted fake OpenAI server (fake_openai.py), a local Neo4j loaded with
+# fixture recipes and restaurants (fixture_graph.py) and a driver that replays conversations (load_driver.py).
+# Run the modules from the server folder, e.g. 'python -m benchmark.load_driver'.
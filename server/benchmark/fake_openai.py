@@ -0,0 +1,169 @@
+import argparse
+import json
+import math
+import os
+import random
+import re
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# OpenAI compatible /v1/chat/completions for benchmarking the server without an API key.
+# Replies come from a script (fixtures/script.json): an ordered list of rules, the first rule whose "prompt" pattern
+# matches the text of all messages and whose "user" pattern matches the last user message answers the call.
+# Each rule can have its own latency distribution, e.g. short intent labels answer faster than the QA step.
+#
+#   python -m benchmark.fake_openai --script benchmark/fixtures/script.json
+#   OPENAI_BASE_URL=http://127.0.0.1:8300/v1 OPENAI_API_KEY=fake flask run
+
+FIXTURES = os.path.join(os.path.dirname(__file__), "fixtures")
+
+
+def latency_sampler(spec, rng):
+    """'fixed:0.3', 'uniform:0.1,0.8', 'normal:0.4,0.1' (mean, sd) or 'lognormal:0.4,0.5' (median, sigma), seconds."""
+    kind, _, args = spec.partition(":")
+    values = [float(v) for v in args.split(",")] if args else []
+    if kind == "fixed":
+        return lambda: values[0]
+    if kind == "uniform":
+        return lambda: rng.uniform(values[0], values[1])
+    if kind == "normal":
+        return lambda: max(0.0, rng.gauss(values[0], values[1]))
+    if kind == "lognormal":
+        return lambda: rng.lognormvariate(math.log(values[0]), values[1])
+    raise ValueError(f"Unknown latency distribution: {spec}")
+
+
+class Script(object):
+    def __init__(self, script, default_latency=None, seed=None, scale=1.0):
+        rng = random.Random(seed)
+        self.scale = scale
+        self.default_latency = latency_sampler(default_latency or script.get("default_latency", "fixed:0"), rng)
+        self.rules = []
+        for rule in script["rules"]:
+            self.rules.append({
+                "name": rule["name"],
+                "prompt": re.compile(rule["prompt"]) if rule.get("prompt") else None,
+                "user": re.compile(rule["user"]) if rule.get("user") else None,
+                "reply": rule["reply"],
+                "latency": latency_sampler(rule["latency"], rng) if rule.get("latency") else self.default_latency,
+            })
+        self.counts = Counter()
+        self.lock = threading.Lock()
+
+    @classmethod
+    def load(cls, path, default_latency=None, seed=None, scale=1.0):
+        with open(path, encoding="utf-8") as f:
+            return cls(json.load(f), default_latency, seed, scale)
+
+    def answer(self, messages):
+        """Returns (rule name, reply, seconds to wait)."""
+        prompt = "\n".join(str(m.get("content", "")) for m in messages)
+        user = next((str(m.get("content", "")) for m in reversed(messages) if m.get("role") == "user"), "")
+        for rule in self.rules:
+            if rule["prompt"] and not rule["prompt"].search(prompt):
+                continue
+            if rule["user"] and not rule["user"].search(user):
+                continue
+            with self.lock:
+                self.counts[rule["name"]] += 1
+            return rule["name"], rule["reply"], rule["latency"]() * self.scale
+        with self.lock:
+            self.counts["unmatched"] += 1
+        return "unmatched", user, self.default_latency() * self.scale
+
+    def stats(self):
+        with self.lock:
+            return dict(self.counts)
+
+
+def usage(messages, content):
+    # about four characters a token, like Recipe_Extraction_Scripts/Fake_LLM_server.py
+    prompt_tokens = sum(len(str(m.get("content", ""))) for m in messages) // 4 + 1
+    completion_tokens = len(content) // 4 + 1
+    return {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens}
+
+
+def completion(body, content):
+    return {
+        "id": "chatcmpl-bench",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": body.get("model", "fake"),
+        "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+        "usage": usage(body.get("messages", []), content),
+    }
+
+
+def chunks(body, content, size=16):
+    base = {"id": "chatcmpl-bench", "object": "chat.completion.chunk", "created": int(time.time()),
+            "model": body.get("model", "fake")}
+    yield dict(base, choices=[{"index": 0, "delta": {"role": "assistant", "content": ""}, "finish_reason": None}])
+    for i in range(0, len(content), size):
+        yield dict(base, choices=[{"index": 0, "delta": {"content": content[i:i + size]}, "finish_reason": None}])
+    yield dict(base, choices=[{"index": 0, "delta": {}, "finish_reason": "stop"}])
+
+
+def handler_for(script):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def do_GET(self):
+            if self.path.rstrip("/").endswith("/stats"):
+                return self.send_json(200, script.stats())
+            self.send_json(404, {"error": {"message": "not found"}})
+
+        def do_POST(self):
+            length = int(self.headers.get("Content-Length", 0))
+            body = json.loads(self.rfile.read(length) or b"{}")
+            if not self.path.endswith("/chat/completions"):
+                return self.send_json(404, {"error": {"message": "not found"}})
+
+            _, content, seconds = script.answer(body.get("messages", []))
+            time.sleep(seconds)
+            if body.get("stream"):
+                return self.send_stream(body, content)
+            self.send_json(200, completion(body, content))
+
+        def send_stream(self, body, content):
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Connection", "close")
+            self.end_headers()
+            for chunk in chunks(body, content):
+                self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode())
+            self.wfile.write(b"data: [DONE]\n\n")
+            self.close_connection = True
+
+        def send_json(self, status, payload):
+            data = json.dumps(payload).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Scripted fake OpenAI server for offline benchmarks.")
+    parser.add_argument("--script", default=os.path.join(FIXTURES, "script.json"))
+    parser.add_argument("--port", type=int, default=8300)
+    parser.add_argument("--latency", help="Default latency for rules without their own, e.g. lognormal:0.8,0.4")
+    parser.add_argument("--scale", type=float, default=1.0, help="Multiply every latency, 0 for the server overhead alone")
+    parser.add_argument("--seed", type=int, help="Seed the latency samples for repeatable runs")
+    args = parser.parse_args()
+
+    script = Script.load(args.script, args.latency, args.seed, args.scale)
+    server = ThreadingHTTPServer(("127.0.0.1", args.port), handler_for(script))
+    print(f"Fake OpenAI server with {len(script.rules)} rules on http://127.0.0.1:{args.port}/v1, GET /stats for rule counts")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
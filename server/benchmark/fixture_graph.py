@@ -0,0 +1,129 @@
+import argparse
+import json
+import os
+import sys
+from urllib.parse import urlparse
+from dotenv import load_dotenv
+from neo4j import GraphDatabase
+
+# Local stand-in for the AuraDB snapshot: an empty Neo4j loaded with the fixture recipes and restaurants,
+# written by the same BulkRecipeWriter the extraction scripts use and indexed like 'graph_schema.py bootstrap'.
+#
+#   docker run -d -p 7687:7687 -e NEO4J_AUTH=neo4j/benchmark neo4j:5
+#   NEO4J_URI=bolt://127.0.0.1:7687 NEO4J_USERNAME=neo4j NEO4J_PASSWORD=benchmark python -m benchmark.fixture_graph load
+
+SERVER = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FIXTURES = os.path.join(os.path.dirname(__file__), "fixtures")
+sys.path.insert(0, SERVER)
+sys.path.insert(0, os.path.join(SERVER, "Recipe_Extraction_Scripts"))
+
+import graph_schema
+import restaurant_geo
+from Neo4j_writer import BulkRecipeWriter
+
+load_dotenv()
+
+LOCAL_HOSTS = ("localhost", "127.0.0.1", "::1")
+
+EXPORT_RECIPES = """
+MATCH (r:Recipe)
+WITH r LIMIT $limit
+OPTIONAL MATCH (r)-[:CONTAINS]->(i:Ingredient)
+WITH r, collect(i.name) AS ingredients
+OPTIONAL MATCH (r)-[]->(f)
+WHERE NOT f:Ingredient
+RETURN r.name AS name, r.instructions AS instructions, r.ingredients AS raw_ingredients, ingredients,
+       collect([labels(f)[0], f.value]) AS facets
+"""
+
+EXPORT_RESTAURANTS = """
+MATCH (n:Restaurant)
+WITH n LIMIT $limit
+OPTIONAL MATCH (n)-[:HAS_TYPE]->(t:Type)
+RETURN n.name AS name, n.address AS address, n.rating AS rating, collect(t.type) AS types,
+       n.location.latitude AS latitude, n.location.longitude AS longitude
+"""
+
+# facet label -> recipe field, the reverse of Neo4j_writer.DEFAULT_FACETS
+FACET_FIELDS = {
+    "TotalTime": "Total Time",
+    "Yield": "Yield",
+    "Nutrition": "Nutrition",
+    "Category": "Category",
+    "Cuisine": "Cuisine",
+    "Difficulty": "Difficulty",
+}
+
+
+def read_fixture(name):
+    with open(os.path.join(FIXTURES, name), encoding="utf-8") as f:
+        return json.load(f)
+
+
+def write_fixture(name, data):
+    with open(os.path.join(FIXTURES, name), "w", encoding="utf-8") as f:
+        json.dump(data, f, indent=1, ensure_ascii=False)
+        f.write("\n")
+
+
+def load(driver, clear=False):
+    if clear:
+        # CALL ... IN TRANSACTIONS needs an auto-commit transaction, which session.run gives
+        with driver.session() as session:
+            session.run("MATCH (n) CALL { WITH n DETACH DELETE n } IN TRANSACTIONS OF 10000 ROWS").consume()
+        print("Cleared the graph")
+
+    recipes = read_fixture("recipes.json")
+    BulkRecipeWriter(driver).write(recipes)
+
+    # parsed into city, state, postal code and, where the fixture has coordinates, a location
+    restaurants = read_fixture("restaurants.json")
+    restaurant_geo.import_restaurants(driver, restaurants)
+    print(f"Loaded {len(recipes)} recipes and {len(restaurants)} restaurants")
+
+    graph_schema.bootstrap(driver)
+
+
+def export(driver, recipes, restaurants):
+    """Sample the real graph into the fixture files, for benchmarks closer to production data."""
+    records, _, _ = driver.execute_query(EXPORT_RECIPES, limit=recipes)
+    rows = []
+    for record in records:
+        recipe = {
+            "Recipe Name": record["name"],
+            "Instructions": record["instructions"] or "",
+            "Ingredients": record["raw_ingredients"] or "",
+            "Ingredients_list": record["ingredients"],
+        }
+        for label, value in record["facets"]:
+            if label in FACET_FIELDS and value is not None:
+                recipe[FACET_FIELDS[label]] = value
+        rows.append(recipe)
+    write_fixture("recipes.json", rows)
+
+    records, _, _ = driver.execute_query(EXPORT_RESTAURANTS, limit=restaurants)
+    write_fixture("restaurants.json", [{k: v for k, v in record.data().items() if v is not None} for record in records])
+    print(f"Exported {len(rows)} recipes and {len(records)} restaurants to {FIXTURES}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load the benchmark fixtures into a local Neo4j, or refresh them from a real graph.")
+    parser.add_argument("command", choices=["load", "export"])
+    parser.add_argument("--clear", action="store_true", help="Delete everything in the graph before loading")
+    parser.add_argument("--force", action="store_true", help="Allow loading into a graph that is not on this machine")
+    parser.add_argument("--recipes", type=int, default=500, help="Recipes to export")
+    parser.add_argument("--restaurants", type=int, default=200, help="Restaurants to export")
+    args = parser.parse_args()
+
+    uri = os.getenv('NEO4J_URI')
+    if args.command == "load" and urlparse(uri or "").hostname not in LOCAL_HOSTS and not args.force:
+        sys.exit(f"Refusing to load fixtures into {uri}, point NEO4J_URI at a local Neo4j or pass --force")
+
+    driver = GraphDatabase.driver(uri, auth=(os.getenv('NEO4J_USERNAME'), os.getenv('NEO4J_PASSWORD')))
+    try:
+        if args.command == "load":
+            load(driver, args.clear)
+        else:
+            export(driver, args.recipes, args.restaurants)
+    finally:
+        driver.close()
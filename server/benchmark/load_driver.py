@@ -0,0 +1,144 @@
+import argparse
+import asyncio
+import json
+import os
+import re
+import time
+from collections import defaultdict
+import aiohttp
+from benchmark_concurrency import percentile
+
+# Replays the fixture conversations against a running server: each virtual user takes the next conversation,
+# gives it its own session id and sends the turns in order, so context lookups see a real history.
+# Latency is reported per labelled intent, with the mean of every stage from the Server-Timing header.
+#
+#   python -m benchmark.load_driver --url http://127.0.0.1:5000/query --concurrency 1,10,50
+
+FIXTURES = os.path.join(os.path.dirname(__file__), "fixtures")
+
+TIMING_ENTRY = re.compile(r'(\w+)(?:;dur=([\d.]+))?(?:;desc="(\d+)[^"]*")?')
+
+
+def parse_server_timing(header):
+    """stage -> milliseconds, with the LLM and Neo4j call counts under 'llm' and 'db'."""
+    stages = {}
+    for entry in (header or "").split(","):
+        match = TIMING_ENTRY.match(entry.strip())
+        if not match:
+            continue
+        name, duration, calls = match.groups()
+        if calls is not None:
+            stages[name] = int(calls)
+        elif duration is not None:
+            stages[name] = float(duration)
+    return stages
+
+
+def load_conversations(path):
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+class Results(object):
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(int)
+        self.stages = defaultdict(lambda: defaultdict(list))
+        self.conversations = 0
+
+    def add(self, intent, seconds, timings):
+        self.latencies[intent].append(seconds)
+        for stage, value in timings.items():
+            self.stages[intent][stage].append(value)
+
+    def completed(self):
+        return sum(len(values) for values in self.latencies.values())
+
+    def stage_means(self, intents):
+        merged = defaultdict(list)
+        for intent in intents:
+            for stage, values in self.stages[intent].items():
+                merged[stage].extend(values)
+        return {stage: sum(values) / len(values) for stage, values in merged.items()}
+
+
+async def send_turn(session, url, session_id, turn, results):
+    body = {"query": turn["query"], "allergies": turn.get("allergies", ""), "city": turn.get("city", ""),
+            "location": turn.get("location"), "name": turn.get("name", ""), "session_id": session_id}
+    start = time.perf_counter()
+    try:
+        async with session.post(url, json=body) as response:
+            await response.read()
+            if response.status != 200:
+                results.errors[turn["intent"]] += 1
+                return
+            timings = parse_server_timing(response.headers.get("Server-Timing"))
+    except (aiohttp.ClientError, asyncio.TimeoutError):
+        results.errors[turn["intent"]] += 1
+        return
+    results.add(turn["intent"], time.perf_counter() - start, timings)
+
+
+async def run(url, conversations, concurrency, total, duration, timeout):
+    """Replay total conversations, or as many as fit in duration seconds, with concurrency users at a time."""
+    results = Results()
+    started = [0]
+    deadline = time.perf_counter() + duration if duration else None
+
+    async def user(session, user_id):
+        while True:
+            if deadline is not None and time.perf_counter() >= deadline:
+                return
+            if deadline is None and started[0] >= total:
+                return
+            number = started[0]
+            started[0] += 1
+            session_id = f"bench-{concurrency}-{user_id}-{number}"
+            for turn in conversations[number % len(conversations)]["turns"]:
+                await send_turn(session, url, session_id, turn, results)
+            results.conversations += 1
+
+    connector = aiohttp.TCPConnector(limit=concurrency)
+    async with aiohttp.ClientSession(connector=connector, timeout=aiohttp.ClientTimeout(total=timeout)) as session:
+        start = time.perf_counter()
+        await asyncio.gather(*(user(session, user_id) for user_id in range(concurrency)))
+        elapsed = time.perf_counter() - start
+    return results, elapsed
+
+
+def report(concurrency, results, elapsed):
+    total = results.completed()
+    errors = sum(results.errors.values())
+    print(f"\nconcurrency {concurrency}: {results.conversations} conversations, {total} turns, {errors} errors "
+          f"in {elapsed:.1f}s, {total / elapsed if elapsed else 0.0:.2f} turns/s")
+    print(f"{'intent':<18} {'turns':>5} {'errors':>6} {'turns/s':>7} {'p50 s':>7} {'p95 s':>7} {'p99 s':>7} {'llm':>4} {'db':>4}  stages ms")
+    intents = sorted(set(results.latencies) | set(results.errors))
+    for intent in intents + ["all"]:
+        if intent == "all":
+            latencies = [s for values in results.latencies.values() for s in values]
+            turn_errors = errors
+            means = results.stage_means(intents)
+        else:
+            latencies = results.latencies[intent]
+            turn_errors = results.errors[intent]
+            means = results.stage_means([intent])
+        stages = " ".join(f"{stage}={ms:.0f}" for stage, ms in means.items() if stage not in ("llm", "db", "total"))
+        print(f"{intent:<18} {len(latencies):>5} {turn_errors:>6} {len(latencies) / elapsed if elapsed else 0.0:>7.2f} "
+              f"{percentile(latencies, 50):>7.2f} {percentile(latencies, 95):>7.2f} {percentile(latencies, 99):>7.2f} "
+              f"{means.get('llm', 0):>4.1f} {means.get('db', 0):>4.1f}  {stages}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Replay mixed-intent conversations against /query and report latency per intent.")
+    parser.add_argument("--url", default="http://127.0.0.1:5000/query")
+    parser.add_argument("--conversations-file", default=os.path.join(FIXTURES, "conversations.json"))
+    parser.add_argument("--concurrency", default="1,10,50", help="Comma separated numbers of simultaneous users")
+    parser.add_argument("--conversations", type=int, default=60, help="Conversations to replay per concurrency level")
+    parser.add_argument("--duration", type=float, help="Run each level for this many seconds instead")
+    parser.add_argument("--timeout", type=float, default=120, help="Per request timeout in seconds")
+    args = parser.parse_args()
+
+    conversations = load_conversations(args.conversations_file)
+    for concurrency in [int(c) for c in args.concurrency.split(",")]:
+        results, elapsed = asyncio.run(run(args.url, conversations, concurrency, args.conversations, args.duration, args.timeout))
+        report(concurrency, results, elapsed)
@@ -0,0 +1,94 @@
+import argparse
+import json
+import os
+import statistics
+import time
+import tiktoken
+from benchmark.load_driver import load_conversations
+from graph_schema import SCHEMA_SLICES, format_properties, schema_slice
+
+# Prompt tokens and Cypher generation latency with the full graph schema against the per intent slice rag.py uses.
+# Needs the server's .env (or the offline benchmark setup); --calls 0 only counts tokens.
+# --schema-file counts the schema tokens alone from a saved structured schema, without Neo4j or an LLM.
+#
+#   python -m benchmark.schema_prompts --calls 5
+#   python -m benchmark.schema_prompts --schema-file benchmark/fixtures/schema.json
+
+FIXTURES = os.path.join(os.path.dirname(__file__), "fixtures")
+
+
+def full_schema(structured_schema):
+    """Neo4jGraph.get_schema's text for a structured schema, every label and property included."""
+    return "\n".join([
+        "Node properties:",
+        *(format_properties(label, props) for label, props in structured_schema.get("node_props", {}).items()),
+        "Relationship properties:",
+        *(format_properties(rel_type, props) for rel_type, props in structured_schema.get("rel_props", {}).items()),
+        "The relationships:",
+        *(f"(:{rel['start']})-[:{rel['type']}]->(:{rel['end']})" for rel in structured_schema.get("relationships", [])),
+    ])
+
+
+def schema_tokens(encoding, structured_schema, slices=SCHEMA_SLICES):
+    """(intent, full schema tokens, slice tokens) for every intent."""
+    full = len(encoding.encode(full_schema(structured_schema)))
+    return [(intent, full, len(encoding.encode(schema_slice(structured_schema, labels))))
+            for intent, labels in slices.items()]
+
+
+def questions_by_intent(conversations, intents):
+    questions = {}
+    for conversation in conversations:
+        for turn in conversation["turns"]:
+            if turn["intent"] in intents:
+                questions.setdefault(turn["intent"], []).append(
+                    f"relevant context from previous conversation:None\nuser_question:{turn['query']}")
+    return questions
+
+
+def prompt_tokens(encoding, chain, schema, questions):
+    prompt = chain.cypher_generation_chain.prompt
+    return statistics.mean(len(encoding.encode(prompt.format(schema=schema, question=q))) for q in questions)
+
+
+def generation_seconds(chain, schema, questions, calls):
+    seconds = []
+    for _ in range(calls):
+        for question in questions:
+            start = time.perf_counter()
+            chain.cypher_generation_chain.invoke({"question": question, "schema": schema})
+            seconds.append(time.perf_counter() - start)
+    return statistics.median(seconds), statistics.mean(seconds)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare Cypher generation prompts with the full and the trimmed graph schema.")
+    parser.add_argument("--conversations-file", default=os.path.join(FIXTURES, "conversations.json"))
+    parser.add_argument("--calls", type=int, default=3, help="Generation calls per question and schema, 0 to skip timing")
+    parser.add_argument("--schema-file", help="Structured schema JSON (Neo4jGraph.get_structured_schema), only counts schema tokens")
+    parser.add_argument("--encoding", help="tiktoken encoding name, by default the one of gpt-4o-mini")
+    args = parser.parse_args()
+
+    encoding = tiktoken.get_encoding(args.encoding) if args.encoding else tiktoken.encoding_for_model("gpt-4o-mini")
+
+    if args.schema_file:
+        with open(args.schema_file, encoding="utf-8") as f:
+            structured_schema = json.load(f)
+        print(f"{'intent':<18} {'full tok':>8} {'slice tok':>9} {'saved':>6}")
+        for intent, full, sliced in schema_tokens(encoding, structured_schema):
+            print(f"{intent:<18} {full:>8} {sliced:>9} {1 - sliced / full:>6.0%}")
+        raise SystemExit
+
+    # connects to Neo4j and builds the chains on import
+    import rag
+
+    full_schema_text = rag.graph.get_schema
+    questions = questions_by_intent(load_conversations(args.conversations_file), rag.schema_slices.slices)
+
+    print(f"{'intent':<18} {'schema':<7} {'schema tok':>10} {'prompt tok':>10} {'p50 s':>7} {'mean s':>7}")
+    for intent, intent_questions in questions.items():
+        chain = rag.chain_for(intent)
+        for label, schema in (("full", full_schema_text), ("slice", rag.schema_slices.get(intent))):
+            tokens = prompt_tokens(encoding, chain, schema, intent_questions)
+            median, mean = generation_seconds(chain, schema, intent_questions, args.calls) if args.calls else (0.0, 0.0)
+            print(f"{intent:<18} {label:<7} {len(encoding.encode(schema)):>10} {tokens:>10.0f} {median:>7.2f} {mean:>7.2f}")
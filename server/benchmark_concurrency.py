@@ -0,0 +1,81 @@
+import argparse
+import asyncio
+import random
+import time
+import aiohttp
+
+# A mix of conversational and graph queries so every kind of LLM and Neo4j call is exercised
+QUERIES = [
+    "hi there",
+    "thank you!",
+    "find me a dessert with strawberries",
+    "what can I make with chicken and rice",
+    "any italian pasta recipes",
+    "find a mexican restaurant",
+    "how long should I boil an egg",
+]
+
+
+def percentile(values, p):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    index = min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))
+    return values[index]
+
+
+async def send(session, url, latencies, errors):
+    body = {"query": random.choice(QUERIES), "allergies": "", "city": "Plano", "name": ""}
+    start = time.perf_counter()
+    try:
+        async with session.post(url, json=body) as response:
+            await response.read()
+            if response.status != 200:
+                errors.append(response.status)
+                return
+    except aiohttp.ClientError as e:
+        errors.append(str(e))
+        return
+    latencies.append(time.perf_counter() - start)
+
+
+async def run(url, requests, concurrency, timeout):
+    latencies = []
+    errors = []
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def worker(session):
+        async with semaphore:
+            await send(session, url, latencies, errors)
+
+    connector = aiohttp.TCPConnector(limit=concurrency)
+    async with aiohttp.ClientSession(connector=connector, timeout=aiohttp.ClientTimeout(total=timeout)) as session:
+        start = time.perf_counter()
+        await asyncio.gather(*(worker(session) for _ in range(requests)))
+        elapsed = time.perf_counter() - start
+
+    return {
+        "completed": len(latencies),
+        "errors": len(errors),
+        "throughput": len(latencies) / elapsed if elapsed else 0.0,
+        "p50": percentile(latencies, 50),
+        "p95": percentile(latencies, 95),
+        "p99": percentile(latencies, 99),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare the sync Flask server and the ASGI server under concurrent load.")
+    parser.add_argument("--sync-url", default="http://127.0.0.1:5000/query", help="/query on 'flask run'")
+    parser.add_argument("--async-url", default="http://127.0.0.1:8000/query", help="/query on 'uvicorn asgi:app --port 8000'")
+    parser.add_argument("--requests", type=int, default=200, help="Requests per concurrency level")
+    parser.add_argument("--concurrency", default="1,10,50,100", help="Comma separated concurrency levels")
+    parser.add_argument("--timeout", type=float, default=120, help="Per request timeout in seconds")
+    args = parser.parse_args()
+
+    print(f"{'server':>6} {'conc':>5} {'done':>5} {'errors':>6} {'req/s':>7} {'p50 s':>7} {'p95 s':>7} {'p99 s':>7}")
+    for concurrency in [int(c) for c in args.concurrency.split(",")]:
+        for label, url in (("sync", args.sync_url), ("async", args.async_url)):
+            report = asyncio.run(run(url, args.requests, concurrency, args.timeout))
+            print(f"{label:>6} {concurrency:>5} {report['completed']:>5} {report['errors']:>6} {report['throughput']:>7.2f} "
+                  f"{report['p50']:>7.2f} {report['p95']:>7.2f} {report['p99']:>7.2f}")
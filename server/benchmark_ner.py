@@ -0,0 +1,92 @@
+import argparse
+import gc
+import os
+import random
+import string
+import time
+import spacy
+from NER import add_vocabulary_matcher, vocabulary_phrases, extract_recipe_criteria, inflections
+
+# Realistic queries with a few synthetic names mixed in so matches actually happen
+QUERIES = [
+    "find me an italian dessert with {0} and {1}",
+    "what can I make with {0}, {1} and {2}",
+    "healthy {0} soup recipes without {1}",
+    "I want something quick with {0}",
+]
+
+
+def synthetic_vocabulary(size, seed=0):
+    # one and two word names, roughly like the ingredient names in the graph
+    rng = random.Random(seed)
+    names = set()
+    while len(names) < size:
+        words = ["".join(rng.choices(string.ascii_lowercase, k=rng.randint(4, 9))) for _ in range(rng.choice((1, 1, 2)))]
+        names.add(" ".join(words))
+    return sorted(names)
+
+
+def synthetic_inflections(names):
+    # stands in for inflect, which would dominate the build time at these sizes
+    table = {}
+    for name in names:
+        table[name] = [name, name + "s"]
+        table[name + "s"] = [name, name + "s"]
+    return table
+
+
+def rss_mb():
+    # resident memory from /proc, tracemalloc would slow the build down by an order of magnitude
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 1024 / 1024
+    except (OSError, AttributeError, ValueError):
+        return None
+
+
+def benchmark(size, queries, model):
+    names = synthetic_vocabulary(size)
+    categories = names[:max(1, size // 100)]
+    table = synthetic_inflections(names)
+
+    nlp = spacy.load(model) if model else spacy.blank("en")
+    if "ner" not in nlp.pipe_names:
+        # the matcher goes before "ner", give the blank pipeline an empty one
+        nlp.add_pipe("ner")
+        nlp.initialize()
+
+    phrases = vocabulary_phrases(names, ["italian"], categories, table)
+    gc.collect()
+    before = rss_mb()
+    start = time.perf_counter()
+    matcher = add_vocabulary_matcher(nlp, phrases)
+    build_s = time.perf_counter() - start
+    gc.collect()
+    after = rss_mb()
+
+    inflections.clear()
+    inflections.update(table)
+    rng = random.Random(1)
+    texts = [rng.choice(QUERIES).format(*rng.sample(names, 3)) for _ in range(queries)]
+
+    start = time.perf_counter()
+    for text in texts:
+        extract_recipe_criteria(nlp(text), "")
+    per_query_ms = (time.perf_counter() - start) / len(texts) * 1000
+
+    memory_mb = after - before if before is not None else None
+    return {"size": size, "patterns": len(matcher), "build_s": build_s, "memory_mb": memory_mb, "query_ms": per_query_ms}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure NER matcher memory and per-query latency at different vocabulary sizes.")
+    parser.add_argument("--sizes", default="10000,100000,1000000", help="Comma separated vocabulary sizes")
+    parser.add_argument("--queries", type=int, default=1000, help="Queries timed per size")
+    parser.add_argument("--model", default="", help="spaCy model to add the matcher to, e.g. en_core_web_sm (default: tokenizer only)")
+    args = parser.parse_args()
+
+    print(f"{'entries':>9} {'patterns':>9} {'build s':>8} {'matcher MB':>10} {'ms/query':>9}")
+    for size in [int(s) for s in args.sizes.split(",")]:
+        report = benchmark(size, args.queries, args.model)
+        memory = f"{report['memory_mb']:.1f}" if report['memory_mb'] is not None else "n/a"
+        print(f"{report['size']:>9} {report['patterns']:>9} {report['build_s']:>8.1f} {memory:>10} {report['query_ms']:>9.3f}")
@@ -0,0 +1,132 @@
+# One chat turn of the /query API, shared by app.py (Flask, blocking OpenAI and Neo4j calls) and asgi.py
+# (Quart, every call awaited): reading the request, the context from earlier messages, the intent, the NER
+# criteria and the answer for each intent. The entry points only add their framework's routing, sessions and
+# Flask's speculative mode on top.
+import inspect
+from NER import extract_recipe_criteria, extract_restaurant_criteria, inflect_ingredients
+from basicChatStructure import get_last_k_messages
+from cypher_builder import parse_allergies
+from rag import pantry_matches, query_cypher
+import metrics
+
+GRAPH_INTENTS = ('find a recipe', 'find a restaurant')
+
+
+class QueryRequest(object):
+    """The fields of a /query body."""
+
+    def __init__(self, body, remote_addr=None):
+        body = body or {}
+        self.query = body.get('query', '')
+        self.allergies = body.get('allergies', '')
+        self.city = body.get('city', '')
+        # the browser's position, {"latitude": ..., "longitude": ...}, for "near me" restaurant questions
+        self.location = body.get('location')
+        self.name = body.get('name', '')
+        # older clients do not send a session id, fall back to one conversation per IP for them
+        self.session_id = body.get('session_id') or remote_addr
+
+
+def question_with_context(relevant_context, user_query):
+    """The question the intent and graph prompts see, and whether Cypher may be built from the NER criteria.
+    The criteria only describe the current message, so that is only done when there is no earlier context."""
+    question = f"""relevant context from previous conversation:{relevant_context}
+user_question:{user_query}"""
+    return question, relevant_context.strip().lower() in ('', 'none')
+
+
+def extract_criteria(doc, graph_intent, request):
+    with metrics.span('ner'):
+        if graph_intent == 'find a recipe':
+            return extract_recipe_criteria(doc, request.allergies)
+        return extract_restaurant_criteria(doc, request.city, request.location)
+
+
+async def resolved(value):
+    # the async intent parser hands back coroutines where the blocking one returns the answer
+    return await value if inspect.isawaitable(value) else value
+
+
+class Conversation(object):
+    """Answers a turn with the given intent parser. awaited says it is the async parser and the graph steps
+    should be awaited too."""
+
+    def __init__(self, intent_parser, nlp, awaited=False):
+        self.intent_parser = intent_parser
+        self.nlp = nlp
+        self.awaited = awaited
+
+    async def classify(self, question, request, direct):
+        """(intent, NER doc or None, started graph branch or None), app.py overrides this for speculative mode."""
+        with metrics.span('intent'):
+            global_intent = await resolved(self.intent_parser.parse_global_user_intent(question))
+        return global_intent, None, None
+
+    async def respond(self, global_intent, user_query, question, memory_pass):
+        """Answer for every intent that does not need the graph."""
+        parser = self.intent_parser
+        question_type = None
+        if global_intent == 'ask a question':
+            with metrics.span('question_type'):
+                question_type = (await resolved(parser.respond_to_question(memory_pass))).strip().lower()
+        with metrics.span('answer'):
+            if global_intent == 'greetings':
+                answer = parser.respond_to_greeting(user_query)
+            elif global_intent == 'quit chat':
+                answer = parser.respond_to_quit_chat(user_query)
+            elif global_intent == 'express gratitude':
+                answer = parser.respond_to_gratitude(user_query)
+            elif question_type == 'food related question':
+                answer = parser.respond_to_food_question(question)
+            elif question_type is not None:
+                answer = parser.respond_to_NonFood_question(user_query)
+            else:
+                answer = parser.respond_to_other(user_query)
+            return await resolved(answer)
+
+    async def answer(self, memory, request):
+        """The /query response body for one turn, the turn and the answer are added to memory."""
+        memory.chat_memory.add_user_message(request.query)
+        memory_pass = str(get_last_k_messages(memory))
+
+        # Get the relevant context from the query given the memory
+        with metrics.span('context'):
+            relevant_context = await resolved(self.intent_parser.find_relevant_information(request.query, memory_pass))
+        question, direct = question_with_context(relevant_context, request.query)
+
+        global_intent, doc, started = await self.classify(question, request, direct)
+        global_intent = global_intent.strip().lower()
+        metrics.set_intent(global_intent)
+
+        if global_intent in GRAPH_INTENTS:
+            if started is not None:
+                # the speculative graph query was started for this intent, just wait for it
+                result = started.result()
+            else:
+                criteria = extract_criteria(doc if doc is not None else self.nlp(request.query), global_intent, request)
+                result = await query_cypher(question, global_intent, criteria, name=request.name, direct=direct,
+                                            awaited=self.awaited)
+            memory.chat_memory.add_ai_message(str(result))
+            return {"result": result}
+
+        answer = await self.respond(global_intent, request.query, question, memory_pass)
+        memory.chat_memory.add_ai_message(str(answer))
+        return {"result": {"result": answer}}
+
+
+def pantry_response(body):
+    """(response body, status) for POST /pantry: recipes ranked by how much of them the ingredients cover, no LLM involved."""
+    body = body or {}
+    ingredients = inflect_ingredients(body.get('ingredients', []))
+    if not ingredients:
+        return {"error": "No ingredients provided"}, 400
+    try:
+        limit = int(body.get('k', 10))
+    except (TypeError, ValueError):
+        return {"error": "k must be a number"}, 400
+    # "peanuts" has to exclude recipes with an Ingredient named "Peanut" too, as in extract_recipe_criteria
+    allergies = inflect_ingredients(parse_allergies(body.get('allergies')))
+    rows = pantry_matches(ingredients, allergies, body.get('category'), body.get('cuisine'), limit)
+    if rows is None:
+        return {"error": "Pantry matching needs the recipe index, set RECIPE_INDEX=1"}, 503
+    return {"result": rows}, 200
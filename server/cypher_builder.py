@@ -0,0 +1,142 @@
+# Builds parameterized Cypher for the common query shapes straight from the NER criteria
+# Queries that can be expressed here skip the LLM Cypher generation step entirely, and since the
+# query text only depends on the shape Neo4j can reuse its cached plan across requests
+
+RESULT_LIMIT = 10
+METERS_PER_MILE = 1609.344
+
+
+def parse_allergies(allergies):
+    """The client sends allergies as free text, e.g. "peanuts, shellfish"."""
+    if not allergies:
+        return []
+    if isinstance(allergies, str):
+        allergies = allergies.split(',')
+    return [a.strip().lower() for a in allergies if a and a.strip()]
+
+
+def parse_location(location):
+    """The client sends the browser's position as {"latitude": ..., "longitude": ...}. Returns (latitude, longitude) or None."""
+    if not isinstance(location, dict):
+        return None
+    try:
+        latitude, longitude = float(location["latitude"]), float(location["longitude"])
+    except (KeyError, TypeError, ValueError):
+        return None
+    if not (-90 <= latitude <= 90 and -180 <= longitude <= 180):
+        return None
+    return latitude, longitude
+
+
+def as_list(value):
+    if not value:
+        return []
+    if isinstance(value, str):
+        return [value]
+    return list(value)
+
+
+def build_recipe_query(criteria):
+    """Category, cuisine, include ingredients and allergy exclusions. Returns (cypher, params) or None."""
+    # diet labels and time limits need judgement the LLM is better at
+    if criteria.get("diet") or criteria.get("time"):
+        return None
+
+    categories = sorted({c.lower() for c in as_list(criteria.get("category"))})
+    cuisines = sorted({c.lower() for c in as_list(criteria.get("cuisine"))})
+    ingredients = sorted({i.lower() for i in as_list(criteria.get("ingredients"))})
+    allergies = parse_allergies(criteria.get("allergies"))
+
+    if not (categories or cuisines or ingredients):
+        return None
+
+    clauses = ["MATCH (r:Recipe)"]
+    params = {"limit": RESULT_LIMIT}
+    if categories:
+        clauses.append("MATCH (r)-[:BELONGS_TO|BELONGS_TO_CATEGORY]->(c:Category) WHERE toLower(c.value) IN $categories")
+        params["categories"] = categories
+    if cuisines:
+        clauses.append("MATCH (r)-[:HAS_CUISINE]->(cu:Cuisine) WHERE toLower(cu.value) IN $cuisines")
+        params["cuisines"] = cuisines
+    clauses.append("WITH DISTINCT r")
+    if allergies:
+        clauses.append("WHERE NOT EXISTS { MATCH (r)-[:CONTAINS]->(a:Ingredient) WHERE toLower(a.name) IN $allergies }")
+        params["allergies"] = allergies
+    if ingredients:
+        clauses.append("MATCH (r)-[:CONTAINS]->(i:Ingredient) WHERE toLower(i.name) IN $ingredients")
+        clauses.append("WITH r, collect(DISTINCT i.name) AS MatchedIngredients")
+        clauses.append("RETURN r.name AS RecipeName, MatchedIngredients")
+        clauses.append("ORDER BY size(MatchedIngredients) DESC, RecipeName")
+        params["ingredients"] = ingredients
+    else:
+        clauses.append("RETURN r.name AS RecipeName")
+        clauses.append("ORDER BY RecipeName")
+    clauses.append("LIMIT $limit")
+
+    return "\n".join(clauses), params
+
+
+def build_restaurant_query(criteria, located=False):
+    """Restaurant type plus optional city, or restaurants within a radius of the user. Returns (cypher, params) or None.
+    located says the restaurants have the city and location properties from restaurant_geo.py, before that
+    the city is searched for in the address."""
+    # rating and time filters are not covered here, leave those to the LLM
+    if criteria.get("min_rating") or criteria.get("max_time"):
+        return None
+
+    types = sorted({t.lower() for t in as_list(criteria.get("cuisine"))})
+    nearby = located and criteria.get("radius_miles") and criteria.get("latitude") is not None
+    if nearby:
+        return build_nearby_query(criteria, types)
+    if not types:
+        return None
+
+    clauses = [
+        "MATCH (n:Restaurant)-[:HAS_TYPE]->(t:Type)",
+        "WHERE toLower(t.type) IN $types"
+    ]
+    params = {"types": types, "limit": RESULT_LIMIT}
+    if criteria.get("city"):
+        # graph_schema rewrites the city equality onto city_lower, restaurants whose address could not be
+        # parsed have no city and are still searched by address
+        clauses.append("AND (toLower(n.city) = $city OR n.city IS NULL AND toLower(n.address) CONTAINS $city)"
+                       if located else "AND toLower(n.address) CONTAINS $city")
+        params["city"] = criteria["city"].strip().lower()
+    clauses.append("RETURN DISTINCT n.name AS RestaurantName, n.address AS Address")
+    clauses.append("LIMIT $limit")
+
+    return "\n".join(clauses), params
+
+
+def build_nearby_query(criteria, types):
+    # the distance predicate on n.location is answered by the point index, closest first
+    clauses = [
+        "MATCH (n:Restaurant)",
+        "WHERE point.distance(n.location, point({latitude: $latitude, longitude: $longitude})) <= $meters"
+    ]
+    params = {
+        "latitude": float(criteria["latitude"]),
+        "longitude": float(criteria["longitude"]),
+        "meters": float(criteria["radius_miles"]) * METERS_PER_MILE,
+        "limit": RESULT_LIMIT,
+    }
+    if types:
+        clauses.append("AND EXISTS { MATCH (n)-[:HAS_TYPE]->(t:Type) WHERE toLower(t.type) IN $types }")
+        params["types"] = types
+    clauses.append("WITH n, point.distance(n.location, point({latitude: $latitude, longitude: $longitude})) AS meters")
+    clauses.append("RETURN n.name AS RestaurantName, n.address AS Address, round(meters / $meters_per_mile, 1) AS Miles")
+    clauses.append("ORDER BY meters")
+    clauses.append("LIMIT $limit")
+    params["meters_per_mile"] = METERS_PER_MILE
+
+    return "\n".join(clauses), params
+
+
+def build_cypher(graph_intent, criteria, located=False):
+    if not isinstance(criteria, dict):
+        return None
+    if graph_intent == 'find a recipe':
+        return build_recipe_query(criteria)
+    if graph_intent == 'find a restaurant':
+        return build_restaurant_query(criteria, located)
+    return None
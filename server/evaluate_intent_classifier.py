@@ -0,0 +1,128 @@
+import argparse
+import math
+import random
+import time
+from intent_classifier import IntentClassifier, read_intent_log
+
+# stored as the threshold when no confidence reaches the target accuracy, above any probability so the LLM always answers
+NEVER = 1.1
+# temperatures tried when calibrating, naive Bayes log score gaps run into the hundreds so the grid goes high
+TEMPERATURES = [round(1.25 ** i, 3) for i in range(0, 41)]
+
+
+def split(records, holdout, seed=0):
+    """Shuffled (train, held_out) split of an intent log."""
+    records = list(records)
+    random.Random(seed).shuffle(records)
+    cut = len(records) - int(round(len(records) * holdout))
+    return records[:cut], records[cut:]
+
+
+def fit_temperature(classifier, records):
+    """Temperature with the lowest negative log likelihood of the LLM labels on records."""
+    labelled = []
+    for record in records:
+        if record["intent"] in classifier.labels:
+            labelled.append((classifier.scores(record["query"]), classifier.labels.index(record["intent"])))
+    if not labelled:
+        return 1.0
+
+    def nll(temperature):
+        total = 0.0
+        for scores, truth in labelled:
+            top = max(scores)
+            log_norm = math.log(sum(math.exp((score - top) / temperature) for score in scores))
+            total -= (scores[truth] - top) / temperature - log_norm
+        return total
+
+    return min(TEMPERATURES, key=nll)
+
+
+def tune_threshold(classifier, records, target_accuracy):
+    """Lowest confidence at which the answers at or above it agree with the LLM at least target_accuracy of the time."""
+    predictions = sorted(
+        ((confidence, label == record["intent"]) for record in records
+         for label, confidence in [classifier.predict(record["query"])]),
+        reverse=True
+    )
+    threshold = NEVER
+    correct = 0
+    for answered, (confidence, agreed) in enumerate(predictions, 1):
+        correct += agreed
+        # only cut between distinct confidences, everything tied with the threshold is answered too
+        if answered < len(predictions) and predictions[answered][0] == confidence:
+            continue
+        if correct / answered >= target_accuracy:
+            threshold = confidence
+    return threshold
+
+
+def calibrate(records, ngram_range=(2, 4), alpha=0.5, holdout=0.2, target_accuracy=0.98, seed=0):
+    """Fit on a training split, then set the temperature and threshold on the held-out split.
+    Returns the classifier and the held-out records."""
+    train, held_out = split(records, holdout, seed)
+    classifier = IntentClassifier(ngram_range, alpha)
+    classifier.fit([r["query"] for r in train], [r["intent"] for r in train])
+    classifier.temperature = fit_temperature(classifier, held_out)
+    classifier.threshold = tune_threshold(classifier, held_out, target_accuracy)
+    return classifier, held_out
+
+
+# Compare the local classifier against the LLM labels in an intent log
+# Reports agreement, how many queries the fast path would answer and the LLM time that saves
+def evaluate(classifier, records, threshold):
+    answered = 0
+    agreed = 0
+    answered_agreed = 0
+    saved_ms = 0.0
+    local_ms = 0.0
+
+    for record in records:
+        start = time.perf_counter()
+        label, confidence = classifier.predict(record["query"])
+        local_ms += (time.perf_counter() - start) * 1000
+
+        if label == record["intent"]:
+            agreed += 1
+        if confidence >= threshold:
+            answered += 1
+            saved_ms += record.get("latency_ms", 0.0)
+            if label == record["intent"]:
+                answered_agreed += 1
+
+    total = len(records)
+    return {
+        "threshold": threshold,
+        "queries": total,
+        "agreement": agreed / total if total else 0.0,
+        "coverage": answered / total if total else 0.0,
+        "fast_path_agreement": answered_agreed / answered if answered else 0.0,
+        "mean_local_ms": local_ms / total if total else 0.0,
+        "llm_ms_saved": saved_ms
+    }
+
+
+def print_report(classifier, records, thresholds):
+    # fast-path agree is the accuracy of the answers that skip the LLM, the number the threshold is tuned on
+    print(f"{'threshold':>9} {'agreement':>9} {'coverage':>8} {'fast-path agree':>15} {'local ms':>8} {'LLM s saved':>11}")
+    for threshold in thresholds:
+        report = evaluate(classifier, records, threshold)
+        print(f"{report['threshold']:>9.3f} {report['agreement']:>9.1%} {report['coverage']:>8.1%} "
+              f"{report['fast_path_agreement']:>15.1%} {report['mean_local_ms']:>8.3f} {report['llm_ms_saved'] / 1000:>11.1f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Evaluate the local intent classifier against logged LLM labels.")
+    parser.add_argument("model", help="Model written by intent_classifier.py")
+    parser.add_argument("log", help="JSONL intent log to evaluate on (ideally not the one used for training)")
+    parser.add_argument("--thresholds", default="0.5,0.7,0.8,0.9,0.95,0.99", help="Comma separated confidence thresholds")
+    args = parser.parse_args()
+
+    classifier = IntentClassifier.load(args.model)
+    records = read_intent_log(args.log)
+
+    thresholds = [float(t) for t in args.thresholds.split(",")]
+    if classifier.threshold is not None:
+        print(f"Model temperature {classifier.temperature:.1f}, tuned threshold {classifier.threshold:.3f}")
+        thresholds.append(classifier.threshold)
+    print_report(classifier, records, thresholds)
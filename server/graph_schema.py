@@ -0,0 +1,298 @@
+# Constraints and indexes for the recipe graph, plus the query rewrite that lets case-insensitive matches use them
+# Every label below gets a lowercase copy of its key stored as <property>_lower (set at ingest by Neo4j_writer.py,
+# backfilled by the bootstrap), so toLower(i.name) IN [...] can be answered from an index on i.name_lower
+# instead of running toLower over every Ingredient node.
+#
+#   python graph_schema.py profile    # db hits of the sample queries as written and as rewritten
+#   python graph_schema.py bootstrap  # create constraints, backfill the lowercase keys and index them
+import argparse
+import hashlib
+import os
+import re
+import threading
+import time
+from dotenv import load_dotenv
+from neo4j import GraphDatabase, READ_ACCESS
+from cypher_builder import build_cypher
+
+load_dotenv()
+
+NORMALIZED_SUFFIX = "_lower"
+
+# label -> property the extraction scripts MERGE on, these get uniqueness constraints
+MERGE_KEYS = {
+    "Recipe": "name",
+    "Ingredient": "name",
+    "TotalTime": "value",
+    "Yield": "value",
+    "Servings": "value",
+    "Nutrition": "value",
+    "Category": "value",
+    "Cuisine": "value",
+    "Difficulty": "value",
+}
+
+# label -> property compared case-insensitively in queries, these get a lowercase copy and an index on it
+# restaurant types are not unique in the imported data so they are only indexed, restaurant cities come from restaurant_geo.py
+NORMALIZED_KEYS = dict(MERGE_KEYS, Type="type", Restaurant="city")
+
+SHOW_INDEXES = "SHOW INDEXES YIELD labelsOrTypes, properties, state"
+
+# labels each Cypher generation prompt is shown, with the relationships between them; everything else is left out
+# of the schema text. Recipe time and difficulty questions still go to the LLM, so those labels stay in.
+SCHEMA_SLICES = {
+    "find a recipe": ["Recipe", "Ingredient", "Category", "Cuisine", "TotalTime", "Difficulty"],
+    "find a restaurant": ["Restaurant", "Type"],
+}
+# how often the graph is asked whether its labels, relationship types or property keys changed
+SCHEMA_CHECK_SECONDS = float(os.getenv('GRAPH_SCHEMA_CHECK_SECONDS', '300'))
+
+# cheap catalog lookups, unlike the full schema introspection
+SCHEMA_VERSION_QUERY = """
+CALL db.labels() YIELD label RETURN 'label' AS kind, label AS name
+UNION ALL
+CALL db.relationshipTypes() YIELD relationshipType RETURN 'relationship' AS kind, relationshipType AS name
+UNION ALL
+CALL db.propertyKeys() YIELD propertyKey RETURN 'property' AS kind, propertyKey AS name
+"""
+
+TO_LOWER = re.compile(r"toLower\(\s*(\w+)\.(\w+)\s*\)", re.IGNORECASE)
+NODE_BINDING = re.compile(r"\(\s*(\w+)\s*:\s*`?(\w+)")
+
+
+def normalized_property(prop):
+    return prop + NORMALIZED_SUFFIX
+
+
+def normalized_properties(indexes):
+    """(label, property) pairs whose lowercase copy is indexed and online, from the rows of SHOW INDEXES."""
+    indexed = set()
+    for index in indexes:
+        if index.get("state") != "ONLINE" or not index.get("labelsOrTypes") or not index.get("properties"):
+            continue
+        for label in index["labelsOrTypes"]:
+            for prop in index["properties"]:
+                if NORMALIZED_KEYS.get(label) and prop == normalized_property(NORMALIZED_KEYS[label]):
+                    indexed.add((label, NORMALIZED_KEYS[label]))
+    return indexed
+
+
+def normalize_cypher(cypher, normalized):
+    """Rewrite toLower(x.prop) to x.prop_lower wherever every label x is bound to has an indexed lowercase copy.
+    Both expressions have the same value on every node, so the result rows do not change."""
+    if not cypher or not normalized:
+        return cypher
+
+    bindings = {}
+    for variable, label in NODE_BINDING.findall(cypher):
+        bindings.setdefault(variable, set()).add(label)
+
+    def rewrite(match):
+        variable, prop = match.groups()
+        labels = bindings.get(variable)
+        if labels and all((label, prop) in normalized for label in labels):
+            return f"{variable}.{normalized_property(prop)}"
+        return match.group(0)
+
+    return TO_LOWER.sub(rewrite, cypher)
+
+
+def schema_version(rows):
+    """Hash of the rows of SCHEMA_VERSION_QUERY, it changes when a label, relationship type or property key is added or removed."""
+    digest = hashlib.sha256()
+    for kind, name in sorted((row["kind"], row["name"]) for row in rows):
+        digest.update(f"{kind}\0{name}\0".encode('utf-8'))
+    return digest.hexdigest()
+
+
+def format_properties(name, props):
+    return name + " {" + ", ".join(f"{p['property']}: {p['type']}" for p in props) + "}"
+
+
+def schema_slice(structured_schema, labels):
+    """Schema text in the format of Neo4jGraph.get_schema, limited to the given labels and the relationships between them.
+    The lowercase key copies are left out, the prompts compare with toLower and normalize_cypher rewrites that onto them."""
+    labels = set(labels)
+    node_props = []
+    for label, props in structured_schema.get("node_props", {}).items():
+        if label in labels:
+            kept = [p for p in props if not p["property"].endswith(NORMALIZED_SUFFIX)]
+            node_props.append(format_properties(label, kept))
+    relationships = [
+        rel for rel in structured_schema.get("relationships", [])
+        if rel["start"] in labels and rel["end"] in labels
+    ]
+    rel_types = {rel["type"] for rel in relationships}
+    rel_props = [
+        format_properties(rel_type, props)
+        for rel_type, props in structured_schema.get("rel_props", {}).items() if rel_type in rel_types
+    ]
+    return "\n".join([
+        "Node properties:", *node_props,
+        "Relationship properties:", *rel_props,
+        "The relationships:", *(f"(:{rel['start']})-[:{rel['type']}]->(:{rel['end']})" for rel in relationships),
+    ])
+
+
+class SchemaSlices(object):
+    """Per intent schema text for the Cypher generation prompts. The slices are built once and only rebuilt
+    when schema_version changes, which is checked at most every check_seconds."""
+
+    def __init__(self, graph, slices=None, check_seconds=SCHEMA_CHECK_SECONDS):
+        self.graph = graph
+        self.slices = slices or SCHEMA_SLICES
+        self.check_seconds = check_seconds
+        self.version = None
+        self.schemas = {}
+        self.checked = 0.0
+        self.lock = threading.Lock()
+
+    def stale(self):
+        return time.monotonic() - self.checked >= self.check_seconds
+
+    def refresh(self, force=False):
+        """Returns True when the slices were rebuilt. When the graph can not be asked, the slices already built
+        keep being served and the next check is check_seconds later; only the first build raises."""
+        with self.lock:
+            self.checked = time.monotonic()
+            try:
+                version = schema_version(self.graph.query(SCHEMA_VERSION_QUERY))
+                if version == self.version and not force:
+                    return False
+                if self.version is not None or force:
+                    # the graph read its schema when it was created, only introspect again after a change
+                    self.graph.refresh_schema()
+                schemas = {
+                    intent: schema_slice(self.graph.get_structured_schema, labels) for intent, labels in self.slices.items()
+                }
+            except Exception as e:
+                if not self.schemas:
+                    raise
+                print(f"Graph schema check failed, keeping the schema slices of version {self.version}: {e}")
+                return False
+            self.schemas = schemas
+            self.version = version
+            return True
+
+    def get(self, intent):
+        if self.stale():
+            self.refresh()
+        return self.schemas[intent]
+
+
+def schema_statements():
+    statements = []
+    for label, prop in MERGE_KEYS.items():
+        statements.append(
+            f"CREATE CONSTRAINT {label.lower()}_{prop}_unique IF NOT EXISTS FOR (n:{label}) REQUIRE n.{prop} IS UNIQUE"
+        )
+    return statements
+
+
+def index_statements():
+    statements = []
+    for label, prop in NORMALIZED_KEYS.items():
+        lower = normalized_property(prop)
+        statements.append(f"CREATE INDEX {label.lower()}_{lower} IF NOT EXISTS FOR (n:{label}) ON (n.{lower})")
+    return statements
+
+
+def backfill_statement(label, prop):
+    # non-string values would make toLower fail, those keep no lowercase copy
+    lower = normalized_property(prop)
+    return f"""
+    MATCH (n:{label})
+    WHERE n.{prop} IS :: STRING NOT NULL AND (n.{lower} IS NULL OR n.{lower} <> toLower(n.{prop}))
+    CALL {{ WITH n SET n.{lower} = toLower(n.{prop}) }} IN TRANSACTIONS OF 10000 ROWS
+    """
+
+
+def bootstrap(driver):
+    # constraints first so the backfill and later ingests MERGE through an index
+    with driver.session() as session:
+        for statement in schema_statements():
+            try:
+                session.run(statement).consume()
+                print(statement)
+            except Exception as e:
+                # e.g. existing duplicates, the remaining statements still run
+                print(f"Skipped: {statement}\n  {e}")
+
+        for label, prop in NORMALIZED_KEYS.items():
+            summary = session.run(backfill_statement(label, prop)).consume()
+            print(f"Backfilled {summary.counters.properties_set} {label}.{normalized_property(prop)} values")
+
+        # the indexes are created after the backfill, query_cypher only rewrites onto a property once its index is online
+        for statement in index_statements():
+            session.run(statement).consume()
+            print(statement)
+        session.run("CALL db.awaitIndexes(300)").consume()
+
+
+def sample_queries():
+    """Query shapes the chains and the Cypher builder actually send, with values from the snapshot."""
+    queries = [
+        ("recipe prompt example", """
+MATCH (r:Recipe)-[:BELONGS_TO]->(c:Category),
+    (r)-[:CONTAINS]->(i:Ingredient)
+WHERE toLower(c.value) IN ["dessert"]
+AND toLower(i.name) IN ["strawberry"]
+AND NOT toLower(i.name) IN ["avocado"]
+RETURN r.name AS RecipeName""", {}),
+        ("restaurant prompt example", """
+MATCH (n:Restaurant)-[:HAS_TYPE]->(t:Type)
+WHERE toLower(t.type) in ['donuts']
+AND n.address CONTAINS "Plano"
+RETURN n.name AS RestaurantName""", {}),
+    ]
+    nearby = {"cuisine": ["pizza"], "latitude": 33.0198, "longitude": -96.6989, "radius_miles": 5}
+    for label, intent, criteria, located in (
+        ("builder: ingredients + allergies", "find a recipe", {"ingredients": ["chicken", "rice"], "allergies": "peanut"}, False),
+        ("builder: category + cuisine", "find a recipe", {"category": ["dessert"], "cuisine": ["italian"]}, False),
+        ("builder: restaurant type + city", "find a restaurant", {"cuisine": ["pizza"], "city": "Plano"}, False),
+        ("builder: type + city property", "find a restaurant", {"cuisine": ["pizza"], "city": "Plano"}, True),
+        ("builder: type within 5 miles", "find a restaurant", nearby, True),
+    ):
+        cypher, params = build_cypher(intent, criteria, located)
+        queries.append((label, cypher, params))
+    return queries
+
+
+def db_hits(plan):
+    if not plan:
+        return 0
+    return plan.get("dbHits", 0) + sum(db_hits(child) for child in plan.get("children", []))
+
+
+def profile(driver, cypher, params):
+    _, summary, _ = driver.execute_query("PROFILE " + cypher, params, routing_=READ_ACCESS)
+    return db_hits(summary.profile)
+
+
+def profile_report(driver):
+    records, _, _ = driver.execute_query(SHOW_INDEXES, routing_=READ_ACCESS)
+    normalized = normalized_properties([record.data() for record in records])
+    if not normalized:
+        print("No lowercase key indexes yet, run 'python graph_schema.py bootstrap' to compare against the rewritten queries.")
+
+    print(f"{'query':<34} {'db hits':>10} {'rewritten':>10}")
+    for label, cypher, params in sample_queries():
+        before = profile(driver, cypher, params)
+        rewritten = normalize_cypher(cypher, normalized)
+        after = profile(driver, rewritten, params) if rewritten != cypher else before
+        print(f"{label:<34} {before:>10} {after:>10}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Create the graph constraints and indexes, or profile the common queries against them.")
+    parser.add_argument("command", choices=["bootstrap", "profile"])
+    args = parser.parse_args()
+
+    driver = GraphDatabase.driver(os.getenv('NEO4J_URI'), auth=(os.getenv('NEO4J_USERNAME'), os.getenv('NEO4J_PASSWORD')))
+    try:
+        if args.command == "bootstrap":
+            bootstrap(driver)
+        else:
+            profile_report(driver)
+    finally:
+        driver.close()
@@ -0,0 +1,142 @@
+import argparse
+import json
+import math
+import re
+from collections import Counter, defaultdict
+
+
+def read_intent_log(path):
+    """Read (query, intent, latency_ms) records logged by intent_parser.parse_global_user_intent."""
+    records = []
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            record = json.loads(line)
+            if record.get("intent", "unknown") != "unknown":
+                records.append(record)
+    return records
+
+
+class IntentClassifier(object):
+    """Multinomial naive Bayes over character n-grams, small enough to answer in well under a millisecond.
+    Naive Bayes counts every overlapping n-gram as independent evidence, so its raw posteriors sit near 1.0;
+    temperature divides the scores before the softmax and threshold is the confidence tuned on held-out
+    queries (see evaluate_intent_classifier.py)."""
+
+    def __init__(self, ngram_range=(2, 4), alpha=0.5, temperature=1.0, threshold=None):
+        self.ngram_range = tuple(ngram_range)
+        self.alpha = alpha
+        self.temperature = temperature
+        self.threshold = threshold
+        self.labels = []
+        self.log_priors = []
+        self.log_likelihoods = {}
+
+    def features(self, text):
+        text = " " + re.sub(r"\s+", " ", text.lower()).strip() + " "
+        low, high = self.ngram_range
+        grams = []
+        for n in range(low, high + 1):
+            grams.extend(text[i:i + n] for i in range(len(text) - n + 1))
+        return grams
+
+    def fit(self, queries, intents):
+        label_counts = Counter(intents)
+        self.labels = sorted(label_counts)
+        gram_counts = {label: Counter() for label in self.labels}
+        for query, intent in zip(queries, intents):
+            gram_counts[intent].update(self.features(query))
+
+        vocab = set()
+        for counts in gram_counts.values():
+            vocab.update(counts)
+
+        # precompute one row of log likelihoods per n-gram so prediction is a handful of dict lookups
+        total = sum(label_counts.values())
+        self.log_priors = [math.log(label_counts[label] / total) for label in self.labels]
+        denominators = [sum(gram_counts[label].values()) + self.alpha * len(vocab) for label in self.labels]
+        self.log_likelihoods = {
+            gram: [math.log((gram_counts[label][gram] + self.alpha) / denominators[i]) for i, label in enumerate(self.labels)]
+            for gram in vocab
+        }
+        return self
+
+    def scores(self, text):
+        """Unnormalized log posterior of every label."""
+        scores = list(self.log_priors)
+        for gram in self.features(text):
+            row = self.log_likelihoods.get(gram)
+            if row is None:
+                continue
+            for i, value in enumerate(row):
+                scores[i] += value
+        return scores
+
+    def predict(self, text, temperature=None):
+        """Return the most likely intent and its calibrated probability."""
+        if not self.labels:
+            return None, 0.0
+
+        scores = self.scores(text)
+        temperature = temperature or self.temperature
+        best = max(range(len(scores)), key=scores.__getitem__)
+        total = sum(math.exp((score - scores[best]) / temperature) for score in scores)
+        return self.labels[best], 1.0 / total
+
+    def save(self, path):
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump({
+                "ngram_range": self.ngram_range,
+                "alpha": self.alpha,
+                "temperature": self.temperature,
+                "threshold": self.threshold,
+                "labels": self.labels,
+                "log_priors": self.log_priors,
+                "log_likelihoods": self.log_likelihoods
+            }, f)
+
+    @classmethod
+    def load(cls, path):
+        with open(path, encoding='utf-8') as f:
+            data = json.load(f)
+        # models saved before calibration have neither, they keep the raw posteriors
+        classifier = cls(data["ngram_range"], data["alpha"], data.get("temperature", 1.0), data.get("threshold"))
+        classifier.labels = data["labels"]
+        classifier.log_priors = data["log_priors"]
+        classifier.log_likelihoods = data["log_likelihoods"]
+        return classifier
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Train the local intent classifier from logged LLM intent labels.")
+    parser.add_argument("log", help="JSONL file written when INTENT_LOG_PATH is set")
+    parser.add_argument("output", help="Where to write the trained model")
+    parser.add_argument("--min-n", type=int, default=2, help="Smallest character n-gram")
+    parser.add_argument("--max-n", type=int, default=4, help="Largest character n-gram")
+    parser.add_argument("--alpha", type=float, default=0.5, help="Additive smoothing")
+    parser.add_argument("--holdout", type=float, default=0.2, help="Share of the log kept out of training to calibrate on")
+    parser.add_argument("--target-accuracy", type=float, default=0.98,
+                        help="Agreement with the LLM the answers above the tuned threshold must reach")
+    args = parser.parse_args()
+
+    from evaluate_intent_classifier import calibrate, print_report
+
+    records = read_intent_log(args.log)
+    # calibrate on queries the model has not seen, then keep the temperature and threshold for the model fitted on everything
+    classifier, held_out = calibrate(records, (args.min_n, args.max_n), args.alpha, args.holdout, args.target_accuracy)
+    print(f"Held-out calibration on {len(held_out)} queries: temperature {classifier.temperature:.1f}, "
+          f"threshold {classifier.threshold:.3f}{' (never skip the LLM)' if classifier.threshold > 1 else ''}")
+    print_report(classifier, held_out, [0.5, 0.7, 0.8, 0.9, 0.95, 0.99, classifier.threshold])
+
+    final = IntentClassifier((args.min_n, args.max_n), args.alpha, classifier.temperature, classifier.threshold)
+    final.fit([r["query"] for r in records], [r["intent"] for r in records])
+    final.save(args.output)
+    classifier = final
+
+    per_label = defaultdict(int)
+    for r in records:
+        per_label[r["intent"]] += 1
+    print(f"Trained on {len(records)} queries: {dict(per_label)}")
+    print(f"Vocabulary size: {len(classifier.log_likelihoods)} n-grams")
@@ -0,0 +1,137 @@
+import contextvars
+import threading
+import time
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+from prometheus_client import CONTENT_TYPE_LATEST, Histogram, generate_latest
+
+# Per request timing spans for every stage of a query, exported as Prometheus histograms at /metrics
+# and summarised in a Server-Timing header so the breakdown shows up in the browser devtools.
+# Stages: context, intent, question_type, answer, ner, recipe_index, pantry, cypher_generation, neo4j, qa
+
+STAGE_SECONDS = Histogram(
+    'deepdish_stage_seconds', 'Time spent in one stage of a query', ['intent', 'stage'],
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+)
+REQUEST_SECONDS = Histogram(
+    'deepdish_request_seconds', 'Time to answer a query', ['intent', 'endpoint'],
+    buckets=(0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60)
+)
+CALLS_PER_REQUEST = Histogram(
+    'deepdish_calls_per_request', 'LLM and Neo4j calls made to answer one query', ['intent', 'kind'],
+    buckets=(0, 1, 2, 3, 4, 5, 6, 8, 10, 15)
+)
+
+current_request = contextvars.ContextVar('current_request', default=None)
+
+
+class RequestTimings(object):
+    """The spans and call counts of one request. Speculative branches run on worker threads, hence the lock."""
+
+    def __init__(self, endpoint):
+        self.endpoint = endpoint
+        self.intent = 'unknown'
+        self.start = time.perf_counter()
+        self.stages = defaultdict(float)
+        self.calls = Counter()
+        self.lock = threading.Lock()
+
+    def add(self, stage, seconds):
+        with self.lock:
+            self.stages[stage] += seconds
+
+    def count(self, kind):
+        with self.lock:
+            self.calls[kind] += 1
+
+    def merge(self, other):
+        """Add the spans and calls of other, e.g. a speculative branch the request ended up using."""
+        stages, calls = other.stage_seconds(), other.call_counts()
+        with self.lock:
+            for stage, seconds in stages.items():
+                self.stages[stage] += seconds
+            self.calls.update(calls)
+
+    def stage_seconds(self):
+        with self.lock:
+            return dict(self.stages)
+
+    def call_counts(self):
+        with self.lock:
+            return dict(self.calls)
+
+    def elapsed(self):
+        return time.perf_counter() - self.start
+
+    def summary(self):
+        with self.lock:
+            return {
+                "intent": self.intent,
+                "total_ms": round(self.elapsed() * 1000, 1),
+                "stages_ms": {stage: round(seconds * 1000, 1) for stage, seconds in self.stages.items()},
+                "llm_calls": self.calls['llm'],
+                "neo4j_calls": self.calls['neo4j'],
+            }
+
+    def server_timing(self):
+        with self.lock:
+            parts = [f'{stage};dur={seconds * 1000:.1f}' for stage, seconds in self.stages.items()]
+            parts.append(f'llm;desc="{self.calls["llm"]} calls"')
+            parts.append(f'db;desc="{self.calls["neo4j"]} queries"')
+        parts.append(f'total;dur={self.elapsed() * 1000:.1f}')
+        return ", ".join(parts)
+
+
+def start_request(endpoint):
+    timings = RequestTimings(endpoint)
+    current_request.set(timings)
+    return timings
+
+
+@contextmanager
+def request_scope(timings):
+    # for code that runs outside the request's own context, like a streamed response body
+    token = current_request.set(timings)
+    try:
+        yield timings
+    finally:
+        current_request.reset(token)
+
+
+def set_intent(intent):
+    timings = current_request.get()
+    if timings is not None:
+        timings.intent = intent
+
+
+def count(kind):
+    """kind is 'llm' or 'neo4j', calls answered from a cache are not counted."""
+    timings = current_request.get()
+    if timings is not None:
+        timings.count(kind)
+
+
+@contextmanager
+def span(stage):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings = current_request.get()
+        if timings is not None:
+            timings.add(stage, time.perf_counter() - start)
+
+
+def finish(timings):
+    """Export the request to the histograms, once it has been answered."""
+    stages, calls = timings.stage_seconds(), timings.call_counts()
+    for stage, seconds in stages.items():
+        STAGE_SECONDS.labels(timings.intent, stage).observe(seconds)
+    for kind in ('llm', 'neo4j'):
+        CALLS_PER_REQUEST.labels(timings.intent, kind).observe(calls.get(kind, 0))
+    REQUEST_SECONDS.labels(timings.intent, timings.endpoint).observe(timings.elapsed())
+
+
+def exposition():
+    """Body and content type for a /metrics response."""
+    return generate_latest(), CONTENT_TYPE_LATEST
@@ -1,8 +1,18 @@
 from langchain_openai import ChatOpenAI
 from langchain.chains import GraphCypherQAChain
 from langchain_core.prompts.prompt import PromptTemplate
+from langchain_core.output_parsers import StrOutputParser
 from langchain_community.graphs import Neo4jGraph
+from langchain_community.chains.graph_qa.cypher import extract_cypher
+from langchain_community.chains.graph_qa.cypher_utils import CypherQueryCorrector
 from dotenv import load_dotenv
+from cypher_builder import build_cypher
+from graph_schema import SHOW_INDEXES, SchemaSlices, normalize_cypher, normalized_properties
+from recipe_index import RECIPE_INDEX_ENABLED, RecipeIndex
+from restaurant_geo import LOCATED_QUERY, located
+from neo4j import AsyncGraphDatabase
+import metrics
+import asyncio
 import getpass
 import os
 
@@ -37,6 +47,26 @@ graph = Neo4jGraph(
      neo4j_password
 )
 
+# Labels whose lowercase key is indexed (see graph_schema.py), toLower comparisons on them are rewritten to use it
+indexes = graph.query(SHOW_INDEXES)
+normalized = normalized_properties(indexes)
+# Whether the restaurants have been given city and location properties (see restaurant_geo.py)
+restaurant_counts = graph.query(LOCATED_QUERY)[0]
+restaurants_located = located(indexes, restaurant_counts)
+if restaurants_located and restaurant_counts["with_location"] < restaurant_counts["restaurants"]:
+    # those are still found by city through their address, but never by distance
+    print(f"{restaurant_counts['restaurants'] - restaurant_counts['with_location']} of {restaurant_counts['restaurants']} "
+          f"restaurants have no location and {restaurant_counts['restaurants'] - restaurant_counts['with_city']} no city, "
+          f"see 'python restaurant_geo.py migrate'")
+
+# Optional in-process recipe facet index (see recipe_index.py), answers the Cypher builder's recipe shapes without Neo4j
+recipe_index = RecipeIndex(graph.query).start() if RECIPE_INDEX_ENABLED else None
+# Most rows a /pantry request can ask for
+PANTRY_MAX_RESULTS = 50
+
+# Async driver for the ASGI server so graph lookups do not block the event loop
+async_driver = AsyncGraphDatabase.driver(neo4j_uri, auth=(neo4j_username, neo4j_password))
+
 # Define Cypher Generation and QA Prompts using dynamic schema
 CYPHER_GENERATION_TEMPLATE_RECIPE = """
 Role:
@@ -93,8 +123,7 @@ Guidelines:
 
 Use Only Explicit Relationships & Constraints
 
-If a city is provided to you, check that the restaurant is in that city using the address property.
-
+{location_guidelines}
 Do not add extra relationships unless the question explicitly requires them.
 
 Check Singular & Plural Forms for Node Properties
@@ -108,10 +137,7 @@ Handle and spelling or grammar errors in the user query before processing. All s
 Some input keys can be empty.
 
 Example:
-MATCH (n:Restaurant)-[:HAS_TYPE]->(t:Type)
-WHERE toLower(t.type) in ['donuts']
-AND n.address CONTAINS "Plano"
-RETURN n.name AS RestaurantName
+{location_example}
 
 Schema:
 {schema}
@@ -120,13 +146,34 @@ User Question:
 {question}
 """
 
+# Until restaurant_geo.py has parsed the addresses the city can only be found in the address text
+# (the prompt is an f-string template, literal braces are doubled)
+RESTAURANT_LOCATION_ADDRESS = ("""If a city is provided to you, check that the restaurant is in that city using the address property.
+""", """MATCH (n:Restaurant)-[:HAS_TYPE]->(t:Type)
+WHERE toLower(t.type) in ['donuts']
+AND n.address CONTAINS "Plano"
+RETURN n.name AS RestaurantName""")
+
+RESTAURANT_LOCATION_GEO = ("""If a city is provided to you, match it exactly with toLower(n.city) = "<city>", and search the address only
+for restaurants without a city: (toLower(n.city) = "<city>" OR n.city IS NULL AND toLower(n.address) CONTAINS "<city>").
+
+If a latitude, longitude and radius_miles are provided to you, keep the restaurants with
+point.distance(n.location, point({{latitude: <latitude>, longitude: <longitude>}})) <= radius_miles * 1609.344
+and order them by that distance, ignore the city then.
+""", """MATCH (n:Restaurant)-[:HAS_TYPE]->(t:Type)
+WHERE toLower(t.type) in ['donuts']
+AND (toLower(n.city) = "plano" OR n.city IS NULL AND toLower(n.address) CONTAINS "plano")
+RETURN n.name AS RestaurantName""")
+
 CYPHER_GENERATION_PROMPT_RECIPE = PromptTemplate(
     input_variables=["schema", "question"],
     template=CYPHER_GENERATION_TEMPLATE_RECIPE
 )
+location_guidelines, location_example = RESTAURANT_LOCATION_GEO if restaurants_located else RESTAURANT_LOCATION_ADDRESS
 CYPHER_GENERATION_PROMPT_RESTURANTS = PromptTemplate(
     input_variables=["schema", "question"],
-    template=CYPHER_GENERATION_TEMPLATE_RESTURANTS
+    template=CYPHER_GENERATION_TEMPLATE_RESTURANTS.replace("{location_guidelines}", location_guidelines)
+    .replace("{location_example}", location_example)
 )
 
 CYPHER_QA_PROMPT = PromptTemplate(
@@ -164,13 +211,146 @@ graph_chain_resturants = GraphCypherQAChain.from_llm(
     allow_dangerous_requests=True
 )
 
-# Query the graph with the criteria
-async def query_cypher(query, graph_intent, criteria=None, name=None):
+# The chains run this on the Cypher they generate before executing it
+class NormalizingCorrector(CypherQueryCorrector):
+    def __init__(self):
+        super().__init__([])
+
+    def __call__(self, query):
+        return normalize_cypher(query, normalized)
+
+graph_chain_recipe.cypher_query_corrector = NormalizingCorrector()
+graph_chain_resturants.cypher_query_corrector = NormalizingCorrector()
+
+# from_llm puts the whole graph schema into both Cypher prompts, each chain only needs its own labels (see graph_schema.py)
+schema_slices = SchemaSlices(graph)
+schema_slices.refresh()
+graph_chain_recipe.graph_schema = schema_slices.get('find a recipe')
+graph_chain_resturants.graph_schema = schema_slices.get('find a restaurant')
+
+def build_question(query, criteria=None, name=None):
     query += str(criteria)
     if name:
         query = f"Address the user by their name, {name}, when answering.\n" + query
+    return query
 
+def chain_for(graph_intent):
     if graph_intent == 'find a recipe':
-        return graph_chain_recipe.invoke({"query": query})
+        return graph_chain_recipe
+    return graph_chain_resturants
+
+# The steps of GraphCypherQAChain run one by one so each is timed and counted in metrics.py
+# Each step takes awaited: app.py runs them blocking, asgi.py awaits the OpenAI and Neo4j calls on its event loop
+def run_graph_query(cypher, params=None):
+    metrics.count('neo4j')
+    with metrics.span('neo4j'):
+        return graph.query(cypher, params or {})
+
+async def agraph_query(cypher, params=None):
+    metrics.count('neo4j')
+    with metrics.span('neo4j'):
+        records, _, _ = await async_driver.execute_query(cypher, params or {})
+    return [record.data() for record in records]
+
+async def graph_rows(cypher, params=None, awaited=False):
+    if awaited:
+        return await agraph_query(cypher, params)
+    return run_graph_query(cypher, params)
+
+async def generate_cypher(chain, query, graph_intent, awaited=False):
+    if not awaited:
+        schema = schema_slices.get(graph_intent)
+    elif schema_slices.stale():
+        # the schema version check is a blocking query, only hand it to a thread when one is due
+        schema = await asyncio.to_thread(schema_slices.get, graph_intent)
     else:
-        return graph_chain_resturants.invoke({"query": query})
\ No newline at end of file
+        schema = schema_slices.get(graph_intent)
+    metrics.count('llm')
+    with metrics.span('cypher_generation'):
+        inputs = {"question": query, "schema": schema}
+        if awaited:
+            generated = await chain.cypher_generation_chain.ainvoke(inputs)
+        else:
+            generated = chain.cypher_generation_chain.invoke(inputs)
+    return normalize_cypher(extract_cypher(generated[chain.cypher_generation_chain.output_key]), normalized)
+
+async def answer_from_context(chain, query, context, awaited=False):
+    metrics.count('llm')
+    with metrics.span('qa'):
+        inputs = {"question": query, "context": context}
+        result = await chain.qa_chain.ainvoke(inputs) if awaited else chain.qa_chain.invoke(inputs)
+    return result[chain.qa_chain.output_key]
+
+class Cancelled(Exception):
+    """A speculative graph query was stopped because the classified intent did not match it."""
+
+def check_cancelled(cancelled):
+    if cancelled is not None and cancelled.is_set():
+        raise Cancelled()
+
+# Rows from the recipe index, or None when it is off or the criteria need Neo4j
+# "What can I make with ..." questions are ranked by how much of each recipe the ingredients cover instead
+def index_context(graph_intent, criteria, chain):
+    if recipe_index is None or graph_intent != 'find a recipe':
+        return None
+    if isinstance(criteria, dict) and criteria.get('pantry'):
+        with metrics.span('pantry'):
+            return recipe_index.pantry(criteria.get('ingredients'), criteria.get('allergies'), criteria.get('category'),
+                                       criteria.get('cuisine'), chain.top_k)
+    with metrics.span('recipe_index'):
+        rows = recipe_index.query(criteria)
+    return rows[:chain.top_k] if rows is not None else None
+
+# Top recipes for an explicit ingredient list, None when the recipe index is off
+def pantry_matches(ingredients, allergies=None, categories=None, cuisines=None, limit=PANTRY_MAX_RESULTS):
+    limit = max(1, min(int(limit), PANTRY_MAX_RESULTS))
+    if recipe_index is None:
+        return None
+    with metrics.span('pantry'):
+        return recipe_index.pantry(ingredients, allergies, categories, cuisines, limit)
+
+# The rows to answer from and the Cypher that produced them
+# When direct is set and the criteria fit a known shape the Cypher is built locally (or answered by the recipe index);
+# an empty result may just be a spelling the LLM can work around, so otherwise the LLM writes the query
+async def graph_context(query, graph_intent, criteria, chain, direct=True, awaited=False, cancelled=None):
+    cypher, context = None, []
+    built = build_cypher(graph_intent, criteria, restaurants_located) if direct else None
+    if built is not None:
+        cypher, params = built
+        cypher = normalize_cypher(cypher, normalized)
+        # the index answers exactly what the built Cypher would, the Cypher is still returned for the stream's stage event
+        context = index_context(graph_intent, criteria, chain)
+        if context is None:
+            check_cancelled(cancelled)
+            context = (await graph_rows(cypher, params, awaited))[:chain.top_k]
+    if not context:
+        check_cancelled(cancelled)
+        cypher = await generate_cypher(chain, query, graph_intent, awaited)
+        check_cancelled(cancelled)
+        context = (await graph_rows(cypher, None, awaited))[:chain.top_k] if cypher else []
+    return cypher, context
+
+# Query the graph with the criteria and answer from the rows
+# cancelled (a threading.Event) stops a speculative branch that is no longer wanted before its next LLM or Neo4j call
+async def query_cypher(query, graph_intent, criteria=None, name=None, direct=True, awaited=False, cancelled=None):
+    query = build_question(query, criteria, name)
+    chain = chain_for(graph_intent)
+    _, context = await graph_context(query, graph_intent, criteria, chain, direct, awaited, cancelled)
+    check_cancelled(cancelled)
+    return {"query": query, "result": await answer_from_context(chain, query, context, awaited)}
+
+# Streaming version of query_cypher, yields ('cypher', {...}) once the graph has answered and then ('token', text) pieces of the answer
+def stream_cypher(query, graph_intent, criteria=None, name=None, direct=True):
+    query = build_question(query, criteria, name)
+    chain = chain_for(graph_intent)
+
+    # only blocking steps run here, so the coroutine completes on its own short lived loop
+    cypher, context = asyncio.run(graph_context(query, graph_intent, criteria, chain, direct))
+    yield 'cypher', {"cypher": cypher, "rows": len(context)}
+
+    # the chain's QA step is an LLMChain which only returns whole answers, so stream through its prompt and model directly
+    qa_stream = chain.qa_chain.prompt | chain.qa_chain.llm | StrOutputParser()
+    metrics.count('llm')
+    with metrics.span('qa'):
+        for token in qa_stream.stream({"question": query, "context": context}):
+            yield 'token', token
\ No newline at end of file
@@ -0,0 +1,435 @@
+import argparse
+import os
+import sys
+import threading
+import time
+from collections import defaultdict
+import numpy as np
+from cypher_builder import RESULT_LIMIT, as_list, build_recipe_query, parse_allergies
+
+# Optional in-process index of the recipe facets the Cypher builder filters on (see cypher_builder.py).
+# Every ingredient, category and cuisine value maps to the ids of its recipes, kept as a bitset (one bit per recipe)
+# when at least one recipe in 32 has it and as a sorted id array otherwise, whichever takes less memory.
+# A lookup is then a few bitwise ORs and ANDs over numpy words instead of a Neo4j round trip, and only the
+# matching ids are turned back into names. Recipe ids follow name order, so ORDER BY RecipeName is ascending ids.
+# The same data is kept as a sparse recipe x ingredient matrix for "what can I cook with my pantry" rankings.
+#
+#   RECIPE_INDEX=1 flask run
+#   python recipe_index.py --sizes 10000,100000,1000000   # memory, lookup and pantry latency on synthetic recipes
+
+RECIPE_INDEX_ENABLED = os.getenv('RECIPE_INDEX', '0') == '1'
+# how often the graph is asked whether recipes were added or removed since the index was built
+RECIPE_INDEX_CHECK_SECONDS = float(os.getenv('RECIPE_INDEX_CHECK_SECONDS', '60'))
+
+# ingredients every kitchen is assumed to have, they count towards a pantry match but are never listed as missing
+PANTRY_STAPLES = [s.strip().lower() for s in os.getenv('PANTRY_STAPLES', 'salt,pepper,black pepper,water').split(',') if s.strip()]
+
+FACETS = ("ingredients", "categories", "cuisines")
+
+INDEX_QUERY = """
+MATCH (r:Recipe)
+RETURN r.name AS name,
+       [(r)-[:CONTAINS]->(i:Ingredient) | i.name] AS ingredients,
+       [(r)-[:BELONGS_TO|BELONGS_TO_CATEGORY]->(c:Category) | c.value] AS categories,
+       [(r)-[:HAS_CUISINE]->(cu:Cuisine) | cu.value] AS cuisines
+"""
+
+# both counts come from the count store, so the check stays cheap however big the graph is.
+# Ingests only ever add recipes and ingredients, edits that keep both counts the same are picked up on restart.
+VERSION_QUERY = """
+MATCH (r:Recipe) WITH count(r) AS recipes
+MATCH ()-[c:CONTAINS]->()
+RETURN recipes, count(c) AS contains
+"""
+
+ONE = np.uint64(1)
+
+
+def to_bits(ids, words):
+    """Bitset of sorted unique ids, the bits falling into the same word are ORed together in one reduceat."""
+    bits = np.zeros(words, dtype=np.uint64)
+    if not len(ids):
+        return bits
+    ids = ids.astype(np.uint64)
+    word = (ids >> np.uint64(6)).astype(np.intp)
+    starts = np.flatnonzero(np.r_[True, word[1:] != word[:-1]])
+    bits[word[starts]] = np.bitwise_or.reduceat(ONE << (ids & np.uint64(63)), starts)
+    return bits
+
+
+def set_ids(bits, limit=None):
+    """Ids of the set bits in ascending order. Only non-zero words are unpacked, and with a limit only the first ones."""
+    words = np.flatnonzero(bits)
+    if limit is not None:
+        words = words[:limit]
+    if not len(words):
+        return words
+    unpacked = np.unpackbits(bits[words].astype('<u8').view(np.uint8), bitorder='little').reshape(len(words), 64)
+    rows, columns = np.nonzero(unpacked)
+    return (words[rows] * 64 + columns)[:limit]
+
+
+def is_bitset(posting):
+    return posting.dtype == np.uint64
+
+
+def has_bit(bits, i):
+    return bool((int(bits[i >> 6]) >> (i & 63)) & 1)
+
+
+def to_mask(bits, size):
+    """Bitset as a bool array with one entry per recipe."""
+    return np.unpackbits(bits.astype('<u8').view(np.uint8), bitorder='little')[:size].astype(bool)
+
+
+class PantryMatrix(object):
+    """Sparse recipe x ingredient matrix, stored by ingredient (CSC) so a whole pantry is scored with one bincount,
+    and by recipe (CSR) so the missing ingredients of the top recipes are a slice each."""
+
+    def __init__(self, recipes, columns, bitsets=None, staples=PANTRY_STAPLES):
+        """columns: lowercase ingredient -> recipe ids, bitsets: the ones FacetIndex keeps as bitsets."""
+        self.vocabulary = sorted(columns)
+        self.column = {value: c for c, value in enumerate(self.vocabulary)}
+        column_ids = [np.unique(np.asarray(columns[value], dtype=np.uint32)) for value in self.vocabulary]
+        lengths = np.array([len(ids) for ids in column_ids], dtype=np.int64)
+        self.column_ptr = np.r_[0, np.cumsum(lengths)]
+        self.column_recipes = np.concatenate(column_ids) if column_ids else np.empty(0, dtype=np.uint32)
+
+        order = np.argsort(self.column_recipes, kind="stable")
+        self.row_ingredients = np.repeat(np.arange(len(self.vocabulary), dtype=np.uint32), lengths)[order]
+        self.sizes = np.bincount(self.column_recipes, minlength=recipes)
+        self.row_ptr = np.r_[0, np.cumsum(self.sizes)]
+        # common ingredients are added up from their bitsets, unpacking one is cheaper than counting its ids
+        self.bitsets = {self.column[value]: bits for value, bits in (bitsets or {}).items() if value in self.column}
+
+        # staples are the same for every pantry, so their count per recipe is only taken once
+        self.staples = set(staples)
+        self.staple_count = self.count(self.columns_of(self.staples))
+
+        # every (ingredients, ingredients had) pair ranked by coverage and then fewest missing, so ranking a pantry
+        # is one table lookup per recipe and a bincount over the ranks instead of sorting the candidates
+        self.width = int(self.sizes.max()) + 1 if recipes else 1
+        size, have = np.divmod(np.arange(self.width * self.width), self.width)
+        valid = np.flatnonzero((size > 0) & (have <= size))
+        coverage, missing = have[valid] / size[valid], size[valid] - have[valid]
+        order = np.lexsort((missing, -coverage))
+        # pairs with the same coverage and missing count share a rank (1 of 1 and 2 of 2), name order decides those
+        changed = (np.diff(coverage[order]) != 0) | (np.diff(missing[order]) != 0)
+        ranks = np.r_[0, np.cumsum(changed)].astype(np.int32)
+        self.unranked = int(ranks[-1]) + 1 if len(ranks) else 0
+        # the smallest types that fit, the lookup runs over every recipe
+        self.rank_table = np.full(self.width * self.width, self.unranked, dtype=np.uint8 if self.unranked < 255 else np.int32)
+        self.rank_table[valid[order]] = ranks
+        self.rank_base = (self.sizes * self.width).astype(np.uint16 if self.width * self.width <= 65536 else np.int64)
+
+    def columns_of(self, values):
+        return np.array(sorted({self.column[v] for v in values if v in self.column}), dtype=np.int64)
+
+    def count(self, columns):
+        """How many of the columns each recipe has."""
+        # the unpacked bits are 0/1 bytes, adding them without a cast is what keeps this fast
+        counts = np.zeros(len(self.sizes), dtype=np.uint8 if len(columns) < 256 else np.int64)
+        sparse = []
+        for c in columns:
+            if c in self.bitsets:
+                bits = np.unpackbits(self.bitsets[c].astype('<u8').view(np.uint8), bitorder='little')
+                np.add(counts, bits[:len(self.sizes)], out=counts, casting='unsafe')
+            else:
+                sparse.append(self.column_recipes[self.column_ptr[c]:self.column_ptr[c + 1]])
+        if sparse:
+            np.add(counts, np.bincount(np.concatenate(sparse), minlength=len(self.sizes)), out=counts, casting='unsafe')
+        return counts
+
+    def row(self, recipe_id):
+        return self.row_ingredients[self.row_ptr[recipe_id]:self.row_ptr[recipe_id + 1]]
+
+    def rank(self, pantry, limit, allowed=None, excluded=None):
+        """The limit recipes with the largest share of their ingredients in the pantry, fewest missing and then name
+        breaking ties. Only recipes with at least one pantry ingredient that is not a staple are ranked.
+        allowed and excluded are bitsets. Returns (recipe ids, coverage) best first."""
+        own = self.count(self.columns_of(set(pantry) - self.staples))
+        candidate = own > 0
+        if allowed is not None:
+            candidate &= to_mask(allowed, len(self.sizes))
+        if excluded is not None:
+            candidate &= ~to_mask(excluded, len(self.sizes))
+
+        have = own + self.staple_count
+        pairs = np.add(self.rank_base, have, dtype=self.rank_base.dtype, casting='unsafe')
+        # pair 0 (no ingredients) is unranked, zeroing the others is cheaper than masking the ranks afterwards
+        np.multiply(pairs, candidate, out=pairs, casting='unsafe')
+        ranks = self.rank_table[pairs]
+        # the rank the limit-th best recipe has, everything better is in and recipes on it are taken in name order
+        cumulative = np.cumsum(np.bincount(ranks, minlength=self.unranked + 1)[:self.unranked])
+        if not len(cumulative) or not cumulative[-1]:
+            return np.empty(0, dtype=np.int64), np.empty(0)
+        cutoff = int(np.searchsorted(cumulative, min(limit, cumulative[-1])))
+        better = np.flatnonzero(ranks < cutoff)
+        ids = np.r_[better, np.flatnonzero(ranks == cutoff)[:limit - len(better)]]
+        ids = ids[np.lexsort((ids, ranks[ids]))]
+        return ids, have[ids] / self.sizes[ids]
+
+    def nbytes(self):
+        arrays = (self.column_ptr, self.column_recipes, self.row_ingredients, self.sizes, self.row_ptr,
+                  self.staple_count, self.rank_table, self.rank_base)
+        return sum(a.nbytes for a in arrays)
+
+
+class FacetIndex(object):
+    """One immutable snapshot of the recipe facets, lookups never lock."""
+
+    def __init__(self, names, postings, matrix, version=None):
+        self.names = names
+        self.words = (len(names) + 63) // 64
+        self.postings = postings
+        self.matrix = matrix
+        self.version = version
+
+    @classmethod
+    def from_ids(cls, names, facet_ids, version=None):
+        """names in name order, facet_ids: facet -> {lowercase value: recipe ids}."""
+        words = (len(names) + 63) // 64
+        postings = {}
+        for facet, values in facet_ids.items():
+            postings[facet] = {}
+            for value, ids in values.items():
+                ids = np.unique(np.asarray(ids, dtype=np.uint32))
+                # a bitset costs len(names) / 8 bytes, an id array 4 bytes per recipe
+                postings[facet][value] = to_bits(ids, words) if len(ids) * 32 >= len(names) else ids
+        ingredients = postings.get("ingredients", {})
+        bitsets = {value: posting for value, posting in ingredients.items() if is_bitset(posting)}
+        return cls(names, postings, PantryMatrix(len(names), facet_ids.get("ingredients", {}), bitsets), version)
+
+    @classmethod
+    def from_records(cls, records, version=None):
+        """records: rows of INDEX_QUERY."""
+        records = sorted(records, key=lambda record: record["name"])
+        facet_ids = {facet: defaultdict(list) for facet in FACETS}
+        for recipe_id, record in enumerate(records):
+            for facet in FACETS:
+                for value in record.get(facet) or []:
+                    if isinstance(value, str):
+                        facet_ids[facet][value.lower()].append(recipe_id)
+        return cls.from_ids([record["name"] for record in records], facet_ids, version)
+
+    def bits(self, facet, value):
+        posting = self.postings.get(facet, {}).get(value)
+        if posting is None:
+            return None
+        return posting if is_bitset(posting) else to_bits(posting, self.words)
+
+    def any_of(self, facet, values):
+        """Bitset of the recipes with at least one of the values."""
+        bits = np.zeros(self.words, dtype=np.uint64)
+        for value in values:
+            value_bits = self.bits(facet, value)
+            if value_bits is not None:
+                bits |= value_bits
+        return bits
+
+    def query(self, criteria, limit=RESULT_LIMIT):
+        """The rows build_recipe_query's Cypher would return, or None when the criteria need the LLM."""
+        if build_recipe_query(criteria) is None:
+            return None
+        categories = sorted({c.lower() for c in as_list(criteria.get("category"))})
+        cuisines = sorted({c.lower() for c in as_list(criteria.get("cuisine"))})
+        ingredients = sorted({i.lower() for i in as_list(criteria.get("ingredients"))})
+        allergies = parse_allergies(criteria.get("allergies"))
+
+        # build_recipe_query only answers when at least one of these is set, so mask never keeps padding bits
+        mask = None
+        for facet, values in (("categories", categories), ("cuisines", cuisines), ("ingredients", ingredients)):
+            if values:
+                bits = self.any_of(facet, values)
+                mask = bits if mask is None else mask & bits
+        if allergies:
+            mask &= ~self.any_of("ingredients", allergies)
+        if not ingredients:
+            return [{"RecipeName": self.names[i]} for i in set_ids(mask, limit)]
+
+        # ORDER BY size(MatchedIngredients) DESC, RecipeName without ranking every candidate:
+        # at_least[m] holds the matching recipes with m or more of the ingredients, taken from the top level down
+        at_least = [mask]
+        present = {}
+        for value in ingredients:
+            value_bits = self.bits("ingredients", value)
+            if value_bits is None:
+                continue
+            present[value] = value_bits
+            at_least.append(at_least[-1] & value_bits)
+            for m in range(len(at_least) - 2, 0, -1):
+                at_least[m] = at_least[m] | (at_least[m - 1] & value_bits)
+
+        rows = []
+        for m in range(len(at_least) - 1, 0, -1):
+            exact = at_least[m] & ~at_least[m + 1] if m + 1 < len(at_least) else at_least[m]
+            for i in set_ids(exact, limit - len(rows)):
+                matched = [value for value, value_bits in present.items() if has_bit(value_bits, int(i))]
+                rows.append({"RecipeName": self.names[i], "MatchedIngredients": matched})
+            if len(rows) >= limit:
+                break
+        return rows
+
+    def pantry(self, ingredients, allergies=None, categories=None, cuisines=None, limit=RESULT_LIMIT):
+        """Recipes ranked by the share of their ingredients the pantry covers, with the ones still missing.
+        A recipe with any of the allergies is left out, categories and cuisines narrow the candidates as in query."""
+        pantry = {i.lower() for i in as_list(ingredients)}
+        allowed = None
+        for facet, values in (("categories", categories), ("cuisines", cuisines)):
+            values = {v.lower() for v in as_list(values)}
+            if values:
+                bits = self.any_of(facet, values)
+                allowed = bits if allowed is None else allowed & bits
+        allergies = parse_allergies(allergies)
+        excluded = self.any_of("ingredients", allergies) if allergies else None
+
+        ids, coverage = self.matrix.rank(pantry, limit, allowed, excluded)
+        rows = []
+        for i, share in zip(ids, coverage):
+            ingredients = [self.matrix.vocabulary[c] for c in self.matrix.row(i)]
+            rows.append({
+                "RecipeName": self.names[i],
+                "Coverage": round(float(share), 2),
+                "MatchedIngredients": [v for v in ingredients if v in pantry],
+                "MissingIngredients": [v for v in ingredients if v not in pantry and v not in self.matrix.staples],
+            })
+        return rows
+
+    def memory(self):
+        """Bytes held by the postings, and how many values are stored as bitsets and as id arrays."""
+        stats = {"bytes": 0, "bitsets": 0, "arrays": 0, "matrix_bytes": self.matrix.nbytes()}
+        for values in self.postings.values():
+            for posting in values.values():
+                stats["bytes"] += posting.nbytes
+                stats["bitsets" if is_bitset(posting) else "arrays"] += 1
+        return stats
+
+
+class RecipeIndex(object):
+    """The current FacetIndex of the graph, rebuilt on a background thread whenever VERSION_QUERY changes.
+    run_query is e.g. Neo4jGraph.query, returning a list of dicts."""
+
+    def __init__(self, run_query, check_seconds=RECIPE_INDEX_CHECK_SECONDS):
+        self.run_query = run_query
+        self.check_seconds = check_seconds
+        self.index = None
+        self.lock = threading.Lock()
+
+    def version(self):
+        rows = self.run_query(VERSION_QUERY)
+        return tuple(rows[0].values()) if rows else None
+
+    def refresh(self):
+        """Returns True when the index was rebuilt."""
+        with self.lock:
+            # read the version before the data, so a change made during the build is seen by the next check
+            version = self.version()
+            if self.index is not None and self.index.version == version:
+                return False
+            start = time.perf_counter()
+            index = FacetIndex.from_records(self.run_query(INDEX_QUERY), version)
+            # lookups already running keep the snapshot they started with
+            self.index = index
+            print(f"Built recipe index of {len(index.names)} recipes in {time.perf_counter() - start:.1f} s, "
+                  f"{index.memory()['bytes'] / 1e6:.1f} MB")
+            return True
+
+    def watch(self):
+        while True:
+            time.sleep(self.check_seconds)
+            try:
+                self.refresh()
+            except Exception as e:
+                print(f"Recipe index refresh failed: {e}")
+
+    def start(self):
+        self.refresh()
+        threading.Thread(target=self.watch, daemon=True).start()
+        return self
+
+    def query(self, criteria, limit=RESULT_LIMIT):
+        index = self.index
+        if index is None or not isinstance(criteria, dict):
+            return None
+        return index.query(criteria, limit)
+
+    def pantry(self, ingredients, allergies=None, categories=None, cuisines=None, limit=RESULT_LIMIT):
+        index = self.index
+        if index is None:
+            return None
+        return index.pantry(ingredients, allergies, categories, cuisines, limit)
+
+
+def synthetic_index(recipes, ingredients=5000, categories=30, cuisines=40, per_recipe=9, seed=0):
+    """Recipes with Zipf distributed ingredients, like real recipe data where a few staples appear everywhere."""
+    rng = np.random.default_rng(seed)
+    names = [f"recipe {i:08d}" for i in range(recipes)]
+    facet_ids = {}
+    for facet, prefix, vocabulary, per in (("ingredients", "ingredient", ingredients, per_recipe),
+                                           ("categories", "category", categories, 1), ("cuisines", "cuisine", cuisines, 1)):
+        owners = np.repeat(np.arange(recipes, dtype=np.uint32), per)
+        values = (rng.zipf(1.3, len(owners)) - 1) % vocabulary
+        order = np.argsort(values, kind="stable")
+        values, owners = values[order], owners[order]
+        starts = np.flatnonzero(np.r_[True, values[1:] != values[:-1]])
+        facet_ids[facet] = {
+            f"{prefix} {value}": ids for value, ids in zip(values[starts], np.split(owners, starts[1:]))
+        }
+    return FacetIndex.from_ids(names, facet_ids)
+
+
+def sample_criteria(rng, count):
+    def pick(facet, vocabulary, size):
+        return [f"{facet} {v}" for v in (rng.zipf(1.3, size) - 1) % vocabulary]
+
+    criteria = []
+    for _ in range(count):
+        criteria.append({
+            "ingredients": pick("ingredient", 5000, int(rng.integers(1, 4))),
+            "category": pick("category", 30, 1) if rng.random() < 0.5 else [],
+            "cuisine": pick("cuisine", 40, 1) if rng.random() < 0.3 else [],
+            "allergies": ",".join(pick("ingredient", 5000, 1)) if rng.random() < 0.3 else "",
+        })
+    return criteria
+
+
+def benchmark(recipes, queries):
+    start = time.perf_counter()
+    index = synthetic_index(recipes)
+    build = time.perf_counter() - start
+    memory = index.memory()
+    names = sys.getsizeof(index.names) + sum(sys.getsizeof(name) for name in index.names)
+
+    latencies = []
+    pantry_latencies = []
+    rng = np.random.default_rng(2)
+    for criteria in sample_criteria(np.random.default_rng(1), queries):
+        start = time.perf_counter()
+        index.query(criteria)
+        latencies.append(time.perf_counter() - start)
+
+        # a pantry is a longer list than a search, mostly common ingredients
+        pantry = [f"ingredient {v}" for v in (rng.zipf(1.3, int(rng.integers(3, 15))) - 1) % 5000]
+        start = time.perf_counter()
+        index.pantry(pantry, criteria["allergies"], criteria["category"])
+        pantry_latencies.append(time.perf_counter() - start)
+    p50, p95, p99 = np.percentile(latencies, [50, 95, 99]) * 1e6
+    pantry_p50, pantry_p95 = np.percentile(pantry_latencies, [50, 95]) * 1e6
+    return {"recipes": recipes, "build_s": build, "postings_mb": memory["bytes"] / 1e6, "names_mb": names / 1e6,
+            "matrix_mb": memory["matrix_bytes"] / 1e6, "bitsets": memory["bitsets"], "arrays": memory["arrays"],
+            "p50_us": p50, "p95_us": p95, "p99_us": p99, "pantry_p50_us": pantry_p50, "pantry_p95_us": pantry_p95}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Memory and lookup latency of the recipe index on synthetic recipes.")
+    parser.add_argument("--sizes", default="10000,100000,1000000", help="Comma separated recipe counts")
+    parser.add_argument("--queries", type=int, default=2000, help="Lookups per size")
+    args = parser.parse_args()
+
+    print(f"{'recipes':>9} {'build s':>8} {'postings MB':>11} {'matrix MB':>9} {'names MB':>9} {'bitsets':>8} {'arrays':>7} "
+          f"{'p50 us':>8} {'p95 us':>8} {'p99 us':>8} {'pantry p50':>10} {'pantry p95':>10}")
+    for size in [int(s) for s in args.sizes.split(",")]:
+        r = benchmark(size, args.queries)
+        print(f"{r['recipes']:>9} {r['build_s']:>8.1f} {r['postings_mb']:>11.1f} {r['matrix_mb']:>9.1f} {r['names_mb']:>9.1f} "
+              f"{r['bitsets']:>8} {r['arrays']:>7} {r['p50_us']:>8.0f} {r['p95_us']:>8.0f} {r['p99_us']:>8.0f} "
+              f"{r['pantry_p50_us']:>10.0f} {r['pantry_p95_us']:>10.0f}")
@@ -0,0 +1,115 @@
+import hashlib
+import json
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+
+def normalize_input(text):
+    """Collapse whitespace and case so trivially different prompts share a cache entry."""
+    return re.sub(r"\s+", " ", text).strip().casefold()
+
+
+class ResponseCache(object):
+    """LRU cache with a TTL for LLM responses, optionally backed by a SQLite file that survives restarts."""
+
+    def __init__(self, max_entries=1024, ttl=86400, path=None, max_disk_entries=100000):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.max_disk_entries = max_disk_entries
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.writes_since_prune = 0
+
+        self.db = None
+        if path:
+            self.db = sqlite3.connect(path, check_same_thread=False)
+            self.db.execute("""
+                CREATE TABLE IF NOT EXISTS responses (
+                    key TEXT PRIMARY KEY,
+                    value TEXT NOT NULL,
+                    expires_at REAL NOT NULL
+                )
+            """)
+            self.db.execute("CREATE INDEX IF NOT EXISTS responses_expires_at ON responses (expires_at)")
+            self.db.commit()
+
+    @staticmethod
+    def key(model, system_instruction, user_input, temperature):
+        payload = json.dumps([model, system_instruction, normalize_input(user_input), temperature])
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def get(self, key):
+        now = time.time()
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                expires_at, value = entry
+                if expires_at > now:
+                    self.entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self.entries[key]
+                self.expirations += 1
+
+            if self.db is not None:
+                row = self.db.execute("SELECT value, expires_at FROM responses WHERE key = ?", (key,)).fetchone()
+                if row is not None and row[1] > now:
+                    self.remember(key, row[0], row[1])
+                    self.hits += 1
+                    return row[0]
+
+            self.misses += 1
+            return None
+
+    def set(self, key, value):
+        expires_at = time.time() + self.ttl
+        with self.lock:
+            self.remember(key, value, expires_at)
+            if self.db is not None:
+                self.db.execute("INSERT OR REPLACE INTO responses (key, value, expires_at) VALUES (?, ?, ?)", (key, value, expires_at))
+                self.writes_since_prune += 1
+                if self.writes_since_prune >= 100:
+                    self.prune_disk()
+                self.db.commit()
+
+    def remember(self, key, value, expires_at):
+        # caller holds the lock
+        if self.max_entries <= 0:
+            return
+        self.entries[key] = (expires_at, value)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    def prune_disk(self):
+        # caller holds the lock, drop expired rows and then the rows closest to expiring until under the cap
+        self.writes_since_prune = 0
+        self.db.execute("DELETE FROM responses WHERE expires_at <= ?", (time.time(),))
+        count = self.db.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+        if count > self.max_disk_entries:
+            self.db.execute(
+                "DELETE FROM responses WHERE key IN (SELECT key FROM responses ORDER BY expires_at LIMIT ?)",
+                (count - self.max_disk_entries,)
+            )
+            self.evictions += count - self.max_disk_entries
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self.entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "persistent": self.db is not None
+            }
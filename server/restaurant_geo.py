@@ -0,0 +1,242 @@
+# Structured location for Restaurant nodes: the free text address is parsed into city, state and postal_code
+# properties and a location point, so restaurant lookups are index seeks (toLower(n.city) = ..., rewritten onto
+# n.city_lower by graph_schema.normalize_cypher) and point index range scans for "within 5 miles", instead of
+# n.address CONTAINS ... over every Restaurant node.
+#
+# Points come from latitude/longitude in the imported rows when present, otherwise from the centroid of the postal code
+# (or of the city) in a GeoNames postal code dump, e.g. https://download.geonames.org/export/zip/US.zip
+#
+#   python restaurant_geo.py migrate --postal-codes US.txt          # backfill the existing restaurants
+#   python restaurant_geo.py import restaurants.json --postal-codes US.txt
+import argparse
+import csv
+import json
+import os
+import re
+from collections import defaultdict
+
+BATCH_SIZE = 1000
+
+US_STATES = {
+    "alabama": "AL", "alaska": "AK", "arizona": "AZ", "arkansas": "AR", "california": "CA", "colorado": "CO",
+    "connecticut": "CT", "delaware": "DE", "district of columbia": "DC", "florida": "FL", "georgia": "GA",
+    "hawaii": "HI", "idaho": "ID", "illinois": "IL", "indiana": "IN", "iowa": "IA", "kansas": "KS", "kentucky": "KY",
+    "louisiana": "LA", "maine": "ME", "maryland": "MD", "massachusetts": "MA", "michigan": "MI", "minnesota": "MN",
+    "mississippi": "MS", "missouri": "MO", "montana": "MT", "nebraska": "NE", "nevada": "NV", "new hampshire": "NH",
+    "new jersey": "NJ", "new mexico": "NM", "new york": "NY", "north carolina": "NC", "north dakota": "ND",
+    "ohio": "OH", "oklahoma": "OK", "oregon": "OR", "pennsylvania": "PA", "rhode island": "RI",
+    "south carolina": "SC", "south dakota": "SD", "tennessee": "TN", "texas": "TX", "utah": "UT", "vermont": "VT",
+    "virginia": "VA", "washington": "WA", "west virginia": "WV", "wisconsin": "WI", "wyoming": "WY",
+    "puerto rico": "PR",
+}
+STATE_CODES = set(US_STATES.values())
+
+COUNTRY_SUFFIX = re.compile(r",?\s*(usa|us|united states(?: of america)?)\s*$", re.IGNORECASE)
+# "<state> <zip>" or "<state>" as the last comma separated part, the city is the part before it
+STATE_ZIP = re.compile(r"^(?P<state>[A-Za-z][A-Za-z .]*?)\.?(?:\s+(?P<postal>\d{5})(?:-\d{4})?)?$")
+
+# restaurant names repeat across locations, so the address is part of the key
+IMPORT_QUERY = """
+UNWIND $rows AS row
+MERGE (n:Restaurant {name: row.name, address: row.address})
+SET n.rating = row.rating, n.city = row.city, n.city_lower = toLower(row.city), n.state = row.state,
+    n.postal_code = row.postal_code,
+    n.location = CASE WHEN row.latitude IS NULL THEN null ELSE point({latitude: row.latitude, longitude: row.longitude}) END
+WITH n, row
+UNWIND row.types AS type
+MERGE (t:Type {type: type})
+SET t.type_lower = toLower(type)
+MERGE (n)-[:HAS_TYPE]->(t)
+"""
+
+UNPARSED_QUERY = """
+MATCH (n:Restaurant)
+WHERE n.address IS NOT NULL AND ($all OR n.city IS NULL OR n.location IS NULL)
+RETURN elementId(n) AS id, n.address AS address,
+       n.location.latitude AS latitude, n.location.longitude AS longitude
+"""
+
+# an address that does not parse keeps its old values rather than losing them
+MIGRATE_QUERY = """
+UNWIND $rows AS row
+MATCH (n:Restaurant) WHERE elementId(n) = row.id
+SET n.city = coalesce(row.city, n.city), n.city_lower = toLower(coalesce(row.city, n.city)),
+    n.state = coalesce(row.state, n.state), n.postal_code = coalesce(row.postal_code, n.postal_code),
+    n.location = CASE WHEN row.latitude IS NULL THEN n.location ELSE point({latitude: row.latitude, longitude: row.longitude}) END
+"""
+
+LOCATION_INDEX = "restaurant_location"
+
+# how many restaurants the migration has reached, count(property) skips the nulls
+LOCATED_QUERY = """
+MATCH (n:Restaurant)
+RETURN count(n) AS restaurants, count(n.city) AS with_city, count(n.location) AS with_location
+"""
+
+
+def index_statements():
+    # 'graph_schema.py bootstrap' creates the city_lower index too, it is here so a migration alone is enough
+    return [
+        "CREATE INDEX restaurant_city_lower IF NOT EXISTS FOR (n:Restaurant) ON (n.city_lower)",
+        "CREATE INDEX restaurant_state IF NOT EXISTS FOR (n:Restaurant) ON (n.state)",
+        "CREATE INDEX restaurant_postal_code IF NOT EXISTS FOR (n:Restaurant) ON (n.postal_code)",
+        f"CREATE POINT INDEX {LOCATION_INDEX} IF NOT EXISTS FOR (n:Restaurant) ON (n.location)",
+    ]
+
+
+def located(indexes, counts):
+    """True once the restaurants carry a location: the point index this module creates is online and some
+    restaurants have been given a location. Takes the rows of graph_schema.SHOW_INDEXES and the row of LOCATED_QUERY."""
+    if not counts or not counts.get("with_location"):
+        return False
+    for index in indexes:
+        if (index.get("state") == "ONLINE" and "Restaurant" in (index.get("labelsOrTypes") or [])
+                and "location" in (index.get("properties") or [])):
+            return True
+    return False
+
+
+def state_code(text):
+    text = text.strip().rstrip(".")
+    if text.upper() in STATE_CODES:
+        return text.upper()
+    return US_STATES.get(text.lower())
+
+
+def parse_address(address):
+    """City, state code and 5 digit postal code of a US style address, e.g. "1901 Preston Rd, Plano, TX 75093".
+    Parts that can not be recognised are None."""
+    parsed = {"city": None, "state": None, "postal_code": None}
+    if not address:
+        return parsed
+    parts = [p.strip() for p in COUNTRY_SUFFIX.sub("", address.strip()).split(",") if p.strip()]
+    if len(parts) < 2:
+        return parsed
+
+    match = STATE_ZIP.match(parts[-1])
+    state = state_code(match.group("state")) if match else None
+    if state is None:
+        # "Plano TX 75093" without the comma before the state
+        words = parts[-1].rsplit(None, 2)
+        if len(words) == 3 and re.fullmatch(r"\d{5}(-\d{4})?", words[2]) and state_code(words[1]):
+            parts = parts[:-1] + [words[0], f"{words[1]} {words[2]}"]
+            match = STATE_ZIP.match(parts[-1])
+            state = state_code(match.group("state"))
+    if state is None:
+        return parsed
+
+    parsed["state"] = state
+    parsed["postal_code"] = match.group("postal")
+    city = parts[-2]
+    # a street number means the city was left out of the address
+    if not re.match(r"^\d", city):
+        parsed["city"] = city.title() if city.isupper() or city.islower() else city
+    return parsed
+
+
+class Centroids(object):
+    """Postal code and city centroids from a GeoNames postal code dump (tab separated, latitude and longitude
+    in columns 10 and 11). A city's centroid is the mean of its postal codes."""
+
+    def __init__(self, postal_codes=None, cities=None):
+        self.postal_codes = postal_codes or {}
+        self.cities = cities or {}
+
+    @classmethod
+    def load(cls, path):
+        if not path:
+            return cls()
+        postal_codes = {}
+        sums = defaultdict(lambda: [0.0, 0.0, 0])
+        with open(path, encoding="utf-8") as f:
+            for row in csv.reader(f, delimiter="\t", quoting=csv.QUOTE_NONE):
+                if len(row) < 11 or not row[9] or not row[10]:
+                    continue
+                latitude, longitude = float(row[9]), float(row[10])
+                postal_codes[row[1]] = (latitude, longitude)
+                total = sums[(row[2].lower(), row[4].upper())]
+                total[0] += latitude
+                total[1] += longitude
+                total[2] += 1
+        cities = {key: (lat / n, lon / n) for key, (lat, lon, n) in sums.items()}
+        print(f"Loaded {len(postal_codes)} postal code and {len(cities)} city centroids")
+        return cls(postal_codes, cities)
+
+    def locate(self, parsed):
+        if parsed["postal_code"] in self.postal_codes:
+            return self.postal_codes[parsed["postal_code"]]
+        if parsed["city"] and parsed["state"]:
+            return self.cities.get((parsed["city"].lower(), parsed["state"]))
+        return None
+
+
+def geo_fields(address, centroids, latitude=None, longitude=None):
+    fields = parse_address(address)
+    if latitude is None or longitude is None:
+        latitude, longitude = centroids.locate(fields) or (None, None)
+    fields["latitude"], fields["longitude"] = latitude, longitude
+    return fields
+
+
+def create_indexes(driver):
+    with driver.session() as session:
+        for statement in index_statements():
+            session.run(statement).consume()
+            print(statement)
+        session.run("CALL db.awaitIndexes(300)").consume()
+
+
+def import_restaurants(driver, restaurants, centroids=None):
+    """MERGE restaurants ({name, address, rating, types}, optionally latitude and longitude) with parsed location fields."""
+    centroids = centroids or Centroids()
+    rows = []
+    for restaurant in restaurants:
+        row = dict(restaurant, types=restaurant.get("types") or [])
+        row.update(geo_fields(row.get("address"), centroids, row.get("latitude"), row.get("longitude")))
+        rows.append(row)
+    for start in range(0, len(rows), BATCH_SIZE):
+        driver.execute_query(IMPORT_QUERY, rows=rows[start:start + BATCH_SIZE])
+    print(f"Imported {len(rows)} restaurants, {sum(r['city'] is not None for r in rows)} with a city "
+          f"and {sum(r['latitude'] is not None for r in rows)} with a location")
+    create_indexes(driver)
+
+
+def migrate(driver, centroids, all_restaurants=False):
+    """Parse the address of every Restaurant still missing its city or location (or all of them) and store the fields."""
+    from neo4j import READ_ACCESS
+
+    records, _, _ = driver.execute_query(UNPARSED_QUERY, all=all_restaurants, routing_=READ_ACCESS)
+    rows = [dict(geo_fields(r["address"], centroids, r["latitude"], r["longitude"]), id=r["id"]) for r in records]
+    for start in range(0, len(rows), BATCH_SIZE):
+        driver.execute_query(MIGRATE_QUERY, rows=rows[start:start + BATCH_SIZE])
+    print(f"Migrated {len(rows)} restaurants, {sum(r['city'] is None for r in rows)} addresses without a city "
+          f"and {sum(r['latitude'] is None for r in rows)} without a location")
+    create_indexes(driver)
+
+
+if __name__ == "__main__":
+    # only the command line needs these, the parsing helpers are used without a database (e.g. by the tests)
+    from dotenv import load_dotenv
+    from neo4j import GraphDatabase
+
+    load_dotenv()
+    parser = argparse.ArgumentParser(description="Give Restaurant nodes indexed city, state, postal code and location properties.")
+    parser.add_argument("command", choices=["migrate", "import"])
+    parser.add_argument("file", nargs="?", help="JSON list of restaurants to import")
+    parser.add_argument("--postal-codes", default=os.getenv('RESTAURANT_POSTAL_CODES'),
+                        help="GeoNames postal code file used to place addresses without coordinates")
+    parser.add_argument("--all", action="store_true", help="Re-parse restaurants that were already migrated")
+    args = parser.parse_args()
+    if args.command == "import" and not args.file:
+        parser.error("import needs a JSON file")
+
+    centroids = Centroids.load(args.postal_codes)
+    driver = GraphDatabase.driver(os.getenv('NEO4J_URI'), auth=(os.getenv('NEO4J_USERNAME'), os.getenv('NEO4J_PASSWORD')))
+    try:
+        if args.command == "migrate":
+            migrate(driver, centroids, args.all)
+        else:
+            with open(args.file, encoding="utf-8") as f:
+                import_restaurants(driver, json.load(f), centroids)
+    finally:
+        driver.close()
@@ -0,0 +1,178 @@
+import asyncio
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager, contextmanager
+from langchain.memory import ConversationBufferMemory
+from langchain_core.messages import messages_from_dict, messages_to_dict
+
+
+class Session(object):
+    """One conversation, use it through SessionStore.session/async_session which hold its lock for the
+    whole request so concurrent requests from the same user cannot interleave their messages."""
+
+    def __init__(self, session_id):
+        self.session_id = session_id
+        self.memory = ConversationBufferMemory(memory_key="chat_history", return_messages=True)
+        self.lock = threading.Lock()
+        self.async_lock = asyncio.Lock()
+        self.last_used = time.time()
+        # requests holding or waiting for the lock, the store never drops a session while this is above 0
+        self.users = 0
+        # how many of the messages came from the store's file, the rest were added by the current request
+        self.loaded = 0
+
+
+class MemorySessionStore(object):
+    """In-process sessions, least recently used ones are dropped past max_sessions or after ttl seconds idle.
+    A session a request is using is never dropped: the next request for it would get a new lock and empty memory."""
+
+    def __init__(self, max_sessions=10000, ttl=3600, max_messages=50):
+        self.max_sessions = max_sessions
+        self.ttl = ttl
+        self.max_messages = max_messages
+        self.sessions = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, session_id):
+        """The session for session_id, counted as in use until release is called."""
+        now = time.time()
+        with self.lock:
+            session = self.sessions.get(session_id)
+            if session is not None and session.users == 0 and now - session.last_used > self.ttl:
+                session = None
+            if session is None:
+                session = Session(session_id)
+                self.sessions[session_id] = session
+            session.last_used = now
+            session.users += 1
+            self.sessions.move_to_end(session_id)
+            self.evict()
+            return session
+
+    def release(self, session):
+        with self.lock:
+            session.users -= 1
+
+    def evict(self):
+        # oldest first, skipping sessions in use, so the store can briefly hold more than max_sessions
+        excess = len(self.sessions) - self.max_sessions
+        if excess <= 0:
+            return
+        idle = []
+        for session_id, session in self.sessions.items():
+            if len(idle) == excess:
+                break
+            if session.users == 0:
+                idle.append(session_id)
+        for session_id in idle:
+            del self.sessions[session_id]
+
+    @contextmanager
+    def session(self, session_id):
+        session = self.get(session_id)
+        try:
+            with session.lock:
+                self.refresh(session)
+                try:
+                    yield session
+                finally:
+                    self.save(session)
+        finally:
+            self.release(session)
+
+    @asynccontextmanager
+    async def async_session(self, session_id):
+        session = self.get(session_id)
+        try:
+            async with session.async_lock:
+                self.refresh(session)
+                try:
+                    yield session
+                finally:
+                    self.save(session)
+        finally:
+            self.release(session)
+
+    def refresh(self, session):
+        pass
+
+    def save(self, session):
+        # keep only the most recent messages so a long conversation cannot grow without bound
+        messages = session.memory.chat_memory.messages
+        if len(messages) > self.max_messages:
+            del messages[:-self.max_messages]
+        session.last_used = time.time()
+
+
+class SQLiteSessionStore(MemorySessionStore):
+    """Sessions kept in a SQLite file so they survive restarts and can be shared between workers.
+    Messages are reloaded from the file at the start of every request so each worker sees the others' writes.
+    The session lock only covers one process, so two workers can answer the same session at once; each save
+    then appends its own new messages to what is stored instead of overwriting it, and no turn is lost
+    (concurrent turns are kept in the order they finished)."""
+
+    def __init__(self, path, max_sessions=10000, ttl=3600, max_messages=50):
+        super().__init__(max_sessions, ttl, max_messages)
+        self.db_lock = threading.Lock()
+        # autocommit mode, save runs its own BEGIN IMMEDIATE transaction
+        self.db = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=30)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("""
+            CREATE TABLE IF NOT EXISTS sessions (
+                session_id TEXT PRIMARY KEY,
+                messages TEXT NOT NULL,
+                updated_at REAL NOT NULL
+            )
+        """)
+        self.db.execute("CREATE INDEX IF NOT EXISTS sessions_updated_at ON sessions (updated_at)")
+
+    def refresh(self, session):
+        # another worker may have answered since this process last saw the session
+        session.memory.chat_memory.messages = self.load(session.session_id)
+        session.loaded = len(session.memory.chat_memory.messages)
+
+    def load(self, session_id):
+        with self.db_lock:
+            return self.read(session_id)
+
+    def read(self, session_id):
+        row = self.db.execute("SELECT messages, updated_at FROM sessions WHERE session_id = ?", (session_id,)).fetchone()
+        if row is None or time.time() - row[1] > self.ttl:
+            return []
+        return messages_from_dict(json.loads(row[0]))
+
+    def save(self, session):
+        added = session.memory.chat_memory.messages[session.loaded:]
+        session.last_used = time.time()
+        with self.db_lock:
+            # BEGIN IMMEDIATE takes the write lock before the read, a worker saving the same session at the same time
+            # waits for this commit and then appends to it
+            self.db.execute("BEGIN IMMEDIATE")
+            try:
+                messages = (self.read(session.session_id) + added)[-self.max_messages:]
+                self.db.execute(
+                    "INSERT OR REPLACE INTO sessions (session_id, messages, updated_at) VALUES (?, ?, ?)",
+                    (session.session_id, json.dumps(messages_to_dict(messages)), session.last_used)
+                )
+                self.db.execute("DELETE FROM sessions WHERE updated_at < ?", (time.time() - self.ttl,))
+                self.db.execute("COMMIT")
+            except BaseException:
+                self.db.execute("ROLLBACK")
+                raise
+        session.memory.chat_memory.messages = messages
+        session.loaded = len(messages)
+
+
+def create_session_store():
+    """Pick the session store from the SESSION_* environment variables."""
+    max_sessions = int(os.getenv('SESSION_MAX_SESSIONS', '10000'))
+    ttl = float(os.getenv('SESSION_TTL', '3600'))
+    max_messages = int(os.getenv('SESSION_MAX_MESSAGES', '50'))
+
+    if os.getenv('SESSION_STORE', 'memory').lower() == 'sqlite':
+        return SQLiteSessionStore(os.getenv('SESSION_DB_PATH', 'sessions.db'), max_sessions, ttl, max_messages)
+    return MemorySessionStore(max_sessions, ttl, max_messages)
@@ -0,0 +1,106 @@
+import threading
+
+# words that strongly suggest the user is asking for a place to eat rather than something to cook
+RESTAURANT_HINTS = {
+    "restaurant", "restaurants", "resturant", "resturants", "place", "places",
+    "near", "nearby", "around", "delivery", "takeout", "dine", "dining", "bar", "cafe", "diner"
+}
+
+# words that strongly suggest the user is asking for something to cook
+RECIPE_HINTS = {
+    "recipe", "recipes", "cook", "make", "bake", "prepare", "ingredient", "ingredients", "dish"
+}
+
+# entity labels from the entity ruler that only make sense for recipe lookups
+RECIPE_LABELS = {"INGREDIENT", "CATEGORY", "DIET_LABEL"}
+
+
+# This function guesses which graph pipeline a query will end up in using only the local NER output
+# It has to be cheap since it runs while the LLM is still classifying the intent
+# Return value is 'find a recipe', 'find a restaurant' or None if there is no confident guess
+def predict_branch(doc):
+    tokens = {token.lower_ for token in doc}
+
+    if tokens & RESTAURANT_HINTS:
+        return 'find a restaurant'
+    if tokens & RECIPE_HINTS or any(ent.label_ in RECIPE_LABELS for ent in doc.ents):
+        return 'find a recipe'
+    return None
+
+
+class SpeculationStats(object):
+    """Thread safe counters describing how often speculative graph queries were actually used, and what the
+    discarded ones cost: the LLM and Neo4j calls they had made (or had in flight) before they were stopped."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.skipped = 0
+        self.wasted_llm_calls = 0
+        self.wasted_neo4j_calls = 0
+        self.wasted_seconds = 0.0
+
+    def record(self, outcome):
+        with self.lock:
+            if outcome == 'hit':
+                self.hits += 1
+            elif outcome == 'miss':
+                self.misses += 1
+            else:
+                self.skipped += 1
+
+    def record_waste(self, timings):
+        """timings: the metrics.RequestTimings of a discarded branch, once it has stopped."""
+        calls = timings.call_counts()
+        seconds = sum(timings.stage_seconds().values())
+        with self.lock:
+            self.wasted_llm_calls += calls.get('llm', 0)
+            self.wasted_neo4j_calls += calls.get('neo4j', 0)
+            self.wasted_seconds += seconds
+
+    def snapshot(self):
+        with self.lock:
+            attempts = self.hits + self.misses
+            return {
+                "attempts": attempts,
+                "hits": self.hits,
+                "misses": self.misses,
+                "skipped": self.skipped,
+                "hit_rate": self.hits / attempts if attempts else 0.0,
+                "wasted_llm_calls": self.wasted_llm_calls,
+                "wasted_neo4j_calls": self.wasted_neo4j_calls,
+                "wasted_seconds": round(self.wasted_seconds, 3),
+            }
+
+
+class Speculation(object):
+    """A graph query started before the global intent is known.
+    The branch counts its spans and calls on its own timings, they are added to the request's (request_timings)
+    only when the branch is used. cancelled tells a discarded branch to stop before its next LLM or Neo4j call."""
+
+    def __init__(self, graph_intent, timings, request_timings=None):
+        self.graph_intent = graph_intent
+        self.timings = timings
+        self.request_timings = request_timings
+        self.cancelled = threading.Event()
+        self.future = None
+
+    def resolve(self, global_intent, stats):
+        # use the speculative result if the classified intent matches, otherwise throw it away
+        if global_intent == self.graph_intent:
+            stats.record('hit')
+            return True
+        self.cancelled.set()
+        # only stops a branch that has not started yet, a running one stops at its next step
+        self.future.cancel()
+        stats.record('miss')
+        self.future.add_done_callback(lambda future: stats.record_waste(self.timings))
+        return False
+
+    def result(self):
+        try:
+            return self.future.result()
+        finally:
+            if self.request_timings is not None:
+                self.request_timings.merge(self.timings)
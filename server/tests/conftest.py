@@ -0,0 +1,7 @@
+import os
+import sys
+
+# the server modules are imported by bare name, as app.py does
+SERVER = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, SERVER)
+sys.path.insert(0, os.path.join(SERVER, "Recipe_Extraction_Scripts"))
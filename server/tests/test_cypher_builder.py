@@ -0,0 +1,68 @@
+import spacy
+from spacy.tokens import Span
+import NER
+from cypher_builder import RESULT_LIMIT, build_cypher, build_recipe_query, parse_allergies
+
+
+def recipe_doc(text, ingredients):
+    doc = spacy.blank("en")(text)
+    doc.ents = [Span(doc, i, i + 1, label="INGREDIENT") for i, token in enumerate(doc) if token.text in ingredients]
+    return doc
+
+
+def test_parse_allergies_splits_free_text():
+    assert parse_allergies(" Peanuts, shellfish ,, ") == ["peanuts", "shellfish"]
+    assert parse_allergies(["Egg", " "]) == ["egg"]
+    assert parse_allergies(None) == []
+
+
+def test_ingredients_and_allergies_are_parameters():
+    cypher, params = build_recipe_query({"ingredients": ["Rice", "chicken"], "allergies": "Peanut"})
+    assert "$ingredients" in cypher and "$allergies" in cypher
+    assert "rice" not in cypher
+    assert params == {"ingredients": ["chicken", "rice"], "allergies": ["peanut"], "limit": RESULT_LIMIT}
+
+
+def test_same_shape_gives_the_same_query_text():
+    first, _ = build_recipe_query({"category": ["Dessert"], "cuisine": ["Italian"]})
+    second, _ = build_recipe_query({"category": ["soup"], "cuisine": ["thai"]})
+    assert first == second
+
+
+def test_shapes_left_to_the_llm():
+    assert build_recipe_query({"ingredients": ["rice"], "diet": ["vegan"]}) is None
+    assert build_recipe_query({"ingredients": ["rice"], "time": ["20 minutes"]}) is None
+    assert build_recipe_query({"allergies": "peanut"}) is None
+    assert build_cypher("find a recipe", "not a dict") is None
+    assert build_cypher("greetings", {"ingredients": ["rice"]}) is None
+
+
+def test_restaurant_city_before_and_after_the_migration():
+    criteria = {"cuisine": "Pizza", "city": " Plano "}
+    cypher, params = build_cypher("find a restaurant", criteria)
+    assert "n.address" in cypher and params["city"] == "plano"
+    cypher, params = build_cypher("find a restaurant", criteria, located=True)
+    assert "toLower(n.city) = $city" in cypher
+    # restaurants the migration could not parse are still found by address
+    assert "n.city IS NULL AND toLower(n.address) CONTAINS $city" in cypher
+
+
+def test_restaurant_radius_needs_the_location_properties():
+    criteria = {"cuisine": [], "latitude": 33.0, "longitude": -96.7, "radius_miles": 2}
+    assert build_cypher("find a restaurant", criteria) is None
+    cypher, params = build_cypher("find a restaurant", criteria, located=True)
+    assert "point.distance(n.location" in cypher and "ORDER BY meters" in cypher
+    assert round(params["meters"]) == 3219
+
+
+def test_allergies_are_expanded_to_both_forms(monkeypatch):
+    monkeypatch.setattr(NER, "inflections", {
+        "peanut": ["peanut", "peanuts"], "peanuts": ["peanut", "peanuts"],
+        "chicken": ["chicken", "chickens"], "chickens": ["chicken", "chickens"],
+    })
+    criteria = NER.extract_recipe_criteria(recipe_doc("peanuts and chicken", {"peanuts", "chicken"}), "Peanuts, Shellfish")
+    assert criteria["allergies"] == ["peanut", "peanuts", "shellfish"]
+    # an ingredient the user is allergic to is not searched for
+    assert criteria["ingredients"] == ["chicken", "chickens"]
+    _, params = build_recipe_query(criteria)
+    assert "peanut" in params["allergies"] and "peanuts" in params["allergies"]
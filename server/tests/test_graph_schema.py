@@ -0,0 +1,59 @@
+import json
+import os
+import pytest
+
+pytest.importorskip("neo4j")
+pytest.importorskip("dotenv")
+from graph_schema import SCHEMA_SLICES, SchemaSlices, schema_slice
+
+SCHEMA_FILE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "benchmark", "fixtures", "schema.json")
+
+
+def structured_schema():
+    with open(SCHEMA_FILE, encoding="utf-8") as f:
+        return json.load(f)
+
+
+class FakeGraph(object):
+    def __init__(self):
+        self.get_structured_schema = structured_schema()
+        self.labels = ["Recipe", "Restaurant"]
+        self.fail = False
+
+    def query(self, cypher):
+        if self.fail:
+            raise ConnectionError("database unavailable")
+        return [{"kind": "label", "name": label} for label in self.labels]
+
+    def refresh_schema(self):
+        pass
+
+
+def test_slice_keeps_only_the_intent_labels():
+    text = schema_slice(structured_schema(), SCHEMA_SLICES["find a restaurant"])
+    assert "Restaurant {" in text and "Type {" in text
+    assert "Recipe" not in text and "Ingredient" not in text
+    assert "(:Restaurant)-[:HAS_TYPE]->(:Type)" in text
+    assert "_lower" not in text
+
+
+def test_failed_check_keeps_serving_the_slices():
+    graph = FakeGraph()
+    slices = SchemaSlices(graph, check_seconds=0)
+    assert slices.refresh()
+    recipe_schema = slices.get("find a recipe")
+
+    graph.fail = True
+    assert not slices.refresh()
+    assert slices.get("find a recipe") == recipe_schema
+
+    graph.fail = False
+    graph.labels.append("Chef")
+    assert slices.refresh()
+
+
+def test_first_build_failure_raises():
+    graph = FakeGraph()
+    graph.fail = True
+    with pytest.raises(ConnectionError):
+        SchemaSlices(graph).refresh()
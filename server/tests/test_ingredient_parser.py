@@ -0,0 +1,20 @@
+import pytest
+from Ingredient_parser import parse_line
+
+
+@pytest.mark.parametrize("line, name", [
+    ("1 tsp. salt", "salt"),
+    ("2 Tbsp. butter", "butter"),
+    ("3 oz. cheddar cheese", "cheddar cheese"),
+    ("1 lb. chicken", "chicken"),
+    ("1 c. sugar", "sugar"),
+    ("1 pkg. cream cheese, softened", "cream cheese"),
+    ("garlic, 2 cloves.", "garlic"),
+    ("1.5 cups flour", "flour"),
+])
+def test_abbreviated_units_are_stripped(line, name):
+    assert parse_line(line)[0] == name
+
+
+def test_section_header_names_no_ingredient():
+    assert parse_line("For the sauce:") == (None, 1.0)
@@ -0,0 +1,35 @@
+import pytest
+import spacy
+from spacy.tokens import Span
+from NER import PANTRY_PHRASES, extract_recipe_criteria
+
+
+@pytest.mark.parametrize("text", [
+    "What can I make with eggs, spinach and feta?",
+    "what could i cook with chicken and rice",
+    "I have tomatoes and basil in my fridge",
+    "there is some tofu in my pantry, any ideas?",
+    "Help me use up this zucchini",
+])
+def test_pantry_phrasings(text):
+    assert PANTRY_PHRASES.search(text)
+
+
+@pytest.mark.parametrize("text", [
+    "I have chicken, any curry recipes?",
+    "I only have an hour, find me a pasta recipe",
+    "I got a new wok, show me stir fry recipes",
+    "recipes for leftover turkey",
+    "what can I make for dinner tonight",
+    "a soup with carrots",
+])
+def test_searches_are_not_pantry_questions(text):
+    assert not PANTRY_PHRASES.search(text)
+
+
+def test_pantry_flag_needs_ingredients():
+    nlp = spacy.blank("en")
+    doc = nlp("what can I make with eggs in my fridge")
+    doc.ents = [Span(doc, 5, 6, label="INGREDIENT")]
+    assert extract_recipe_criteria(doc, "")["pantry"] is True
+    assert "pantry" not in extract_recipe_criteria(nlp("what can I make with what is in my fridge"), "")
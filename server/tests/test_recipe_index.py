@@ -0,0 +1,111 @@
+import random
+from fractions import Fraction
+import pytest
+from recipe_index import PANTRY_STAPLES, FacetIndex
+
+INGREDIENTS = ["egg", "flour", "milk", "rice", "chicken", "tomato", "basil", "garlic"] + PANTRY_STAPLES[:2]
+CATEGORIES = ["dessert", "dinner", "soup"]
+CUISINES = ["italian", "thai", "mexican"]
+
+
+def random_records(rng, recipes):
+    records = []
+    for n in rng.sample(range(1000), recipes):
+        records.append({
+            "name": f"recipe {n:03d}",
+            # some recipes get no ingredients at all
+            "ingredients": rng.sample(INGREDIENTS, rng.randint(0, 6)),
+            "categories": rng.sample(CATEGORIES, rng.randint(0, 2)),
+            "cuisines": rng.sample(CUISINES, rng.randint(0, 1)),
+        })
+    return records
+
+
+def some(rng, values, most):
+    return rng.sample(values, rng.randint(0, most))
+
+
+def brute_query(records, criteria, limit):
+    """What build_recipe_query's Cypher returns, recipe by recipe."""
+    rows = []
+    for record in records:
+        if criteria["category"] and not set(criteria["category"]) & set(record["categories"]):
+            continue
+        if criteria["cuisine"] and not set(criteria["cuisine"]) & set(record["cuisines"]):
+            continue
+        if set(criteria["allergies"]) & set(record["ingredients"]):
+            continue
+        matched = sorted(set(criteria["ingredients"]) & set(record["ingredients"]))
+        if criteria["ingredients"] and not matched:
+            continue
+        rows.append((-len(matched), record["name"], matched))
+    rows.sort(key=lambda row: row[:2])
+    if criteria["ingredients"]:
+        return [{"RecipeName": name, "MatchedIngredients": matched} for _, name, matched in rows[:limit]]
+    return [{"RecipeName": name} for _, name, _ in rows[:limit]]
+
+
+def brute_pantry(records, pantry, allergies, categories, cuisines, limit):
+    staples = set(PANTRY_STAPLES)
+    rows = []
+    for record in records:
+        ingredients = set(record["ingredients"])
+        if not ingredients & (set(pantry) - staples):
+            continue
+        if categories and not set(categories) & set(record["categories"]):
+            continue
+        if cuisines and not set(cuisines) & set(record["cuisines"]):
+            continue
+        if set(allergies) & ingredients:
+            continue
+        have = len(ingredients & (set(pantry) | staples))
+        rows.append((-Fraction(have, len(ingredients)), len(ingredients) - have, record["name"], {
+            "RecipeName": record["name"],
+            "Coverage": round(have / len(ingredients), 2),
+            "MatchedIngredients": sorted(ingredients & set(pantry)),
+            "MissingIngredients": sorted(ingredients - set(pantry) - staples),
+        }))
+    rows.sort(key=lambda row: row[:3])
+    return [row[3] for row in rows[:limit]]
+
+
+@pytest.mark.parametrize("seed", range(200))
+def test_query_and_pantry_match_brute_force(seed):
+    rng = random.Random(seed)
+    records = random_records(rng, rng.randint(0, 80))
+    index = FacetIndex.from_records(records)
+    limit = rng.choice([1, 3, 10])
+
+    criteria = {
+        "ingredients": some(rng, INGREDIENTS, 3),
+        "category": some(rng, CATEGORIES, 2),
+        "cuisine": some(rng, CUISINES, 1),
+        "allergies": some(rng, INGREDIENTS, 2),
+    }
+    rows = index.query(criteria, limit)
+    if not (criteria["ingredients"] or criteria["category"] or criteria["cuisine"]):
+        assert rows is None
+    else:
+        for row in rows:
+            row.get("MatchedIngredients", []).sort()
+        assert rows == brute_query(records, criteria, limit)
+
+    pantry = some(rng, INGREDIENTS, 5)
+    allergies, categories, cuisines = some(rng, INGREDIENTS, 1), some(rng, CATEGORIES, 1), some(rng, CUISINES, 1)
+    assert (index.pantry(pantry, allergies, categories, cuisines, limit)
+            == brute_pantry(records, pantry, allergies, categories, cuisines, limit))
+
+
+def test_empty_graph():
+    index = FacetIndex.from_records([])
+    assert index.query({"ingredients": ["egg"]}) == []
+    assert index.pantry(["egg"]) == []
+
+
+def test_recipe_without_ingredients_is_never_a_pantry_match():
+    index = FacetIndex.from_records([
+        {"name": "water", "ingredients": [], "categories": ["drink"], "cuisines": []},
+        {"name": "omelette", "ingredients": ["egg", "salt"], "categories": ["breakfast"], "cuisines": []},
+    ])
+    assert [row["RecipeName"] for row in index.pantry(["egg", "water"])] == ["omelette"]
+    assert index.query({"category": ["drink"]}) == [{"RecipeName": "water"}]
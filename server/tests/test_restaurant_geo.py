@@ -0,0 +1,34 @@
+import pytest
+from restaurant_geo import Centroids, geo_fields, located, parse_address
+
+LOCATION_INDEX = {"labelsOrTypes": ["Restaurant"], "properties": ["location"], "state": "ONLINE"}
+
+
+@pytest.mark.parametrize("address, expected", [
+    ("1901 Preston Rd, Plano, TX 75093", ("Plano", "TX", "75093")),
+    ("212 E 6th St, Austin, Texas 78701-1234, USA", ("Austin", "TX", "78701")),
+    ("900 E 11th St, AUSTIN, tx", ("Austin", "TX", None)),
+    ("3699 McKinney Ave, Dallas TX 75204", ("Dallas", "TX", "75204")),
+    ("10 Downing St, London SW1A 2AA, UK", (None, None, None)),
+    ("1722 Routh St, TX 75201", (None, "TX", "75201")),
+    ("somewhere downtown", (None, None, None)),
+    ("", (None, None, None)),
+    (None, (None, None, None)),
+])
+def test_parse_address(address, expected):
+    parsed = parse_address(address)
+    assert (parsed["city"], parsed["state"], parsed["postal_code"]) == expected
+
+
+def test_coordinates_in_the_row_win_over_centroids():
+    centroids = Centroids({"75093": (33.0, -96.8)}, {("plano", "TX"): (33.1, -96.7)})
+    assert geo_fields("1 Main St, Plano, TX 75093", centroids)["latitude"] == 33.0
+    assert geo_fields("1 Main St, Plano, TX", centroids)["latitude"] == 33.1
+    assert geo_fields("1 Main St, Plano, TX 75093", centroids, 32.5, -96.5)["latitude"] == 32.5
+
+
+def test_located_needs_the_index_and_located_restaurants():
+    assert located([LOCATION_INDEX], {"restaurants": 3, "with_city": 2, "with_location": 1})
+    assert not located([LOCATION_INDEX], {"restaurants": 3, "with_city": 0, "with_location": 0})
+    assert not located([dict(LOCATION_INDEX, state="POPULATING")], {"restaurants": 3, "with_city": 3, "with_location": 3})
+    assert not located([], {"restaurants": 3, "with_city": 3, "with_location": 3})
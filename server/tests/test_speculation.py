@@ -0,0 +1,63 @@
+import threading
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from speculation import Speculation, SpeculationStats
+
+
+class FakeTimings(object):
+    def __init__(self):
+        self.calls = Counter()
+        self.stages = Counter()
+
+    def call_counts(self):
+        return dict(self.calls)
+
+    def stage_seconds(self):
+        return dict(self.stages)
+
+    def merge(self, other):
+        self.calls.update(other.calls)
+        self.stages.update(other.stages)
+
+
+def branch(speculation, started, release):
+    # one LLM call, then the next step only runs if the branch is still wanted
+    speculation.timings.calls['llm'] += 1
+    speculation.timings.stages['cypher_generation'] += 0.5
+    started.set()
+    release.wait()
+    if speculation.cancelled.is_set():
+        return None
+    speculation.timings.calls['llm'] += 1
+    return "answer"
+
+
+def start(executor, request_timings):
+    speculation = Speculation('find a recipe', FakeTimings(), request_timings)
+    started, release = threading.Event(), threading.Event()
+    speculation.future = executor.submit(branch, speculation, started, release)
+    started.wait()
+    return speculation, release
+
+
+def test_hit_adds_the_branch_to_the_request():
+    stats, request_timings = SpeculationStats(), FakeTimings()
+    with ThreadPoolExecutor(1) as executor:
+        speculation, release = start(executor, request_timings)
+        assert speculation.resolve('find a recipe', stats)
+        release.set()
+        assert speculation.result() == "answer"
+    assert request_timings.calls['llm'] == 2
+    assert stats.snapshot()["hits"] == 1 and stats.snapshot()["wasted_llm_calls"] == 0
+
+
+def test_miss_stops_the_branch_and_counts_its_cost():
+    stats, request_timings = SpeculationStats(), FakeTimings()
+    with ThreadPoolExecutor(1) as executor:
+        speculation, release = start(executor, request_timings)
+        assert not speculation.resolve('find a restaurant', stats)
+        release.set()
+    snapshot = stats.snapshot()
+    assert snapshot["misses"] == 1
+    assert snapshot["wasted_llm_calls"] == 1 and snapshot["wasted_seconds"] == 0.5
+    assert request_timings.calls['llm'] == 0